@@ -3,6 +3,12 @@
 # 模型路徑
 BASE_MODEL_NAME = "Davlan/xlm-roberta-large-ner-hrl"
 LORA_MODEL_PATH = "./final_lora_model"
+# 蒸餾出嚟的細模型 (完整 HF 模型，PIIPipeline 可直接載入)
+STUDENT_MODEL_PATH = "./models/final_student_model"
+# 結構化剪枝後的模型 (完整 HF 模型，見 src/training/prune.py)
+PRUNED_MODEL_PATH = "./models/final_pruned_model"
+# 困難樣本挖掘訓練出嚟的 adapter (見 src/training/hard_mining.py)
+MINED_LORA_MODEL_PATH = "./models/final_lora_model_mined"
 
 # 標籤定義
 LABEL_LIST = [
@@ -30,4 +36,17 @@ BASE_FORBIDDEN = [
 
 # 推論參數
 MIN_SCORE_THRESHOLD = 0.45
-MAX_SEQ_LENGTH = 384
\ No newline at end of file
+MAX_SEQ_LENGTH = 384
+
+# 訓練數據快取 (Tokenized + 標籤對齊後的 Arrow 檔)
+DATASET_CACHE_DIR = "./cache/tokenized"
+# 凍結層 hidden states 快取 (fp16 memmap，見 src/training/activation_cache.py)
+ACTIVATION_CACHE_DIR = "./cache/activations"
+# 蒸餾用的 Teacher logits 快取 (fp16 memmap，見 src/training/distill.py)
+TEACHER_LOGITS_CACHE_DIR = "./cache/teacher_logits"
+# 模型原始實體快取 (PIIProcessor 之前，見 src/inference/rule_tuning.py)
+RAW_ENTITY_CACHE_DIR = "./cache/raw_entities"
+SPLIT_SEED = 42
+
+# 推論效能設定 (由 python -m src.inference.autotune 生成，PIIPipeline 啟動時自動讀取)
+AUTOTUNE_PROFILE_PATH = "./models/autotune_profile.json"
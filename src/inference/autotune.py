@@ -0,0 +1,224 @@
+import os
+import sys
+import time
+import argparse
+import importlib.util
+import multiprocessing as mp
+
+import numpy as np
+import torch
+
+# ===========================
+# 🔥 1. 路徑設定
+# ===========================
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.dirname(current_dir))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from src.config import LORA_MODEL_PATH, MAX_SEQ_LENGTH, AUTOTUNE_PROFILE_PATH
+from src.inference.pipeline import PIIPipeline
+from src.inference.inference import load_text_samples
+from src.inference.machine_profile import hardware_fingerprint, save_profile
+
+DEFAULT_SAMPLE = os.path.join(current_dir, "testdata.txt")
+
+
+# ===========================
+# 📏 2. 量度工具
+# ===========================
+def measure(pii_pipe, texts, batch_size):
+    """回傳吞吐量 (條/秒) 及每次調用的 p50 / p99 延遲 (ms)"""
+    latencies = []
+    start = time.perf_counter()
+    for i in range(0, len(texts), batch_size):
+        batch = texts[i:i + batch_size]
+        t0 = time.perf_counter()
+        pii_pipe.predict_batch(batch, batch_size=batch_size)
+        latencies.append(time.perf_counter() - t0)
+    total = time.perf_counter() - start
+    return _summarize(len(texts), total, latencies)
+
+def _summarize(count, seconds, latencies):
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "throughput": count / seconds if seconds > 0 else 0.0,
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+    }
+
+
+# ===========================
+# 👷 3. 多進程量度 (每個 worker 一份模型)
+# ===========================
+_worker_pipe = None
+_worker_barrier = None
+
+def _init_worker(model_path, backend, max_seq_length, num_threads, barrier):
+    global _worker_pipe, _worker_barrier
+    _worker_pipe = PIIPipeline(
+        model_path=model_path, backend=backend, max_seq_length=max_seq_length,
+        num_threads=num_threads, use_profile=False
+    )
+    _worker_barrier = barrier
+
+def _wait_ready(_):
+    # 每個 worker 剛好攞一個，全部載入完先一齊放行
+    _worker_barrier.wait()
+    return os.getpid()
+
+def _run_batch(args):
+    batch, batch_size = args
+    t0 = time.perf_counter()
+    _worker_pipe.predict_batch(batch, batch_size=batch_size)
+    return time.perf_counter() - t0
+
+def measure_workers(model_path, texts, settings, workers):
+    """以 workers 個進程 (各自 cores // workers 線程) 量度整體吞吐量，不計模型載入時間"""
+    ctx = mp.get_context("spawn")
+    barrier = ctx.Barrier(workers)
+    num_threads = max(1, (os.cpu_count() or 1) // workers)
+    init_args = (model_path, settings["backend"], settings["max_seq_length"], num_threads, barrier)
+
+    batch_size = settings["batch_size"]
+    jobs = [(texts[i:i + batch_size], batch_size) for i in range(0, len(texts), batch_size)]
+
+    with ctx.Pool(workers, initializer=_init_worker, initargs=init_args) as pool:
+        pool.map(_wait_ready, range(workers), chunksize=1)
+        start = time.perf_counter()
+        latencies = pool.map(_run_batch, jobs, chunksize=1)
+        total = time.perf_counter() - start
+
+    result = _summarize(len(texts), total, latencies)
+    result["num_threads"] = num_threads
+    return result
+
+
+# ===========================
+# 🚀 4. Sweep
+# ===========================
+def _unique_positive(values):
+    return sorted({v for v in values if v and v > 0}, reverse=True)
+
+def default_grid():
+    cores = os.cpu_count() or 1
+    backends = ["eager", "int8"]
+    if importlib.util.find_spec("optimum") is not None:
+        backends.append("onnx")
+    return {
+        "backend": backends,
+        "num_threads": _unique_positive([cores, cores // 2, cores // 4]),
+        "batch_size": [1, 4, 8, 16, 32],
+        "max_seq_length": [128, 256, MAX_SEQ_LENGTH],
+        "workers": [w for w in (1, 2, 4) if w <= cores],
+    }
+
+def autotune(texts, grid, model_path=LORA_MODEL_PATH, objective="throughput"):
+    """
+    依次掃描 backend x max_seq_length x num_threads x batch_size (單進程)，
+    再用最佳組合量度多進程 workers。回傳 (單進程最佳設定, 多進程建議或 None, 全部結果)。
+    """
+    def score(result):
+        return result["throughput"] if objective == "throughput" else -result["p99_ms"]
+
+    results = []
+    for backend in grid["backend"]:
+        pii_pipe = PIIPipeline(model_path=model_path, backend=backend, use_profile=False)
+        if pii_pipe.backend != backend:
+            print(f"⏭️ backend {backend} 不可用，跳過。")
+            continue
+
+        for max_seq_length in grid["max_seq_length"]:
+            pii_pipe.set_max_seq_length(max_seq_length)
+            for num_threads in grid["num_threads"]:
+                torch.set_num_threads(num_threads)
+                # 預熱一次，避免第一次調用的初始化成本影響結果
+                pii_pipe.predict_batch(texts[:1], batch_size=1)
+                for batch_size in grid["batch_size"]:
+                    settings = {
+                        "backend": backend, "max_seq_length": max_seq_length,
+                        "num_threads": num_threads, "batch_size": batch_size, "workers": 1,
+                    }
+                    result = {**settings, **measure(pii_pipe, texts, batch_size)}
+                    results.append(result)
+                    print(f"📊 {settings} -> {result['throughput']:.2f} 條/秒 | "
+                          f"p50 {result['p50_ms']:.1f} ms | p99 {result['p99_ms']:.1f} ms")
+        del pii_pipe
+
+    if not results:
+        raise RuntimeError("❌ 沒有任何可用的設定組合")
+
+    best = max(results, key=score)
+
+    # 多進程：沿用最佳單進程設定，線程數平分給每個 worker。
+    # 結果只係建議 (multi_worker)，唔會改寫單進程的 num_threads：
+    # 只有明確以 PIIPipeline(workers=N) 運行的進程先會按 cores // N 分線程
+    best_multi = None
+    for workers in grid["workers"]:
+        if workers <= 1:
+            continue
+        settings = {k: best[k] for k in ("backend", "max_seq_length", "batch_size")}
+        result = {**settings, "workers": workers, **measure_workers(model_path, texts, settings, workers)}
+        results.append(result)
+        print(f"📊 workers={workers} -> {result['throughput']:.2f} 條/秒 | p99 {result['p99_ms']:.1f} ms")
+        if score(result) > score(best_multi or best):
+            best_multi = result
+
+    settings = {
+        "backend": best["backend"],
+        "num_threads": best["num_threads"],
+        "batch_size": best["batch_size"],
+        "max_seq_length": best["max_seq_length"],
+    }
+    multi_worker = None
+    if best_multi:
+        multi_worker = {
+            "workers": best_multi["workers"],
+            "num_threads_per_worker": best_multi["num_threads"],
+            "throughput": best_multi["throughput"],
+            "single_process_throughput": best["throughput"],
+        }
+    return settings, multi_worker, results
+
+
+# ===========================
+# 🧪 命令列入口
+# ===========================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="掃描 PIIPipeline 推論設定並生成本機效能設定檔")
+    parser.add_argument("--sample", default=DEFAULT_SAMPLE, help="代表性樣本 (.txt / .json)")
+    parser.add_argument("--max-samples", type=int, default=200)
+    parser.add_argument("--model-path", default=LORA_MODEL_PATH)
+    parser.add_argument("--output", default=AUTOTUNE_PROFILE_PATH)
+    parser.add_argument("--objective", choices=["throughput", "p99"], default="throughput")
+    parser.add_argument("--backends", nargs="+", default=None)
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=None)
+    parser.add_argument("--threads", nargs="+", type=int, default=None)
+    parser.add_argument("--seq-lengths", nargs="+", type=int, default=None)
+    parser.add_argument("--workers", nargs="+", type=int, default=None)
+    cli_args = parser.parse_args()
+
+    grid = default_grid()
+    overrides = {
+        "backend": cli_args.backends, "batch_size": cli_args.batch_sizes,
+        "num_threads": cli_args.threads, "max_seq_length": cli_args.seq_lengths,
+        "workers": cli_args.workers,
+    }
+    grid.update({k: v for k, v in overrides.items() if v})
+
+    fingerprint, hardware = hardware_fingerprint()
+    print(f"🖥️ 硬件指紋: {fingerprint} {hardware}")
+    print(f"🔧 掃描範圍: {grid}")
+
+    texts = load_text_samples(cli_args.sample)[:cli_args.max_samples]
+    best_settings, multi_worker, all_results = autotune(
+        texts, grid, model_path=cli_args.model_path, objective=cli_args.objective
+    )
+
+    save_profile(best_settings, all_results, path=cli_args.output, model_path=cli_args.model_path,
+                 multi_worker=multi_worker)
+    print(f"\n✅ 單進程最佳設定: {best_settings}")
+    if multi_worker:
+        print(f"💡 多進程更快: {multi_worker['workers']} 個 worker 共 {multi_worker['throughput']:.2f} 條/秒，"
+              f"每個 worker 用 PIIPipeline(workers={multi_worker['workers']}) 啟動")
+    print(f"📁 已寫入 {cli_args.output}，PIIPipeline 載入同一模型時會自動套用 (硬件指紋或模型權重改變後需重新執行)。")
@@ -0,0 +1,138 @@
+import os
+import sys
+import types
+import threading
+from collections import Counter
+
+import torch
+from torch import nn
+from transformers.modeling_outputs import TokenClassifierOutput
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.dirname(current_dir))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+# ===========================
+# 🚪 Early-exit 推論 (按信心提早離開 encoder)
+# ===========================
+# 大部分流量嘅 token 好早已經肯定係 O，唔使行晒 24 層：
+# - 喺中間層 (預設每 4 層) 加一個輕量分類頭 (Linear)，由最後分類頭蒸餾訓練
+#   (見 src/training/train_early_exit.py)，分類頭檔案存喺模型資料夾的 early_exit_heads.pt
+# - 推論時逐層計；去到有分類頭的層，如果整個 batch 每個真實 token 的最大機率都 >= threshold，
+#   就直接用呢層的 logits，否則繼續下一層
+# - 記錄每次 forward 喺第幾層離開，用嚟報告平均深度
+#
+# 用法：PIIPipeline(early_exit=0.9)
+
+EXIT_HEADS_NAME = "early_exit_heads.pt"
+
+
+class EarlyExitHeads(nn.Module):
+    """中間層分類頭 + 門檻 + 離開深度統計"""
+
+    def __init__(self, hidden_size, num_labels, exit_layers, threshold=0.9):
+        super().__init__()
+        self.exit_layers = list(exit_layers)
+        self.threshold = threshold
+        self.heads = nn.ModuleDict({str(layer): nn.Linear(hidden_size, num_labels) for layer in self.exit_layers})
+        self.exit_counts = Counter()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_classifier(cls, model, exit_layers, threshold=0.9):
+        """每個分類頭都由最後的分類頭初始化 (起點已經接近)"""
+        heads = cls(model.config.hidden_size, model.config.num_labels, exit_layers, threshold)
+        for head in heads.heads.values():
+            head.load_state_dict(model.classifier.state_dict())
+        return heads.to(model.device)
+
+    def forward(self, layer, hidden_states):
+        return self.heads[str(layer)](hidden_states)
+
+    def record(self, depth):
+        with self._lock:
+            self.exit_counts[depth] += 1
+
+    def reset_stats(self):
+        with self._lock:
+            self.exit_counts.clear()
+
+    def stats(self):
+        with self._lock:
+            total = sum(self.exit_counts.values())
+            mean = sum(depth * n for depth, n in self.exit_counts.items()) / total if total else 0.0
+            return {"forwards": total, "mean_exit_depth": round(mean, 2),
+                    "exit_histogram": dict(sorted(self.exit_counts.items()))}
+
+    def save(self, path):
+        torch.save({
+            "hidden_size": next(iter(self.heads.values())).in_features,
+            "num_labels": next(iter(self.heads.values())).out_features,
+            "exit_layers": self.exit_layers,
+            "threshold": self.threshold,
+            "state_dict": self.state_dict(),
+        }, path)
+
+    @classmethod
+    def load(cls, path, threshold=None):
+        payload = torch.load(path, map_location="cpu")
+        heads = cls(payload["hidden_size"], payload["num_labels"], payload["exit_layers"],
+                    threshold if threshold is not None else payload["threshold"])
+        heads.load_state_dict(payload["state_dict"])
+        return heads.eval()
+
+
+def early_exit_forward(self, input_ids=None, attention_mask=None, token_type_ids=None, labels=None, **kwargs):
+    """取代 XLMRobertaForTokenClassification.forward；逐層計算，信心足夠就提早返回"""
+    heads = self.early_exit_heads
+    encoder = self.base_model
+    if attention_mask is None:
+        attention_mask = torch.ones_like(input_ids)
+    real_tokens = attention_mask.bool()
+    num_layers = len(encoder.encoder.layer)
+
+    hidden_states = encoder.embeddings(input_ids=input_ids, token_type_ids=token_type_ids)
+    extended_mask = self.get_extended_attention_mask(attention_mask, input_ids.shape)
+    logits, depth = None, num_layers
+    for index, layer in enumerate(encoder.encoder.layer):
+        outputs = layer(hidden_states, attention_mask=extended_mask)
+        hidden_states = outputs[0] if isinstance(outputs, tuple) else outputs
+        if index + 1 in heads.exit_layers and index + 1 < num_layers:
+            exit_logits = heads(index + 1, hidden_states)
+            confidence = exit_logits.softmax(dim=-1).max(dim=-1).values
+            if bool((confidence[real_tokens] >= heads.threshold).all()):
+                logits, depth = exit_logits, index + 1
+                break
+    if logits is None:
+        logits = self.classifier(self.dropout(hidden_states))
+    heads.record(depth)
+
+    loss = None
+    if labels is not None:
+        loss = nn.functional.cross_entropy(logits.view(-1, logits.size(-1)), labels.view(-1), ignore_index=-100)
+    return TokenClassifierOutput(loss=loss, logits=logits)
+
+
+def enable_early_exit(model, heads):
+    """將分類頭掛上模型並換走 forward (HF pipeline 照用同一個模型物件)"""
+    model.early_exit_heads = heads.to(model.device)
+    model.forward = types.MethodType(early_exit_forward, model)
+    return model
+
+
+def disable_early_exit(model):
+    if "forward" in model.__dict__:
+        del model.forward
+    if hasattr(model, "early_exit_heads"):
+        del model.early_exit_heads
+    return model
+
+
+def load_early_exit(model, model_path, threshold=None):
+    path = os.path.join(model_path, EXIT_HEADS_NAME)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"搵唔到 early-exit 分類頭: {path} (請先執行 python -m src.training.train_early_exit)")
+    heads = EarlyExitHeads.load(path, threshold)
+    print(f"🚪 Early-exit 已啟用 (離開層: {heads.exit_layers}, threshold {heads.threshold})")
+    return enable_early_exit(model, heads)
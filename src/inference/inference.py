@@ -15,6 +15,32 @@ if project_root not in sys.path:
 # 🔥 2. 使用我們剛寫好的 Pipeline 類別
 from src.inference.pipeline import PIIPipeline
 
+def load_text_samples(path):
+    """
+    讀取測試文字：
+    - .json：list 或 {"data": [...]}
+    - .txt ：每行一條 (兼容 testdata.txt 的 "...", 格式)
+    """
+    path = Path(path)
+    if path.suffix == ".json":
+        with open(path, "r", encoding="utf-8") as f:
+            raw_input = json.load(f)
+        return raw_input.get("data", []) if isinstance(raw_input, dict) else raw_input
+
+    texts = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip().rstrip(",")
+            if not line:
+                continue
+            if line.startswith('"'):
+                try:
+                    line = json.loads(line)
+                except json.JSONDecodeError:
+                    line = line.strip('"')
+            texts.append(line)
+    return texts
+
 def run_inference():
     print("🚀 [1/3] Initializing PII Pipeline...")
     
@@ -0,0 +1,123 @@
+import os
+import sys
+import json
+import hashlib
+import platform
+
+# ===========================
+# 🔥 1. 路徑設定
+# ===========================
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.dirname(current_dir))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from src.config import AUTOTUNE_PROFILE_PATH
+
+
+def _cpu_model_name():
+    try:
+        with open("/proc/cpuinfo", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or "unknown"
+
+
+def _total_memory_gb():
+    try:
+        pages = os.sysconf("SC_PHYS_PAGES")
+        page_size = os.sysconf("SC_PAGE_SIZE")
+        return round(pages * page_size / (1024 ** 3))
+    except (ValueError, OSError, AttributeError):
+        return 0
+
+
+def hardware_fingerprint():
+    """
+    硬件指紋：CPU 型號、核心數、記憶體、系統及 torch 版本。
+    指紋一變 (換機 / 升級 torch) 就需要重新 autotune。
+    """
+    try:
+        import torch
+        torch_version = torch.__version__
+        has_cuda = torch.cuda.is_available()
+    except ImportError:
+        torch_version, has_cuda = "none", False
+
+    info = {
+        "cpu": _cpu_model_name(),
+        "machine": platform.machine(),
+        "cores": os.cpu_count(),
+        "memory_gb": _total_memory_gb(),
+        "system": platform.system(),
+        "torch": torch_version,
+        "cuda": has_cuda,
+    }
+    digest = hashlib.sha256(json.dumps(info, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    return digest, info
+
+
+def model_hash(model_path):
+    """以權重檔的名稱、大小及修改時間識別模型 (重新訓練 / 換模型後自動唔同)"""
+    entries = []
+    if os.path.isdir(model_path):
+        for name in sorted(os.listdir(model_path)):
+            if name.endswith((".safetensors", ".bin", ".pt")):
+                stat = os.stat(os.path.join(model_path, name))
+                entries.append([name, stat.st_size, int(stat.st_mtime)])
+    return hashlib.sha256(json.dumps([os.path.abspath(model_path), entries]).encode("utf-8")).hexdigest()[:16]
+
+
+def load_profile(path=AUTOTUNE_PROFILE_PATH, model_path=None, workers=1):
+    """
+    讀取與本機指紋 (及 model_path 的權重) 相符的設定；冇檔案或唔相符則回傳 None。
+    workers > 1：作為 N 個進程之一運行，線程數按 autotune 的多進程建議平分 (每個 worker cores // N)；
+    單進程 (預設) 一律用單進程的最佳設定。
+    """
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            profile = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"⚠️ 無法讀取 Autotune 設定檔 {path}: {e}")
+        return None
+
+    fingerprint, _ = hardware_fingerprint()
+    if profile.get("fingerprint") != fingerprint:
+        print(f"⚠️ Autotune 設定檔的硬件指紋與本機不符，將使用預設設定 (請重新執行 autotune)。")
+        return None
+    if model_path is not None and profile.get("model") != model_hash(model_path):
+        print(f"⚠️ Autotune 設定檔唔係為 {model_path} 現時的權重調校，將使用預設設定 (請重新執行 autotune)。")
+        return None
+
+    settings = dict(profile.get("settings") or {})
+    if workers > 1:
+        settings.update({
+            "num_threads": max(1, (os.cpu_count() or 1) // workers),
+            "num_interop_threads": 1,
+        })
+    return settings
+
+
+def save_profile(settings, results=None, path=AUTOTUNE_PROFILE_PATH, model_path=None, multi_worker=None):
+    """settings = 單進程最佳設定；multi_worker = 多進程建議 (workers 數及吞吐量)，只作參考"""
+    fingerprint, info = hardware_fingerprint()
+    profile = {
+        "fingerprint": fingerprint,
+        "hardware": info,
+        "model": model_hash(model_path) if model_path else None,
+        "model_path": os.path.abspath(model_path) if model_path else None,
+        "settings": settings,
+        "multi_worker": multi_worker,
+        "results": results or [],
+    }
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(profile, f, ensure_ascii=False, indent=2)
+    return profile
@@ -0,0 +1,326 @@
+import os
+import sys
+import time
+import argparse
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from transformers import AutoTokenizer, AutoModelForTokenClassification
+from peft import PeftModel
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.dirname(current_dir))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from src.config import BASE_MODEL_NAME, LABEL2ID, ID2LABEL
+from src.inference.pipeline import PIIPipeline
+
+# ===========================
+# 🔀 多 Adapter 服務 (一個 Base Model，多個 LoRA 熱插拔)
+# ===========================
+# A/B 測試唔同版本的 adapter，以前每個版本都要一個完整 PIIPipeline (各自載入 + 合併 2 GB base)。
+# 呢度：
+# - Base Model 只載入一次，adapter 以「未合併」形式登記 (每個只多幾 MB：LoRA 矩陣 + 分類頭)
+# - 每個請求 / batch 按名路由：PEFT 的 adapter_names 參數逐句揀 adapter，唔使切換全局狀態
+# - PEFT 套用 adapter_names 的方法係喺 forward 期間暫時喺共用的 LoRA 層加 hook，
+#   兩個線程同時 forward 會互相疊 hook (結果錯亂)，所以 forward 要排隊：多線程安全，但唔會並行
+# - 運行中 load_adapter / unload_adapter，唔使重啟；改動模型結構時用寫鎖等現有請求完成。
+#   替換同名 adapter 時先用新名載入，成功先切換，載入失敗舊版本照用
+# 代價：未合併的 LoRA 每層多兩次細矩陣乘法，單一 adapter 的 latency 比合併版略高。
+#
+# 用法：
+#   pipe = MultiAdapterPipeline({"latest": "models/final_lora_model_latest",
+#                                "v1": "models/final_lora_model_news_novel_v1"})
+#   pipe.predict(text, adapter="v1")
+#   pipe.load_adapter("v2", "models/final_lora_model_v2"); pipe.unload_adapter("v1")
+
+
+class ReadWriteLock:
+    """
+    多個讀者 (推論請求) 可同時進入；寫者 (載入 / 卸載 adapter) 獨佔。
+    讀鎖可以喺同一線程重入 (predict -> run_model)：重入唔再排隊，否則等緊的寫者會令佢死鎖。
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._local = threading.local()
+
+    @contextmanager
+    def read(self):
+        if getattr(self._local, "depth", 0):
+            self._local.depth += 1
+            try:
+                yield
+            finally:
+                self._local.depth -= 1
+            return
+        with self._cond:
+            while self._writing:
+                self._cond.wait()
+            self._readers += 1
+        self._local.depth = 1
+        try:
+            yield
+        finally:
+            self._local.depth = 0
+            with self._cond:
+                self._readers -= 1
+                self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            while self._writing:
+                self._cond.wait()
+            self._writing = True
+            while self._readers:
+                self._cond.wait()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+
+class MultiAdapterPipeline(PIIPipeline):
+    def __init__(self, adapters, default_adapter=None, base_model_name=BASE_MODEL_NAME, **kwargs):
+        """
+        adapters：{名稱: adapter 資料夾}，第一個 (或 default_adapter) 為預設。
+        其餘參數同 PIIPipeline；只支援 eager backend (未合併的 LoRA 唔可以量化 / 匯出 ONNX)。
+        """
+        if not adapters:
+            raise ValueError("最少要登記一個 adapter")
+        if kwargs.get("backend") not in (None, "eager"):
+            print(f"⚠️ 多 Adapter 模式只支援 eager backend，已忽略 {kwargs['backend']}。")
+        kwargs.pop("early_exit", None)
+        self._initial_adapters = dict(adapters)
+        self.default_adapter = default_adapter or next(iter(adapters))
+        self.base_model_name = base_model_name
+        # 對外名稱 -> PEFT 入面的 adapter 名 (熱替換時新版本用另一個內部名載入，再切換)
+        self._internal_names = {}
+        self._revision = 0
+        self._rw_lock = ReadWriteLock()
+        self._forward_lock = threading.Lock()
+        self._adapter_local = threading.local()
+        self.request_counts = Counter()
+        self._count_lock = threading.Lock()
+        super().__init__(model_path=self._initial_adapters[self.default_adapter], **{**kwargs, "backend": "eager"})
+
+    def _load_model(self, model_path):
+        try:
+            self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+        except Exception:
+            print("⚠️ Adapter 資料夾找不到 Tokenizer，改用 Base Model 的 Tokenizer。")
+            self.tokenizer = AutoTokenizer.from_pretrained(self.base_model_name)
+
+        print(f"⚙️ 正在初始化共用 Base Model ({self.base_model_name})...")
+        base_model = AutoModelForTokenClassification.from_pretrained(
+            self.base_model_name,
+            num_labels=len(LABEL2ID),
+            id2label=ID2LABEL,
+            label2id=LABEL2ID,
+            ignore_mismatched_sizes=True
+        )
+        self.model = PeftModel.from_pretrained(base_model, model_path, adapter_name=self.default_adapter)
+        self._internal_names[self.default_adapter] = self.default_adapter
+        self._report_adapter(self.default_adapter)
+        for name, path in self._initial_adapters.items():
+            if name != self.default_adapter:
+                self._add_adapter(name, path, name)
+        # 每次 forward 前按當前線程的路由注入 adapter_names
+        self.model.register_forward_pre_hook(self._inject_adapter_names, with_kwargs=True)
+
+    # ===========================
+    # 🔌 Adapter 管理
+    # ===========================
+    @property
+    def adapters(self):
+        return list(self._internal_names)
+
+    def _resolve(self, name):
+        if name not in self._internal_names:
+            raise KeyError(f"未登記的 adapter: {name} (已登記: {self.adapters})")
+        return self._internal_names[name]
+
+    def adapter_size_mb(self, name):
+        """呢個 adapter 額外佔用的記憶體 (LoRA 矩陣 + 自己一份分類頭)"""
+        internal = self._resolve(name)
+        total = sum(p.numel() * p.element_size() for n, p in self.model.named_parameters() if f".{internal}." in n)
+        return total / 1024 / 1024
+
+    def _report_adapter(self, name):
+        print(f"🔌 已登記 adapter '{name}' (+{self.adapter_size_mb(name):.2f} MB)")
+
+    def _add_adapter(self, name, path, internal):
+        self.model.load_adapter(path, adapter_name=internal)
+        self.model.eval()
+        self._internal_names[name] = internal
+        self._report_adapter(name)
+
+    def load_adapter(self, name, path):
+        """
+        運行中載入新 adapter (同名即替換)。
+        替換時新版本先用另一個內部名載入，成功先切換再刪舊版本：載入失敗唔會令呢個名消失，
+        而且唯一一個 adapter 都可以替換 (PEFT 唔准刪走最後一個 adapter)。
+        """
+        with self._rw_lock.write():
+            old = self._internal_names.get(name)
+            internal = name
+            if old is not None:
+                self._revision += 1
+                internal = f"{name}__r{self._revision}"
+            self._add_adapter(name, path, internal)
+            if old is not None:
+                self._delete_internal(old)
+
+    def unload_adapter(self, name):
+        if name == self.default_adapter:
+            raise ValueError(f"唔可以卸載預設 adapter '{name}'，請先用 set_default_adapter 換走")
+        with self._rw_lock.write():
+            self._delete_internal(self._resolve(name))
+            del self._internal_names[name]
+        print(f"🔌 已卸載 adapter '{name}'")
+
+    def _delete_internal(self, internal):
+        self.model.delete_adapter(internal)
+        # delete_adapter 可能會改動 active adapter；路由靠 adapter_names，唔受影響
+        self.model.set_adapter(self._internal_names[self.default_adapter])
+
+    def set_default_adapter(self, name):
+        self._resolve(name)
+        self.default_adapter = name
+
+    # ===========================
+    # 🔀 路由
+    # ===========================
+    def _inject_adapter_names(self, module, args, kwargs):
+        name = getattr(self._adapter_local, "adapter", None) or self.default_adapter
+        input_ids = kwargs.get("input_ids", args[0] if args else None)
+        kwargs["adapter_names"] = [self._internal_names[name]] * input_ids.shape[0]
+        return args, kwargs
+
+    @contextmanager
+    def use_adapter(self, name=None):
+        """呢個 context 入面，當前線程的所有推論都用指定 adapter"""
+        name = name or self.default_adapter
+        with self._rw_lock.read():
+            self._resolve(name)
+            previous = getattr(self._adapter_local, "adapter", None)
+            self._adapter_local.adapter = name
+            try:
+                yield name
+            finally:
+                self._adapter_local.adapter = previous
+
+    def run_model(self, inputs, adapter=None, **kwargs):
+        """
+        直接呼叫 run_model 的地方 (StreamingMasker、rule_tuning) 都要持讀鎖，唔會同 load / unload 撞；
+        未指定 adapter 就沿用當前線程 use_adapter 的路由 (冇就用預設)。
+        forward 用 _forward_lock 排隊：PEFT 的 adapter_names hook 係掛喺共用模組上面，唔可以重疊。
+        """
+        adapter = adapter or getattr(self._adapter_local, "adapter", None)
+        with self.use_adapter(adapter), self._forward_lock:
+            return super().run_model(inputs, **kwargs)
+
+    def predict(self, text, adapter=None):
+        with self.use_adapter(adapter) as name:
+            self._count(name, 1)
+            return super().predict(text)
+
+    def predict_batch(self, texts, batch_size=None, adapter=None):
+        texts = list(texts)
+        with self.use_adapter(adapter) as name:
+            self._count(name, len(texts))
+            return super().predict_batch(texts, batch_size=batch_size)
+
+    def _count(self, name, n):
+        with self._count_lock:
+            self.request_counts[name] += n
+
+
+# ===========================
+# 🧪 冒煙測試 (細模型 + 兩個唔同的 adapter，多線程結果要同各自合併的模型一致)
+# ===========================
+def _result_key(result):
+    return result["masked"], [(e["entity_group"], e["start"], e["end"]) for e in result["entities"]]
+
+
+def smoke_test(threads=6, calls=20):
+    import torch
+    from concurrent.futures import ThreadPoolExecutor
+    from src.training.smoke_fixtures import toy_workspace
+    from src.training.train_lora import build_lora_model
+
+    with toy_workspace() as ws:
+        # 兩個 adapter：LoRA 矩陣及分類頭都加唔同的隨機擾動，輸出先會明顯唔同
+        references = {}
+        for seed, name in enumerate(("a", "b")):
+            torch.manual_seed(seed)
+            model = build_lora_model(ws.model_path)
+            with torch.no_grad():
+                for param in model.parameters():
+                    if param.requires_grad:
+                        param.add_(torch.randn_like(param) * 0.5)
+            model.save_pretrained(ws.path(name))
+            merged_dir = ws.path(f"merged_{name}")
+            model.merge_and_unload().save_pretrained(merged_dir)
+            AutoTokenizer.from_pretrained(ws.model_path).save_pretrained(merged_dir)
+            references[name] = PIIPipeline(model_path=merged_dir, backend="eager", use_profile=False)
+
+        texts = [ws.sample_text(i * 7, 6 + i % 5) for i in range(calls)]
+        expected = {name: [_result_key(ref.predict(t)) for t in texts] for name, ref in references.items()}
+        assert expected["a"] != expected["b"], "兩個 adapter 輸出一樣，測試冇意義"
+
+        pipe = MultiAdapterPipeline({"a": ws.path("a"), "b": ws.path("b")}, base_model_name=ws.model_path,
+                                    use_profile=False)
+
+        def worker(index):
+            wrong = 0
+            for i, text in enumerate(texts):
+                name = "ab"[(index + i) % 2]
+                wrong += _result_key(pipe.predict(text, adapter=name)) != expected[name][i]
+            return wrong
+
+        with ThreadPoolExecutor(threads) as pool:
+            wrong = sum(pool.map(worker, range(threads)))
+        print(f"📊 {threads} 線程 x {calls} 次 predict：{wrong} 個結果同合併模型唔一致")
+        assert wrong == 0
+
+        # 熱替換唯一同名 adapter：新版本生效，名一直都解析到
+        solo = MultiAdapterPipeline({"a": ws.path("a")}, base_model_name=ws.model_path, use_profile=False)
+        solo.load_adapter("a", ws.path("b"))
+        assert solo.adapters == ["a"]
+        assert [_result_key(solo.predict(t)) for t in texts] == expected["b"]
+    print("✅ 冒煙測試通過")
+
+
+# ===========================
+# 🧪 測試區塊 (比較記憶體及各 adapter 的結果)
+# ===========================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="一個 Base Model 同時服務多個 LoRA adapter")
+    parser.add_argument("--adapter", nargs=2, action="append", metavar=("NAME", "PATH"),
+                        help="可重複，例如 --adapter latest models/final_lora_model_latest")
+    parser.add_argument("--text", default="Li Ka-shing resides at 12/F, Man Yee Building. ID: R123456(7)")
+    parser.add_argument("--smoke-test", action="store_true", help="細模型多線程路由測試")
+    cli_args = parser.parse_args()
+    if cli_args.smoke_test:
+        smoke_test()
+        sys.exit(0)
+
+    adapters = dict(cli_args.adapter or [
+        ("latest", "models/final_lora_model_latest"),
+        ("news_novel_v1", "models/final_lora_model_news_novel_v1"),
+    ])
+    pipe = MultiAdapterPipeline(adapters, use_profile=False)
+    base_mb = sum(p.numel() * p.element_size() for p in pipe.model.get_base_model().parameters()) / 1024 / 1024
+    print(f"\n📦 模型總記憶體: {base_mb:.0f} MB (包括 {len(pipe.adapters)} 個 adapter)")
+    for name in pipe.adapters:
+        start = time.perf_counter()
+        result = pipe.predict(cli_args.text, adapter=name)
+        print(f"[{name}] ({(time.perf_counter() - start) * 1000:.0f} ms) {result['masked']}")
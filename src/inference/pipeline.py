@@ -1,6 +1,9 @@
 import torch
 import os
 import sys
+import copy
+import shutil
+import threading
 from transformers import AutoTokenizer, AutoModelForTokenClassification, pipeline
 from peft import PeftModel
 
@@ -15,26 +18,96 @@ if project_root not in sys.path:
 # 🔥 關鍵：必須匯入 LABEL2ID 等設定，告訴模型有幾個標籤
 from src.config import LORA_MODEL_PATH, BASE_MODEL_NAME, LABEL2ID, ID2LABEL
 from src.inference.processor import PIIProcessor
+from src.inference.machine_profile import load_profile, model_hash
+from src.inference.early_exit import load_early_exit
+
+SUPPORTED_BACKENDS = ("eager", "int8", "onnx")
+# onnx_merged 入面記錄匯出時的模型權重 hash
+ONNX_STAMP_NAME = "source_model_hash.txt"
 
 class PIIPipeline:
-    def __init__(self, model_path=LORA_MODEL_PATH, device=None):
+    def __init__(self, model_path=LORA_MODEL_PATH, device=None, num_threads=None, num_interop_threads=None,
+                 backend=None, max_seq_length=None, batch_size=None, use_profile=True, early_exit=None,
+                 workers=1):
         """
         初始化 PII Pipeline：負責正確載入 Base Model + LoRA Adapter
+        (model_path 冇 adapter_config.json 時當作完整模型載入，例如蒸餾出嚟的 student)
+
+        多線程：同一個 PIIPipeline 可以被多個 thread 同時調用 predict / predict_batch。
+        合併後的模型權重共用一份，每個 thread 有自己的 Tokenizer 及 HF pipeline，
+        所有 forward 都喺 torch.inference_mode() 之下執行。
+        num_threads / num_interop_threads 控制 torch 的 intra-op / inter-op 線程數。
+
+        效能設定：backend ("eager" / "int8" / "onnx")、max_seq_length (長文分段長度)、
+        batch_size (predict_batch 預設值)。未指定的參數會自動從 autotune 設定檔補上
+        (只限硬件指紋及模型權重都相符，見 src/inference/autotune.py)。
+        workers：呢個進程係 N 個 worker 之一時傳入 N，設定檔的線程數會按 cores // N 平分。
+
+        early_exit：threshold (例如 0.9)，啟用中間層提早離開 (需要模型資料夾有 early_exit_heads.pt，
+        見 src/inference/early_exit.py)；平均離開深度用 early_exit_stats() 查詢。
         """
         if device is None:
             device = 0 if torch.cuda.is_available() else -1
+        self.device = device
+
+        # 0. 自動套用 autotune 設定 (明確傳入的參數優先)
+        profile = load_profile(model_path=model_path, workers=workers) if use_profile else None
+        if profile:
+            print(f"⚡ 已載入 Autotune 設定: {profile}")
+            num_threads = num_threads or profile.get("num_threads")
+            num_interop_threads = num_interop_threads or profile.get("num_interop_threads")
+            backend = backend or profile.get("backend")
+            max_seq_length = max_seq_length or profile.get("max_seq_length")
+            batch_size = batch_size or profile.get("batch_size")
+
+        self.backend = backend or "eager"
+        if self.backend not in SUPPORTED_BACKENDS:
+            raise ValueError(f"不支援的 backend: {self.backend} (可選: {SUPPORTED_BACKENDS})")
+        self.max_seq_length = max_seq_length
+        self.batch_size = batch_size or 16
+        self.configure_threads(num_threads, num_interop_threads)
             
         print(f"📂 正在從 {model_path} 載入模型...")
         
         try:
-            # 1. 載入 Tokenizer
-            # 優先嘗試從 LoRA 資料夾載入，失敗則從 Base Model 載入
-            try:
-                self.tokenizer = AutoTokenizer.from_pretrained(model_path)
-            except:
-                print("⚠️ LoRA 資料夾找不到 Tokenizer，改用 Base Model 的 Tokenizer。")
-                self.tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL_NAME)
+            self._load_model(model_path)
+            self.model.eval()
+
+            # 🔥 4. 切換推論 Backend (int8 動態量化 / ONNX Runtime)
+            self._apply_backend(model_path)
+
+            # 🔥 5. Early-exit (只支援 PyTorch backend)
+            self.early_exit = None
+            if early_exit:
+                if self.backend == "onnx":
+                    print("⚠️ ONNX backend 唔支援 early-exit，已略過。")
+                else:
+                    self.model = load_early_exit(self.model, model_path, threshold=early_exit)
+                    self.early_exit = self.model.early_exit_heads
 
+        except Exception as e:
+            print(f"❌ 模型載入失敗: {e}")
+            print("💡 請確認 src/config.py 裡的 LABEL2ID 是否與訓練時一致。")
+            raise e
+        
+        # 建立 HuggingFace Pipeline (主線程使用；其他線程各自建立，見 _get_nlp_pipeline)
+        self._default_model_max_length = self.tokenizer.model_max_length
+        self.nlp_pipeline = self._build_nlp_pipeline(self.tokenizer)
+        self._owner_thread = threading.get_ident()
+        self._local = threading.local()
+        print(f"✅ 模型載入成功！(Device: {'GPU' if device==0 else 'CPU'})")
+
+    def _load_model(self, model_path):
+        """載入 self.tokenizer 及 self.model (LoRA adapter 會合併入 Base Model)"""
+        # 1. 載入 Tokenizer
+        # 優先嘗試從 LoRA 資料夾載入，失敗則從 Base Model 載入
+        try:
+            self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+        except:
+            print("⚠️ LoRA 資料夾找不到 Tokenizer，改用 Base Model 的 Tokenizer。")
+            self.tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL_NAME)
+
+        if os.path.exists(os.path.join(model_path, "adapter_config.json")):
             # 🔥 2. 關鍵修正：先載入 Base Model，並強制指定標籤數量 (解決 Size Mismatch)
             print(f"⚙️ 正在初始化 Base Model ({BASE_MODEL_NAME}) 並設定 {len(LABEL2ID)} 個標籤...")
             base_model = AutoModelForTokenClassification.from_pretrained(
@@ -49,28 +122,120 @@ class PIIPipeline:
             print("🔗 正在疊加 LoRA 權重...")
             self.model = PeftModel.from_pretrained(base_model, model_path)
             self.model = self.model.merge_and_unload() # 合併權重，提升推論速度
+        else:
+            # 完整模型 (例如 src/training/distill.py 蒸餾出嚟的 student)：直接載入
+            print("⚙️ 正在載入完整模型 (非 LoRA adapter)...")
+            self.model = AutoModelForTokenClassification.from_pretrained(model_path)
 
-        except Exception as e:
-            print(f"❌ 模型載入失敗: {e}")
-            print("💡 請確認 src/config.py 裡的 LABEL2ID 是否與訓練時一致。")
-            raise e
-        
-        # 建立 HuggingFace Pipeline
-        self.nlp_pipeline = pipeline(
+    @staticmethod
+    def configure_threads(num_threads=None, num_interop_threads=None):
+        """設定 torch intra-op / inter-op 線程數 (None = 保持預設)"""
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        if num_interop_threads:
+            try:
+                torch.set_num_interop_threads(num_interop_threads)
+            except RuntimeError as e:
+                # inter-op 線程池一經啟動就不能再改
+                print(f"⚠️ 無法設定 inter-op 線程數: {e}")
+
+    def _apply_backend(self, model_path):
+        if self.backend == "int8":
+            if self.device != -1:
+                print("⚠️ int8 動態量化只支援 CPU，改用 eager backend。")
+                self.backend = "eager"
+                return
+            print("⚙️ 正在進行 int8 動態量化 (nn.Linear)...")
+            self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+        elif self.backend == "onnx":
+            self.model = self._load_onnx_model(model_path)
+
+    def _load_onnx_model(self, model_path):
+        try:
+            from optimum.onnxruntime import ORTModelForTokenClassification
+        except ImportError:
+            print("⚠️ 未安裝 optimum[onnxruntime]，改用 eager backend。")
+            self.backend = "eager"
+            return self.model
+
+        onnx_dir = os.path.join(model_path, "onnx_merged")
+        stamp_path = os.path.join(onnx_dir, ONNX_STAMP_NAME)
+        stamp = model_hash(model_path)
+        exported = None
+        if os.path.exists(stamp_path):
+            with open(stamp_path, "r", encoding="utf-8") as f:
+                exported = f.read().strip()
+        if not os.path.exists(os.path.join(onnx_dir, "model.onnx")) or exported != stamp:
+            # 先將合併後的模型存成普通 HF 格式，再匯出 ONNX；權重一變 (重新訓練) 就重新匯出
+            if os.path.exists(onnx_dir):
+                print("♻️ 模型權重已更新，舊的 ONNX 匯出作廢。")
+                shutil.rmtree(onnx_dir, ignore_errors=True)
+            print(f"⚙️ 正在匯出 ONNX 模型至 {onnx_dir}...")
+            export_dir = onnx_dir + "_export"
+            self.model.save_pretrained(export_dir)
+            self.tokenizer.save_pretrained(export_dir)
+            ort_model = ORTModelForTokenClassification.from_pretrained(export_dir, export=True)
+            ort_model.save_pretrained(onnx_dir)
+            shutil.rmtree(export_dir, ignore_errors=True)
+            # 最後先寫 stamp：匯出中途失敗，下次會重新匯出
+            with open(stamp_path, "w", encoding="utf-8") as f:
+                f.write(stamp)
+        return ORTModelForTokenClassification.from_pretrained(onnx_dir)
+
+    def _build_nlp_pipeline(self, tokenizer):
+        extra_params = {}
+        tokenizer.model_max_length = self.max_seq_length or self._default_model_max_length
+        if self.max_seq_length:
+            # 長文按 max_seq_length 分段，段與段之間重疊 1/4 避免實體被切斷
+            extra_params["stride"] = self.max_seq_length // 4
+        return pipeline(
             "token-classification", 
             model=self.model, 
-            tokenizer=self.tokenizer, 
+            tokenizer=tokenizer, 
             aggregation_strategy="simple",
-            device=device
+            device=self.device,
+            **extra_params
         )
-        print(f"✅ 模型載入成功！(Device: {'GPU' if device==0 else 'CPU'})")
+
+    def set_max_seq_length(self, max_seq_length):
+        """運行中更改分段長度 (會重建所有線程的 HF pipeline)"""
+        self.max_seq_length = max_seq_length
+        self.nlp_pipeline = self._build_nlp_pipeline(self.tokenizer)
+        self._local = threading.local()
+
+    def _get_nlp_pipeline(self):
+        """
+        每個 thread 一個 HF pipeline + Tokenizer 副本 (Fast Tokenizer 的內部狀態並非線程安全)，
+        模型權重仍然共用。
+        """
+        if threading.get_ident() == self._owner_thread:
+            return self.nlp_pipeline
+        nlp_pipeline = getattr(self._local, "nlp_pipeline", None)
+        if nlp_pipeline is None:
+            nlp_pipeline = self._build_nlp_pipeline(copy.deepcopy(self.tokenizer))
+            self._local.nlp_pipeline = nlp_pipeline
+        return nlp_pipeline
+
+    def early_exit_stats(self, reset=False):
+        """回傳 {forwards, mean_exit_depth, exit_histogram}；未啟用 early-exit 時回傳 None"""
+        if self.early_exit is None:
+            return None
+        stats = self.early_exit.stats()
+        if reset:
+            self.early_exit.reset_stats()
+        return stats
+
+    def run_model(self, inputs, **kwargs):
+        """只跑模型 (未經 PIIProcessor)，線程安全，並關閉 autograd 紀錄"""
+        with torch.inference_mode():
+            return self._get_nlp_pipeline()(inputs, **kwargs)
 
     def predict(self, text):
         """
         輸入文字，回傳：原文、遮蓋後文字、實體列表
         """
         # 1. AI 推論
-        raw_results = self.nlp_pipeline(text)
+        raw_results = self.run_model(text)
         
         # 2. 後處理 (Processor Class)
         processor = PIIProcessor(text, raw_results)
@@ -83,6 +248,30 @@ class PIIPipeline:
             "entities": final_entities
         }
 
+    def predict_batch(self, texts, batch_size=None):
+        """
+        批量版 predict：模型一次過處理 batch_size 條文字，回傳與 predict 相同格式的列表
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+        batch_size = batch_size or self.batch_size
+
+        # 1. AI 推論 (HF pipeline 支援 list 輸入 + batch_size)
+        raw_batch = self.run_model(texts, batch_size=batch_size)
+
+        # 2. 逐條後處理
+        results = []
+        for text, raw_results in zip(texts, raw_batch):
+            processor = PIIProcessor(text, raw_results)
+            final_entities = processor.process()
+            results.append({
+                "original": text,
+                "masked": processor.get_masked_text(),
+                "entities": final_entities
+            })
+        return results
+
 # ===========================
 # 🧪 測試區塊
 # ===========================
@@ -1,6 +1,23 @@
 import re
 from collections import defaultdict
 
+class NumberedTagRegistry:
+    """
+    [LABEL-n] 編號表：同一 (標籤, 原文) 永遠得到同一個編號。
+    可以跨多段文字共用 (串流 / 分塊處理時保持編號一致)。
+    """
+
+    def __init__(self):
+        self.type_counts = defaultdict(int)
+        self.entity_value_map = {}
+
+    def get_tag(self, label, word):
+        key = (label, word.strip().lower())
+        if key not in self.entity_value_map:
+            self.type_counts[label] += 1
+            self.entity_value_map[key] = self.type_counts[label]
+        return f"{label}-{self.entity_value_map[key]}"
+
 class PIIProcessor:
     # =========================================================================
     # 🔧 1. Configuration & Rules (配置中心 - 業務邏輯集中管理)
@@ -58,6 +75,9 @@ class PIIProcessor:
         "ACCOUNT": r'(?<!\d)\d{3}[-\s]?\d{3,6}[-\s]?\d{3,}(?!\d)'
     }
 
+    # URL 排除規則 (網址內的字串不作遮蓋)
+    URL_PATTERN = r'https?://[^\s,]+'
+
     # =========================================================================
     # ⚙️ 2. Initialization & Helpers
     # =========================================================================
@@ -68,8 +88,7 @@ class PIIProcessor:
         self.url_ranges = self._get_url_ranges()
 
     def _get_url_ranges(self):
-        url_pattern = r'https?://[^\s,]+'
-        return [match.span() for match in re.finditer(url_pattern, self.text)]
+        return [match.span() for match in re.finditer(self.URL_PATTERN, self.text)]
 
     def _is_in_forbidden_range(self, start, end):
         for r_start, r_end in self.url_ranges:
@@ -315,19 +334,9 @@ class PIIProcessor:
         """
         Assigns consistent numbered tags.
         """
-        type_counts = defaultdict(int)
-        entity_value_map = {}
-
+        registry = NumberedTagRegistry()
         for ent in self.entities:
-            label = ent['entity_group']
-            clean_word = ent['word'].strip().lower()
-            key = (label, clean_word)
-
-            if key not in entity_value_map:
-                type_counts[label] += 1
-                entity_value_map[key] = type_counts[label]
-            
-            ent['numbered_tag'] = f"{label}-{entity_value_map[key]}"
+            ent['numbered_tag'] = registry.get_tag(ent['entity_group'], ent['word'])
 
     # =========================================================================
     # 🚀 4. Execution Pipeline
@@ -352,13 +361,18 @@ class PIIProcessor:
         self.assign_numbered_tags()
         return self.entities
 
+    @staticmethod
+    def format_tag(original_word, numbered_tag):
+        """將實體原文替換為 [LABEL-n] 標籤，保留前後空格"""
+        prefix = " " if original_word.startswith(" ") else ""
+        suffix = " " if original_word.endswith(" ") else ""
+        return f"{prefix}[{numbered_tag}]{suffix}"
+
     def get_masked_text(self):
         masked = self.text
         for ent in sorted(self.entities, key=lambda x: x['start'], reverse=True):
             if ent['end'] <= ent['start']: continue
             original_word = self.text[ent['start']:ent['end']]
-            prefix = " " if original_word.startswith(" ") else ""
-            suffix = " " if original_word.endswith(" ") else ""
-            tag = f"{prefix}[{ent['numbered_tag']}]{suffix}"
+            tag = self.format_tag(original_word, ent['numbered_tag'])
             masked = masked[:ent['start']] + tag + masked[ent['end']:]
         return masked
\ No newline at end of file
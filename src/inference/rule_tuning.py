@@ -0,0 +1,263 @@
+import os
+import sys
+import copy
+import gzip
+import json
+import time
+import hashlib
+import argparse
+import itertools
+import multiprocessing as mp
+from collections import Counter
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.dirname(current_dir))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+# 呢個模組會喺 spawn 出嚟的 worker 重新 import：唔好喺頂層 import torch / PIIPipeline
+from src.config import LORA_MODEL_PATH, ID2LABEL, RAW_ENTITY_CACHE_DIR
+from src.inference.processor import PIIProcessor
+from src.inference.machine_profile import model_hash
+
+# ===========================
+# 🎛️ 後處理規則調校 (模型結果快取 + PIIProcessor 重播)
+# ===========================
+# 改 PIIProcessor 的參數 (DEFAULT_CONFIDENCE、MERGE_GAP_TOLERANCE、LABEL_PRIORITY、INFRA_SUFFIXES...)
+# 唔使再跑模型：
+# 1. 用 PIIPipeline 跑一次驗證文字，HF pipeline 的原始實體 (未經 PIIProcessor) 壓縮存入
+#    cache/raw_entities/<key>.json.gz，key = 模型權重 + 文字 + backend / 分段長度
+# 2. 每組參數只重播 PIIProcessor，同 gold 比較 span 級 (標籤 + 起迄位置完全一致) P/R/F1
+# 3. 參數組合以多進程平行計算
+#
+# Gold 用訓練數據格式 (tokens + ner_tags)，自動還原成文字及字元位置。
+#
+# 用法：
+#   python -m src.inference.rule_tuning --gold eval.json \
+#       --grid '{"DEFAULT_CONFIDENCE": [0.2, 0.3, 0.4], "MERGE_GAP_TOLERANCE.ORG": [1, 2]}'
+# 參數名有 "." 即係改 dict 入面其中一項；INFRA_SUFFIXES 等 list 參數，候選值就係 list 的 list。
+
+REPORT_NAME = "rule_tuning_report.json"
+CACHE_VERSION = 1
+
+
+# ===========================
+# 📄 1. Gold 數據
+# ===========================
+def _joins_with_space(prev_char, next_char):
+    return prev_char.isascii() and prev_char.isalnum() and next_char.isascii() and next_char.isalnum()
+
+
+def tokens_to_text(tokens, tags):
+    """tokens + BIO 標籤 -> (文字, [(標籤, start, end)])；兩個英數 token 之間補返空格"""
+    text, spans, current = "", [], None
+    for token, tag in zip(tokens, tags):
+        if text and token and _joins_with_space(text[-1], token[0]):
+            text += " "
+        start = len(text)
+        text += token
+        label = ID2LABEL[tag]
+        if label == "O":
+            current = None
+        elif label.startswith("B-") or current is None or current[0] != label[2:]:
+            current = [label[2:], start, len(text)]
+            spans.append(current)
+        else:
+            current[2] = len(text)
+    return text, [tuple(s) for s in spans]
+
+
+def load_gold(path):
+    with open(path, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+    data = raw["data"] if isinstance(raw, dict) and "data" in raw else raw
+    samples = []
+    for item in data:
+        text, spans = tokens_to_text(item["tokens"], item["ner_tags"])
+        if text:
+            samples.append({"text": text, "gold": spans})
+    return samples
+
+
+# ===========================
+# 💾 2. 模型原始結果快取
+# ===========================
+def raw_cache_key(model_path, texts, backend, max_seq_length):
+    payload = {
+        "version": CACHE_VERSION,
+        "model": model_hash(model_path),
+        "texts": hashlib.sha256("\n\0".join(texts).encode("utf-8")).hexdigest(),
+        "backend": backend,
+        "max_seq_length": max_seq_length,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()[:24]
+
+
+def _compact(entities):
+    return [[e["entity_group"], round(float(e["score"]), 5), e["word"], int(e["start"]), int(e["end"])]
+            for e in entities]
+
+
+def _expand(compact):
+    return [{"entity_group": g, "score": s, "word": w, "start": b, "end": e} for g, s, w, b, e in compact]
+
+
+def load_or_run_model(texts, model_path=LORA_MODEL_PATH, backend="eager", max_seq_length=None, batch_size=16,
+                      cache_dir=RAW_ENTITY_CACHE_DIR):
+    """回傳每條文字的原始實體 (PIIProcessor 之前)；有快取就直接讀"""
+    key = raw_cache_key(model_path, texts, backend, max_seq_length)
+    path = os.path.join(cache_dir, f"{key}.json.gz")
+    if os.path.exists(path):
+        print(f"⚡ 使用已快取的模型結果: {path}")
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return [_expand(item) for item in json.load(f)["entities"]]
+
+    from src.inference.pipeline import PIIPipeline
+    pii_pipe = PIIPipeline(model_path=model_path, backend=backend, max_seq_length=max_seq_length, use_profile=False)
+    print(f"🤖 正在用模型處理 {len(texts)} 條文字 (只需一次)...")
+    start = time.perf_counter()
+    raw = pii_pipe.run_model(texts, batch_size=batch_size)
+    elapsed = time.perf_counter() - start
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        json.dump({"model_path": os.path.abspath(model_path), "model_seconds": round(elapsed, 2),
+                   "entities": [_compact(entities) for entities in raw]}, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    print(f"💾 已快取至 {path} (模型用咗 {elapsed:.1f}s)")
+    return [_expand(_compact(entities)) for entities in raw]
+
+
+# ===========================
+# 🔁 3. 參數組合 + 重播
+# ===========================
+def expand_grid(grid):
+    """{參數: [候選值]} -> [{參數: 值}, ...] (全組合)"""
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[n] for n in names))]
+
+
+def processor_class(params):
+    """按參數生成 PIIProcessor 子類 ("A.B" = 改 dict 屬性 A 入面的 B)"""
+    attrs = {}
+    for name, value in params.items():
+        attr, _, key = name.partition(".")
+        if not hasattr(PIIProcessor, attr):
+            raise AttributeError(f"PIIProcessor 冇呢個參數: {attr}")
+        if key:
+            attrs.setdefault(attr, copy.deepcopy(getattr(PIIProcessor, attr)))[key] = value
+        else:
+            attrs[attr] = value
+    return type("TunedPIIProcessor", (PIIProcessor,), attrs)
+
+
+def span_scores(predicted, gold):
+    """predicted / gold：每條文字一個 {(標籤, start, end)} 集合"""
+    tp, pred_count, gold_count = Counter(), Counter(), Counter()
+    for pred_spans, gold_spans in zip(predicted, gold):
+        for span in pred_spans:
+            pred_count[span[0]] += 1
+        for span in gold_spans:
+            gold_count[span[0]] += 1
+        for span in pred_spans & gold_spans:
+            tp[span[0]] += 1
+
+    def prf(t, p, g):
+        precision = t / p if p else 0.0
+        recall = t / g if g else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        return {"precision": round(precision, 4), "recall": round(recall, 4), "f1": round(f1, 4)}
+
+    labels = sorted(set(pred_count) | set(gold_count))
+    return {
+        **prf(sum(tp.values()), sum(pred_count.values()), sum(gold_count.values())),
+        "per_label": {l: {**prf(tp[l], pred_count[l], gold_count[l]), "support": gold_count[l]} for l in labels},
+    }
+
+
+def replay(params, texts, raw_entities, gold):
+    cls = processor_class(params)
+    predicted = []
+    for text, entities in zip(texts, raw_entities):
+        # PIIProcessor 會直接改動實體 dict，每組參數都要用新副本
+        result = cls(text, copy.deepcopy(entities)).process()
+        predicted.append({(e["entity_group"], e["start"], e["end"]) for e in result})
+    return span_scores(predicted, gold)
+
+
+_worker_data = None
+
+def _init_worker(texts, raw_entities, gold):
+    global _worker_data
+    _worker_data = (texts, raw_entities, gold)
+
+def _replay_one(params):
+    return params, replay(params, *_worker_data)
+
+
+def sweep(configs, texts, raw_entities, gold, workers=None):
+    """每組參數一個任務，以 spawn 進程池平行重播"""
+    workers = max(1, min(workers or os.cpu_count() or 1, len(configs)))
+    if workers == 1:
+        return [(params, replay(params, texts, raw_entities, gold)) for params in configs]
+    ctx = mp.get_context("spawn")
+    with ctx.Pool(workers, initializer=_init_worker, initargs=(texts, raw_entities, gold)) as pool:
+        return pool.map(_replay_one, configs, chunksize=max(1, len(configs) // (workers * 4)))
+
+
+def format_report(rows, top=10):
+    lines = ["| # | 參數 | P | R | F1 |", "|---|---|---|---|---|"]
+    for i, r in enumerate(rows[:top], 1):
+        params = ", ".join(f"{k}={json.dumps(v, ensure_ascii=False)}" for k, v in r["params"].items()) or "(預設)"
+        lines.append(f"| {i} | {params} | {r['precision']:.4f} | {r['recall']:.4f} | {r['f1']:.4f} |")
+    return "\n".join(lines)
+
+
+def tune(gold_path, grid, model_path=LORA_MODEL_PATH, backend="eager", max_seq_length=None, workers=None,
+         cache_dir=RAW_ENTITY_CACHE_DIR, output=REPORT_NAME, top=10):
+    samples = load_gold(gold_path)
+    texts = [s["text"] for s in samples]
+    gold = [set(s["gold"]) for s in samples]
+    raw_entities = load_or_run_model(texts, model_path, backend, max_seq_length, cache_dir=cache_dir)
+
+    # 第一行永遠係現有預設參數，方便比較
+    configs = [{}] + [c for c in expand_grid(grid) if c]
+    print(f"🎛️ 重播 {len(configs)} 組參數 x {len(texts)} 條文字...")
+    start = time.perf_counter()
+    results = sweep(configs, texts, raw_entities, gold, workers)
+    elapsed = time.perf_counter() - start
+
+    rows = [{"params": params, **scores} for params, scores in results]
+    baseline = rows[0]
+    rows.sort(key=lambda r: r["f1"], reverse=True)
+    report = {"baseline": baseline, "best": rows[0], "rows": rows, "texts": len(texts),
+              "configs": len(configs), "replay_seconds": round(elapsed, 2)}
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print("\n" + format_report(rows, top))
+    print(f"\n📊 預設參數 F1 {baseline['f1']:.4f} -> 最佳 F1 {rows[0]['f1']:.4f} {rows[0]['params']}")
+    print(f"✅ 重播用咗 {elapsed:.1f}s，報告: {output}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="快取模型結果，只重播 PIIProcessor 調校規則參數")
+    parser.add_argument("--gold", required=True, help="有標註的驗證數據 (tokens + ner_tags JSON)")
+    parser.add_argument("--grid", default="{}", help="JSON 字串或檔案：{參數: [候選值, ...]}")
+    parser.add_argument("--model", default=LORA_MODEL_PATH)
+    parser.add_argument("--backend", default="eager")
+    parser.add_argument("--max-seq-length", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None, help="預設 = CPU 核心數")
+    parser.add_argument("--output", default=REPORT_NAME)
+    parser.add_argument("--top", type=int, default=10)
+    cli_args = parser.parse_args()
+
+    if os.path.exists(cli_args.grid):
+        with open(cli_args.grid, "r", encoding="utf-8") as f:
+            param_grid = json.load(f)
+    else:
+        param_grid = json.loads(cli_args.grid)
+    tune(cli_args.gold, param_grid, model_path=cli_args.model, backend=cli_args.backend,
+         max_seq_length=cli_args.max_seq_length, workers=cli_args.workers, output=cli_args.output, top=cli_args.top)
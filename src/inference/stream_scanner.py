@@ -0,0 +1,164 @@
+import os
+import re
+import sys
+import time
+import argparse
+from bisect import bisect_left, insort
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:  # pragma: no cover
+    import sre_parse
+
+# ===========================
+# 🔥 1. 路徑設定
+# ===========================
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.dirname(current_dir))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from src.inference.processor import PIIProcessor, NumberedTagRegistry
+
+
+class RegexStreamScanner:
+    """
+    大型純文字 Log 的串流遮蓋器 (只用 PIIProcessor.REGEX_PATTERNS，不經模型)。
+
+    以固定大小的 chunk 讀入，保留一段 overlap 邊界 (按最長 pattern 計算)，
+    只有確定不會再變的前綴才會寫出，記憶體用量與檔案大小無關。
+    """
+
+    # 預設每次讀取的字元數
+    DEFAULT_CHUNK_SIZE = 1 << 20
+
+    # 無上限量詞 (如 \d{3,}、[^\s,]+) 的長度上限，避免 overlap 無限大
+    MAX_MATCH_LENGTH = 256
+
+    # 必需字元提示：buffer 入面冇呢個字元就唔使跑該 regex (EMAIL 係最慢嘅 pattern)
+    REQUIRED_CHARS = {"EMAIL": "@"}
+
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE, patterns=None, max_match_length=None):
+        self.chunk_size = chunk_size
+        self.max_match_length = max_match_length or self.MAX_MATCH_LENGTH
+        patterns = patterns if patterns is not None else PIIProcessor.REGEX_PATTERNS
+
+        # 預先編譯 (保留 REGEX_PATTERNS 的順序：先到先得，與 apply_regex_fallback 一致)
+        self.compiled = [(label, re.compile(p)) for label, p in patterns.items()]
+        self.url_regex = re.compile(PIIProcessor.URL_PATTERN)
+
+        # overlap：最長的可能匹配長度；context：保留給 lookbehind / URL 判斷的左側文字
+        widths = [self._max_width(p) for p in list(patterns.values()) + [PIIProcessor.URL_PATTERN]]
+        # +1：lookahead (如 (?!\d)) 需要多睇一個字元先可以確定
+        self.overlap = max(widths) + 1
+        self.context = self.overlap
+
+        # 跨 chunk 共用的編號表 (與 assign_numbered_tags 同一規則)
+        self.tags = NumberedTagRegistry()
+        self.stats = {"chars": 0, "entities": 0, "seconds": 0.0}
+
+    def _max_width(self, pattern):
+        try:
+            width = sre_parse.parse(pattern).getwidth()[1]
+        except Exception:
+            return self.max_match_length
+        return min(width, self.max_match_length)
+
+    @staticmethod
+    def _overlaps(ranges, start, end):
+        """ranges 為已排序且互不重疊的區間，用二分搜尋檢查 [start, end) 是否相交"""
+        idx = bisect_left(ranges, (start,))
+        if idx > 0 and ranges[idx - 1][1] > start:
+            return True
+        return idx < len(ranges) and ranges[idx][0] < end
+
+    def _find_matches(self, buffer, committed):
+        """在 buffer[committed:] 搵出所有 regex 實體 (已排除 URL 及互相重疊)"""
+        url_ranges = [m.span() for m in self.url_regex.finditer(buffer)]
+        accepted = []
+        for label, regex in self.compiled:
+            required = self.REQUIRED_CHARS.get(label)
+            if required and required not in buffer:
+                continue
+            # pos=committed：lookbehind 仍然可以睇到左側 context
+            for match in regex.finditer(buffer, committed):
+                start, end = match.span()
+                if self._overlaps(url_ranges, start, end) or self._overlaps(accepted, start, end):
+                    continue
+                insort(accepted, (start, end, label))
+        return accepted
+
+    def _flush(self, buffer, committed, final):
+        """
+        遮蓋 buffer[committed:] 中已確定的部分。
+        回傳 (輸出文字, 新的 committed 位置)
+        """
+        safe_end = len(buffer) if final else max(committed, len(buffer) - self.overlap)
+        pieces = []
+        cursor = committed
+        for start, end, label in self._find_matches(buffer, committed):
+            if start >= safe_end:
+                break
+            word = buffer[start:end]
+            pieces.append(buffer[cursor:start])
+            pieces.append(PIIProcessor.format_tag(word, self.tags.get_tag(label, word)))
+            cursor = end
+            self.stats["entities"] += 1
+        # 最後一個實體可能跨過 safe_end，committed 以較遠者為準
+        cut = max(cursor, safe_end)
+        pieces.append(buffer[cursor:cut])
+        return "".join(pieces), cut
+
+    def scan_stream(self, reader, writer):
+        """
+        reader: 有 read(n) 的文字串流；writer: 有 write(s) 的文字串流
+        """
+        start_time = time.perf_counter()
+        buffer = ""
+        committed = 0
+
+        while True:
+            chunk = reader.read(self.chunk_size)
+            final = not chunk
+            buffer += chunk
+            self.stats["chars"] += len(chunk)
+
+            output, committed = self._flush(buffer, committed, final)
+            if output:
+                writer.write(output)
+            if final:
+                break
+
+            # 丟棄已寫出的部分，只保留左側 context
+            keep_from = max(0, committed - self.context)
+            buffer = buffer[keep_from:]
+            committed -= keep_from
+
+        self.stats["seconds"] += time.perf_counter() - start_time
+        return self.stats
+
+    def scan_file(self, input_path, output_path):
+        with open(input_path, "r", encoding="utf-8", errors="replace", newline="") as reader, \
+             open(output_path, "w", encoding="utf-8", newline="") as writer:
+            return self.scan_stream(reader, writer)
+
+
+# ===========================
+# 🧪 命令列入口
+# ===========================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="以 Regex 串流遮蓋大型 Log 檔")
+    parser.add_argument("input", help="輸入文字檔")
+    parser.add_argument("output", help="輸出 (已遮蓋) 文字檔")
+    parser.add_argument("--chunk-size", type=int, default=RegexStreamScanner.DEFAULT_CHUNK_SIZE)
+    cli_args = parser.parse_args()
+
+    scanner = RegexStreamScanner(chunk_size=cli_args.chunk_size)
+    print(f"🚀 開始串流掃描: {cli_args.input} (chunk={scanner.chunk_size}, overlap={scanner.overlap})")
+    stats = scanner.scan_file(cli_args.input, cli_args.output)
+
+    size_mb = os.path.getsize(cli_args.input) / (1024 * 1024)
+    seconds = max(stats["seconds"], 1e-9)
+    print(f"✅ 完成！共 {stats['chars']} 字元，遮蓋 {stats['entities']} 個實體")
+    print(f"⏱️ 耗時 {seconds:.2f} 秒 ({size_mb / seconds:.1f} MB/s)")
+    print(f"📁 輸出: {cli_args.output}")
@@ -0,0 +1,182 @@
+import os
+import sys
+import time
+
+# ===========================
+# 🔥 1. 路徑設定
+# ===========================
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.dirname(current_dir))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from src.inference.processor import PIIProcessor, NumberedTagRegistry
+
+
+class StreamingMasker:
+    """
+    即時聊天 (逐字 / 逐 token 到達) 的增量遮蓋器。
+
+    用法：
+        masker = StreamingMasker(pii_pipe)
+        for chunk in incoming:
+            send(masker.feed(chunk))   # 只回傳已確定的遮蓋文字
+        send(masker.finish())          # 訊息完結，吐出剩餘部分
+
+    每次 feed 只會對「尾部窗口」(已輸出部分的少量上文 + 未確定部分) 重跑模型，
+    尾部最後 LOOKAHEAD_CHARS 個字元會被扣起，因為實體 (電話、戶口號碼、名字)
+    仲可能繼續變長。
+    """
+
+    # 扣起唔輸出的字元數 (最長的電話 / 戶口號碼約 20 字元)
+    LOOKAHEAD_CHARS = 24
+
+    # 重跑模型時保留的已輸出上文 (畀模型睇語境，唔會重複輸出)
+    CONTEXT_CHARS = 64
+
+    def __init__(self, pii_pipeline, lookahead_chars=None, context_chars=None):
+        self.pii_pipeline = pii_pipeline
+        self.lookahead_chars = self.LOOKAHEAD_CHARS if lookahead_chars is None else lookahead_chars
+        self.context_chars = self.CONTEXT_CHARS if context_chars is None else context_chars
+        self.reset()
+
+    def reset(self):
+        """開始一條新訊息"""
+        self.text = ""
+        self.emitted_upto = 0
+        self.tags = NumberedTagRegistry()
+        self.entities = []
+        self.metrics = {
+            "time_to_first_masked_byte": None,
+            "cpu_seconds": 0.0,
+            "model_calls": 0,
+            "model_chars": 0,
+        }
+        self._start_time = None
+
+    # =========================================================================
+    # ⚙️ Helpers
+    # =========================================================================
+
+    def _detect_tail(self):
+        """對尾部窗口重跑模型 + PIIProcessor，回傳全文座標的實體"""
+        window_start = max(0, self.emitted_upto - self.context_chars)
+        window = self.text[window_start:]
+        if not window.strip():
+            return []
+
+        raw_results = self.pii_pipeline.run_model(window)
+        self.metrics["model_calls"] += 1
+        self.metrics["model_chars"] += len(window)
+
+        entities = PIIProcessor(window, raw_results).process()
+        for ent in entities:
+            ent['start'] += window_start
+            ent['end'] += window_start
+        return entities
+
+    def _safe_boundary(self, entities, final):
+        """計算可以安全輸出的位置：扣起 lookahead，且唔可以切開實體或英數字詞"""
+        if final:
+            return len(self.text)
+
+        boundary = max(self.emitted_upto, len(self.text) - self.lookahead_chars)
+
+        # 唔好喺實體中間切斷 (實體仲可能變長)
+        for ent in entities:
+            if ent['start'] < boundary < ent['end']:
+                boundary = ent['start']
+
+        # 唔好喺英文字 / 數字中間切斷 (例如 "Sam" 之後可能係 "mi")
+        while boundary > self.emitted_upto:
+            prev_char, next_char = self.text[boundary - 1], self.text[boundary]
+            if prev_char.isascii() and prev_char.isalnum() and next_char.isascii() and next_char.isalnum():
+                boundary -= 1
+            else:
+                break
+        return max(boundary, self.emitted_upto)
+
+    def _render(self, entities, end):
+        """將 [emitted_upto, end) 遮蓋後輸出"""
+        pieces = []
+        cursor = self.emitted_upto
+        for ent in sorted(entities, key=lambda x: x['start']):
+            start = max(ent['start'], cursor)
+            if start >= end or ent['end'] <= start:
+                continue
+            stop = min(ent['end'], end)
+            word = self.text[start:stop]
+            tag = self.tags.get_tag(ent['entity_group'], self.text[ent['start']:ent['end']])
+            pieces.append(self.text[cursor:start])
+            pieces.append(PIIProcessor.format_tag(word, tag))
+
+            final_ent = dict(ent)
+            final_ent['numbered_tag'] = tag
+            self.entities.append(final_ent)
+            cursor = stop
+        pieces.append(self.text[cursor:end])
+        self.emitted_upto = end
+        return "".join(pieces)
+
+    def _step(self, final):
+        cpu_start = time.process_time()
+        entities = self._detect_tail()
+        boundary = self._safe_boundary(entities, final)
+        output = self._render(entities, boundary) if boundary > self.emitted_upto else ""
+        self.metrics["cpu_seconds"] += time.process_time() - cpu_start
+
+        if output and self.metrics["time_to_first_masked_byte"] is None:
+            self.metrics["time_to_first_masked_byte"] = time.perf_counter() - self._start_time
+        return output
+
+    # =========================================================================
+    # 🚀 Public API
+    # =========================================================================
+
+    def feed(self, chunk):
+        """加入新到達的文字，回傳已確定可以送出的遮蓋文字 (可能為空字串)"""
+        if self._start_time is None:
+            self._start_time = time.perf_counter()
+        if not chunk:
+            return ""
+        self.text += chunk
+        if len(self.text) - self.emitted_upto <= self.lookahead_chars:
+            return ""
+        return self._step(final=False)
+
+    def finish(self):
+        """訊息完結：輸出所有扣起的文字"""
+        if self._start_time is None:
+            self._start_time = time.perf_counter()
+        if self.emitted_upto >= len(self.text):
+            return ""
+        return self._step(final=True)
+
+
+# ===========================
+# 🧪 測試區塊
+# ===========================
+if __name__ == "__main__":
+    from src.inference.pipeline import PIIPipeline
+
+    pii_pipe = PIIPipeline()
+    masker = StreamingMasker(pii_pipe)
+
+    test_texts = [
+        "Sammi 之前打過黎，佢電話係 9123 4567，叫佢覆返我。",
+        "我的車牌係 AB1234，銀行戶口 123-456-789。",
+    ]
+
+    print("\n" + "="*50)
+    print("🚀 串流遮蓋測試 (逐字輸入)")
+    print("="*50)
+
+    for text in test_texts:
+        masker.reset()
+        streamed = "".join(masker.feed(char) for char in text) + masker.finish()
+        metrics = masker.metrics
+        print(f"📄 原文: {text}")
+        print(f"🛡️ 遮蓋: {streamed}")
+        print(f"⏱️ 首字輸出: {metrics['time_to_first_masked_byte'] * 1000:.1f} ms | "
+              f"CPU: {metrics['cpu_seconds'] * 1000:.1f} ms | 模型調用: {metrics['model_calls']} 次")
+        print("-" * 30)
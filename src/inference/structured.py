@@ -0,0 +1,233 @@
+import os
+import re
+import sys
+import csv
+import json
+import time
+import argparse
+
+# ===========================
+# 🔥 1. 路徑設定
+# ===========================
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.dirname(current_dir))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+
+# ===========================
+# 🔧 2. 簡易 JSONPath (只支援 $.a.b、a[0].b、a[*].b)
+# ===========================
+_PATH_TOKEN = re.compile(r'([^.\[\]]+)|\[(\d+|\*)\]')
+
+def parse_json_path(path):
+    """'$.customer.phones[*]' -> ['customer', 'phones', '*']"""
+    path = path.strip()
+    if path.startswith("$"):
+        path = path[1:]
+    steps = []
+    for key, index in _PATH_TOKEN.findall(path):
+        if key:
+            steps.append(key)
+        elif index == "*":
+            steps.append("*")
+        else:
+            steps.append(int(index))
+    return steps
+
+def _iter_path(node, steps):
+    """逐個回傳 (容器, key) —— 方便原地改寫"""
+    if not steps:
+        return
+    step, rest = steps[0], steps[1:]
+
+    if step == "*":
+        if isinstance(node, list):
+            keys = range(len(node))
+        elif isinstance(node, dict):
+            keys = list(node.keys())
+        else:
+            return
+    elif isinstance(step, int):
+        keys = [step] if isinstance(node, list) and step < len(node) else []
+    else:
+        keys = [step] if isinstance(node, dict) and step in node else []
+
+    for key in keys:
+        if rest:
+            yield from _iter_path(node[key], rest)
+        else:
+            yield node, key
+
+
+class StructuredMasker:
+    """
+    結構化數據 (CSV / JSON Lines) 的批量遮蓋。
+
+    同一欄位的值 (例如姓名、地址、電話) 通常重複成千上萬次，
+    所以先按欄位去重，只將未見過的值送入 PIIPipeline.predict_batch，
+    再將遮蓋結果寫回每條記錄。加速比例約等於 1 / unique_ratio。
+    """
+
+    # 每次累積幾多條記錄先做一次去重 + 批量推論
+    DEFAULT_BLOCK_SIZE = 1000
+
+    # 每個欄位最多快取幾多個唯一值 (超過就清空，保持記憶體有上限)
+    MAX_CACHE_PER_FIELD = 200000
+
+    def __init__(self, pii_pipeline, fields, batch_size=None, block_size=DEFAULT_BLOCK_SIZE):
+        self.pii_pipeline = pii_pipeline
+        self.fields = list(fields)
+        self.json_paths = {f: parse_json_path(f) for f in self.fields}
+        self.batch_size = batch_size
+        self.block_size = block_size
+
+        self.cache = {f: {} for f in self.fields}
+        self.stats = {"records": 0, "values": 0, "unique_values": 0, "seconds": 0.0}
+
+    # =========================================================================
+    # ⚙️ Core
+    # =========================================================================
+
+    def _mask_values(self, field, values):
+        """將一個欄位的值去重後批量推論，結果寫入 cache"""
+        field_cache = self.cache[field]
+        if len(field_cache) > self.MAX_CACHE_PER_FIELD:
+            field_cache.clear()
+
+        pending = []
+        seen = set()
+        for value in values:
+            self.stats["values"] += 1
+            if value in field_cache or value in seen:
+                continue
+            seen.add(value)
+            pending.append(value)
+
+        if not pending:
+            return
+
+        self.stats["unique_values"] += len(pending)
+        results = self.pii_pipeline.predict_batch(pending, batch_size=self.batch_size)
+        for value, result in zip(pending, results):
+            field_cache[value] = result["masked"]
+
+    def _lookup(self, field, value):
+        if not isinstance(value, str) or not value.strip():
+            return value
+        return self.cache[field][value]
+
+    def _process_block(self, block, get_values, set_values):
+        # 1. 按欄位收集 + 去重 + 批量推論
+        for field in self.fields:
+            values = [v for record in block for v in get_values(record, field)
+                      if isinstance(v, str) and v.strip()]
+            self._mask_values(field, values)
+
+        # 2. 寫回
+        for record in block:
+            for field in self.fields:
+                set_values(record, field)
+        self.stats["records"] += len(block)
+        return block
+
+    def _blocks(self, records):
+        block = []
+        for record in records:
+            block.append(record)
+            if len(block) >= self.block_size:
+                yield block
+                block = []
+        if block:
+            yield block
+
+    # =========================================================================
+    # 📄 CSV
+    # =========================================================================
+
+    def mask_csv(self, reader, writer):
+        start_time = time.perf_counter()
+        csv_reader = csv.DictReader(reader)
+        missing = [f for f in self.fields if f not in (csv_reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f"CSV 找不到欄位: {missing}")
+
+        csv_writer = csv.DictWriter(writer, fieldnames=csv_reader.fieldnames)
+        csv_writer.writeheader()
+
+        def get_values(record, field):
+            return [record.get(field)]
+
+        def set_values(record, field):
+            record[field] = self._lookup(field, record.get(field))
+
+        for block in self._blocks(csv_reader):
+            csv_writer.writerows(self._process_block(block, get_values, set_values))
+
+        self.stats["seconds"] += time.perf_counter() - start_time
+        return self.report()
+
+    # =========================================================================
+    # 📄 JSON Lines
+    # =========================================================================
+
+    def mask_jsonl(self, reader, writer):
+        start_time = time.perf_counter()
+
+        def get_values(record, field):
+            return [container[key] for container, key in _iter_path(record, self.json_paths[field])]
+
+        def set_values(record, field):
+            for container, key in _iter_path(record, self.json_paths[field]):
+                container[key] = self._lookup(field, container[key])
+
+        records = (json.loads(line) for line in reader if line.strip())
+        for block in self._blocks(records):
+            for record in self._process_block(block, get_values, set_values):
+                writer.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+        self.stats["seconds"] += time.perf_counter() - start_time
+        return self.report()
+
+    def report(self):
+        values = self.stats["values"]
+        return {
+            **self.stats,
+            "unique_ratio": (self.stats["unique_values"] / values) if values else 0.0,
+        }
+
+
+# ===========================
+# 🧪 命令列入口
+# ===========================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="批量遮蓋 CSV / JSON Lines 結構化數據")
+    parser.add_argument("input", help="輸入檔 (.csv 或 .jsonl)")
+    parser.add_argument("output", help="輸出檔")
+    parser.add_argument("--fields", nargs="+", required=True,
+                        help="要遮蓋的欄位：CSV 用欄位名，JSONL 用 JSONPath (如 $.customer.name)")
+    parser.add_argument("--format", choices=["csv", "jsonl"], default=None)
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--block-size", type=int, default=StructuredMasker.DEFAULT_BLOCK_SIZE)
+    cli_args = parser.parse_args()
+
+    data_format = cli_args.format or ("csv" if cli_args.input.lower().endswith(".csv") else "jsonl")
+
+    from src.inference.pipeline import PIIPipeline
+    masker = StructuredMasker(
+        PIIPipeline(), cli_args.fields,
+        batch_size=cli_args.batch_size, block_size=cli_args.block_size
+    )
+
+    print(f"🚀 開始遮蓋 {cli_args.input} ({data_format})，欄位: {cli_args.fields}")
+    with open(cli_args.input, "r", encoding="utf-8", newline="") as reader, \
+         open(cli_args.output, "w", encoding="utf-8", newline="") as writer:
+        if data_format == "csv":
+            report = masker.mask_csv(reader, writer)
+        else:
+            report = masker.mask_jsonl(reader, writer)
+
+    print(f"✅ 完成！記錄: {report['records']} | 欄位值: {report['values']} | 唯一值: {report['unique_values']}")
+    print(f"📊 Unique ratio: {report['unique_ratio']:.1%} (模型只需處理呢個比例的值)")
+    print(f"⏱️ 耗時 {report['seconds']:.2f} 秒")
+    print(f"📁 輸出: {cli_args.output}")
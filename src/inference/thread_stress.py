@@ -0,0 +1,81 @@
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+# ===========================
+# 🔥 1. 路徑設定
+# ===========================
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.dirname(current_dir))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from src.inference.pipeline import PIIPipeline
+from src.inference.inference import load_text_samples
+
+DEFAULT_DATA = os.path.join(current_dir, "testdata.txt")
+
+
+def _signature(result):
+    """比較用：遮蓋文字 + 實體 (標籤、位置)"""
+    return (
+        result["masked"],
+        [(e["entity_group"], e["start"], e["end"], e["numbered_tag"]) for e in result["entities"]],
+    )
+
+
+def run_stress(pii_pipe, texts, num_threads=8, rounds=4):
+    """
+    多線程壓力測試：N 個 thread 同時對 texts 調用 predict，
+    結果必須與單線程輸出完全一致。
+    """
+    print(f"🧪 [1/2] 單線程基準 ({len(texts)} 條)...")
+    start = time.perf_counter()
+    expected = [_signature(pii_pipe.predict(t)) for t in texts]
+    single_seconds = time.perf_counter() - start
+
+    # 每個 thread 以不同次序處理全部文字，增加交錯機會
+    jobs = []
+    for r in range(rounds * num_threads):
+        offset = r % len(texts)
+        jobs.append([(i % len(texts)) for i in range(offset, offset + len(texts))])
+
+    def worker(indices):
+        return [(i, _signature(pii_pipe.predict(texts[i]))) for i in indices]
+
+    print(f"🧪 [2/2] {num_threads} 線程 x {len(jobs)} 個任務...")
+    start = time.perf_counter()
+    mismatches = 0
+    with ThreadPoolExecutor(max_workers=num_threads) as pool:
+        for results in pool.map(worker, jobs):
+            for i, signature in results:
+                if signature != expected[i]:
+                    mismatches += 1
+                    print(f"❌ 第 {i} 條結果不一致")
+    multi_seconds = time.perf_counter() - start
+
+    total = len(jobs) * len(texts)
+    print(f"⏱️ 單線程: {len(texts) / single_seconds:.2f} 條/秒 | "
+          f"{num_threads} 線程: {total / multi_seconds:.2f} 條/秒")
+    return mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PIIPipeline 多線程壓力測試")
+    parser.add_argument("--data", default=DEFAULT_DATA)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--rounds", type=int, default=2)
+    parser.add_argument("--intra-op", type=int, default=None, help="torch intra-op 線程數")
+    parser.add_argument("--inter-op", type=int, default=None, help="torch inter-op 線程數")
+    cli_args = parser.parse_args()
+
+    pii_pipe = PIIPipeline(num_threads=cli_args.intra_op, num_interop_threads=cli_args.inter_op)
+    texts = load_text_samples(cli_args.data)
+    mismatches = run_stress(pii_pipe, texts, num_threads=cli_args.threads, rounds=cli_args.rounds)
+
+    if mismatches:
+        print(f"❌ 壓力測試失敗：{mismatches} 個結果與單線程不一致")
+        sys.exit(1)
+    print("✅ 壓力測試通過：多線程結果與單線程完全一致")
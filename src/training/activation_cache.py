@@ -0,0 +1,195 @@
+import os
+import sys
+import json
+import shutil
+import hashlib
+
+import numpy as np
+import torch
+from torch import nn
+from torch.utils.data import Dataset as TorchDataset
+from transformers.modeling_outputs import TokenClassifierOutput
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.dirname(current_dir))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from src.config import ACTIVATION_CACHE_DIR
+
+# ===========================
+# 🧊 凍結層 Activation 快取 (Frozen-layer Activation Cache)
+# ===========================
+# --freeze-layers N：LoRA 只加喺第 N 層之後，下面 N 層 (連 embeddings) 完全凍結，
+# 每個 epoch 輸出都一樣。所以：
+# - 訓練前用凍結的下層跑一次全部數據，hidden states 以 fp16 寫入磁碟 (np.memmap)
+#   格式：hidden.f16 = [總 token 數, hidden_size]，offsets.npy 記錄每句的起點
+# - 訓練時 UpperStackModel 直接由快取的 hidden states 開始，只跑上面 24 - N 層
+# 注意：快取時下層用 eval 模式 (冇 dropout)，所以凍結層的 dropout 唔再生效。
+
+# 改動快取格式或下層計算方式時請遞增
+ACTIVATION_CACHE_VERSION = 1
+
+
+def _unwrap(peft_or_hf_model):
+    """PeftModel -> XLMRobertaForTokenClassification (LoRA 已注入)"""
+    return peft_or_hf_model.get_base_model() if hasattr(peft_or_hf_model, "get_base_model") else peft_or_hf_model
+
+
+def _run_layers(layers, hidden_states, extended_mask):
+    for layer in layers:
+        outputs = layer(hidden_states, attention_mask=extended_mask)
+        hidden_states = outputs[0] if isinstance(outputs, tuple) else outputs
+    return hidden_states
+
+
+def activation_cache_key(model, dataset, num_frozen):
+    hf_model = _unwrap(model)
+    payload = {
+        "version": ACTIVATION_CACHE_VERSION,
+        "model": hf_model.config.name_or_path,
+        "hidden_size": hf_model.config.hidden_size,
+        "num_frozen": num_frozen,
+        # HF Dataset 的 fingerprint：由 load_from_disk 載入時是固定的
+        "dataset": getattr(dataset, "_fingerprint", None) or len(dataset),
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()[:24]
+
+
+@torch.inference_mode()
+def build_activation_cache(model, dataset, num_frozen, target, batch_size=16):
+    """用凍結的 embeddings + 前 num_frozen 層跑一次 dataset，寫入 fp16 memmap"""
+    hf_model = _unwrap(model)
+    encoder = hf_model.base_model
+    was_training = hf_model.training
+    hf_model.eval()
+    device = next(hf_model.parameters()).device
+
+    lengths = np.asarray(dataset["length"], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    hidden_size = hf_model.config.hidden_size
+
+    tmp_dir = f"{target}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    hidden = np.memmap(os.path.join(tmp_dir, "hidden.f16"), dtype=np.float16, mode="w+",
+                       shape=(int(offsets[-1]), hidden_size))
+
+    # 按長度排序分 batch，減少 padding
+    order = np.argsort(lengths, kind="stable")
+    input_ids_column = dataset["input_ids"]
+    for start in range(0, len(order), batch_size):
+        idx = order[start:start + batch_size]
+        max_len = int(lengths[idx].max())
+        input_ids = torch.full((len(idx), max_len), hf_model.config.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(idx), max_len), dtype=torch.long)
+        for row, i in enumerate(idx):
+            input_ids[row, :lengths[i]] = torch.tensor(input_ids_column[i])
+            attention_mask[row, :lengths[i]] = 1
+        input_ids, attention_mask = input_ids.to(device), attention_mask.to(device)
+
+        states = encoder.embeddings(input_ids=input_ids)
+        extended_mask = hf_model.get_extended_attention_mask(attention_mask, input_ids.shape)
+        states = _run_layers(encoder.encoder.layer[:num_frozen], states, extended_mask)
+        states = states.to(torch.float16).cpu().numpy()
+        for row, i in enumerate(idx):
+            hidden[offsets[i]:offsets[i + 1]] = states[row, :lengths[i]]
+
+    hidden.flush()
+    del hidden
+    np.save(os.path.join(tmp_dir, "offsets.npy"), offsets)
+    with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"num_frozen": num_frozen, "hidden_size": hidden_size, "tokens": int(offsets[-1]),
+                   "examples": len(lengths), "version": ACTIVATION_CACHE_VERSION}, f, indent=2)
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(tmp_dir, target)
+    hf_model.train(was_training)
+    return target
+
+
+def load_or_build_activations(model, dataset, num_frozen, cache_dir=ACTIVATION_CACHE_DIR, batch_size=16):
+    target = os.path.join(cache_dir, activation_cache_key(model, dataset, num_frozen))
+    if os.path.exists(os.path.join(target, "meta.json")):
+        print(f"⚡ 使用已快取的凍結層 hidden states: {target}")
+    else:
+        print(f"🧊 正在用前 {num_frozen} 層計算 hidden states 快取 ({len(dataset)} 句)...")
+        build_activation_cache(model, dataset, num_frozen, target, batch_size=batch_size)
+        print(f"💾 已快取至 {target}")
+    return CachedActivationDataset(target, dataset)
+
+
+class CachedActivationDataset(TorchDataset):
+    """
+    每條樣本回傳 memmap 切片 (唔會即時讀入記憶體) + labels。
+    保留 input_ids 只係畀 Trainer 的 group_by_length 計長度用。
+    """
+
+    def __init__(self, cache_path, tokenized_dataset):
+        with open(os.path.join(cache_path, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.offsets = np.load(os.path.join(cache_path, "offsets.npy"))
+        self.hidden = np.memmap(os.path.join(cache_path, "hidden.f16"), dtype=np.float16, mode="r",
+                                shape=(self.meta["tokens"], self.meta["hidden_size"]))
+        self.input_ids = tokenized_dataset["input_ids"]
+        self.labels = tokenized_dataset["labels"]
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, i):
+        return {
+            "hidden_states": self.hidden[self.offsets[i]:self.offsets[i + 1]],
+            "input_ids": self.input_ids[i],
+            "labels": self.labels[i],
+        }
+
+
+class CachedActivationCollator:
+    """補齊 hidden states (0) 及 labels (-100)，生成 attention_mask"""
+
+    def __init__(self, pad_to_multiple_of=8):
+        self.pad_to_multiple_of = pad_to_multiple_of
+
+    def __call__(self, features):
+        max_len = max(len(f["labels"]) for f in features)
+        if self.pad_to_multiple_of:
+            max_len = ((max_len + self.pad_to_multiple_of - 1) // self.pad_to_multiple_of) * self.pad_to_multiple_of
+        hidden_size = features[0]["hidden_states"].shape[-1]
+
+        hidden_states = torch.zeros((len(features), max_len, hidden_size), dtype=torch.float32)
+        attention_mask = torch.zeros((len(features), max_len), dtype=torch.long)
+        labels = torch.full((len(features), max_len), -100, dtype=torch.long)
+        for row, f in enumerate(features):
+            n = len(f["labels"])
+            hidden_states[row, :n] = torch.from_numpy(np.asarray(f["hidden_states"], dtype=np.float32))
+            attention_mask[row, :n] = 1
+            labels[row, :n] = torch.tensor(f["labels"])
+        return {"hidden_states": hidden_states, "attention_mask": attention_mask, "labels": labels}
+
+
+class UpperStackModel(nn.Module):
+    """
+    由快取的 hidden states 開始，只跑第 num_frozen 層之後的 (LoRA) 層 + 分類頭。
+    參數同原本的 PeftModel 共用，訓練完直接用 peft_model.save_pretrained 儲存 adapter。
+    """
+
+    def __init__(self, peft_model, num_frozen):
+        super().__init__()
+        self.peft_model = peft_model
+        self.num_frozen = num_frozen
+        self.config = _unwrap(peft_model).config
+
+    def forward(self, hidden_states, attention_mask, labels=None, **kwargs):
+        hf_model = _unwrap(self.peft_model)
+        hidden_states = hidden_states.to(next(hf_model.parameters()).dtype)
+        extended_mask = hf_model.get_extended_attention_mask(attention_mask, attention_mask.shape)
+        hidden_states = _run_layers(hf_model.base_model.encoder.layer[self.num_frozen:], hidden_states, extended_mask)
+        logits = hf_model.classifier(hf_model.dropout(hidden_states))
+
+        loss = None
+        if labels is not None:
+            loss = nn.functional.cross_entropy(logits.view(-1, logits.size(-1)), labels.view(-1), ignore_index=-100)
+        return TokenClassifierOutput(loss=loss, logits=logits)
+
+    def save_pretrained(self, *args, **kwargs):
+        return self.peft_model.save_pretrained(*args, **kwargs)
@@ -0,0 +1,282 @@
+import os
+import sys
+import copy
+import json
+import time
+import queue
+import random
+import shutil
+import argparse
+import threading
+import dataclasses
+
+import numpy as np
+import torch
+from transformers.trainer import OPTIMIZER_NAME, SCHEDULER_NAME, SCALER_NAME, TRAINER_STATE_NAME
+from transformers.trainer_callback import ExportableState
+from transformers.trainer_utils import PREFIX_CHECKPOINT_DIR
+from peft import PeftModel, get_peft_model_state_dict
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.dirname(current_dir))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from src.training.async_eval import load_adapter_weights
+
+# ===========================
+# 💾 輕量 Adapter Checkpoint (背景線程寫入)
+# ===========================
+# 以前每 500 步 Trainer 停低，同步寫入 adapter + tokenizer (~20 MB) + training_args + optimizer ...
+# LoRA 訓練真正需要保存的只有可訓練參數。呢度：
+# - 訓練線程只將 LoRA / modules_to_save 權重、optimizer (只有可訓練參數)、scheduler、RNG、
+#   trainer_state 複製一份到 CPU (幾 MB)，即刻返去訓練
+# - 單一背景線程按次序寫入 .tmp-checkpoint-N，寫完 trainer_state.json 先 os.replace 成 checkpoint-N，
+#   所以見到 checkpoint-N 就一定係完整的 (async_eval 的評估進程照用)
+# - 檔案格式同 Trainer 一樣，trainer.train(resume_from_checkpoint=...) 照常續訓，
+#   optimizer / scheduler / RNG / 數據次序全部還原，結果同一口氣訓練完全一樣
+# - 多進程 (DDP) 時每個 rank 要各自存 RNG，照用 Trainer 原本的同步 checkpoint
+#
+# 用法：PIITrainer(..., adapter_checkpoints=True)；train_lora.py 預設已啟用 (--full-checkpoints 改返舊做法)
+# 比較 / 驗證：python -m src.training.adapter_checkpoint --smoke-test
+
+MARKER_NAME = "adapter_checkpoint.json"
+ADAPTER_WEIGHTS_FILE = "adapter_model.safetensors"
+TMP_PREFIX = ".tmp-"
+
+
+def peft_model_of(model):
+    """PeftModel 本身，或凍結層快取模式的 UpperStackModel 入面的 PeftModel"""
+    if isinstance(model, PeftModel):
+        return model
+    inner = getattr(model, "peft_model", None)
+    return inner if isinstance(inner, PeftModel) else None
+
+
+def is_adapter_checkpoint(path):
+    return path is not None and os.path.exists(os.path.join(path, MARKER_NAME))
+
+
+def checkpoint_size_mb(path):
+    total = sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files)
+    return total / 1024 / 1024
+
+
+def _cpu_copy(obj):
+    """遞歸複製 (tensor 一律 clone 去 CPU)，之後訓練線程改動原本的 state 都唔受影響"""
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {k: _cpu_copy(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_cpu_copy(v) for v in obj)
+    return copy.deepcopy(obj)
+
+
+def _rng_states():
+    states = {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "cpu": torch.random.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        states["cuda"] = torch.cuda.random.get_rng_state()
+    return states
+
+
+def snapshot_trainer(trainer):
+    """喺訓練線程做：只複製可訓練參數及續訓需要的狀態"""
+    peft_model = peft_model_of(trainer.model)
+    adapter_name = peft_model.active_adapter
+    # 同 Trainer._save_checkpoint 一樣，先更新 EarlyStopping 等有狀態 callback 的記錄
+    for cb in [cb for cb in trainer.callback_handler.callbacks + [trainer.control] if isinstance(cb, ExportableState)]:
+        name = cb.__class__.__name__
+        if isinstance(trainer.state.stateful_callbacks.get(name), list):
+            trainer.state.stateful_callbacks[name].append(cb.state())
+        else:
+            trainer.state.stateful_callbacks[name] = cb.state()
+
+    scaler = getattr(trainer.accelerator, "scaler", None)
+    return {
+        "step": trainer.state.global_step,
+        "adapter": _cpu_copy(get_peft_model_state_dict(peft_model, adapter_name=adapter_name)),
+        "adapter_config": copy.deepcopy(peft_model.peft_config[adapter_name]),
+        "optimizer": _cpu_copy(trainer.optimizer.state_dict()),
+        "scheduler": copy.deepcopy(trainer.lr_scheduler.state_dict()),
+        "scaler": _cpu_copy(scaler.state_dict()) if scaler is not None else None,
+        "rng": _rng_states(),
+        "trainer_state": json.dumps(dataclasses.asdict(trainer.state), indent=2, sort_keys=True) + "\n",
+    }
+
+
+def write_checkpoint(target, snapshot):
+    """寫入臨時資料夾，trainer_state.json 最後寫，再 rename 成正式名稱"""
+    from safetensors.torch import save_file
+
+    tmp_dir = os.path.join(os.path.dirname(target), TMP_PREFIX + os.path.basename(target))
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    save_file(snapshot["adapter"], os.path.join(tmp_dir, ADAPTER_WEIGHTS_FILE), metadata={"format": "pt"})
+    snapshot["adapter_config"].save_pretrained(tmp_dir)
+    torch.save(snapshot["optimizer"], os.path.join(tmp_dir, OPTIMIZER_NAME))
+    torch.save(snapshot["scheduler"], os.path.join(tmp_dir, SCHEDULER_NAME))
+    if snapshot["scaler"] is not None:
+        torch.save(snapshot["scaler"], os.path.join(tmp_dir, SCALER_NAME))
+    torch.save(snapshot["rng"], os.path.join(tmp_dir, "rng_state.pth"))
+    with open(os.path.join(tmp_dir, MARKER_NAME), "w", encoding="utf-8") as f:
+        json.dump({"step": snapshot["step"], "created": time.strftime("%Y-%m-%d %H:%M:%S")}, f)
+    with open(os.path.join(tmp_dir, TRAINER_STATE_NAME), "w", encoding="utf-8") as f:
+        f.write(snapshot["trainer_state"])
+
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(tmp_dir, target)
+    return target
+
+
+class CheckpointWriter:
+    """單一背景線程按次序寫 checkpoint；寫入失敗會喺下次 wait() 時拋出"""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._error = None
+        self.write_seconds = []
+        self._thread = threading.Thread(target=self._run, name="adapter-checkpoint-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, target, snapshot, after=None):
+        with self._lock:
+            self._pending.add(target)
+        self._queue.put((target, snapshot, after))
+
+    def is_pending(self, target):
+        with self._lock:
+            return target in self._pending
+
+    def _run(self):
+        while True:
+            target, snapshot, after = self._queue.get()
+            start = time.perf_counter()
+            try:
+                write_checkpoint(target, snapshot)
+                if after is not None:
+                    after()
+            except Exception as e:
+                self._error = e
+            finally:
+                self.write_seconds.append(time.perf_counter() - start)
+                with self._lock:
+                    self._pending.discard(target)
+                self._queue.task_done()
+
+    def wait(self):
+        self._queue.join()
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError(f"背景寫入 checkpoint 失敗: {error}") from error
+
+
+def save_adapter_checkpoint(trainer, writer, trial=None):
+    """取代 Trainer._save_checkpoint：訓練線程只做 snapshot，寫入及清理舊 checkpoint 交畀背景線程"""
+    if trainer.hp_search_backend is None and trial is None:
+        trainer.store_flos()
+    run_dir = trainer._get_output_dir(trial=trial)
+    target = os.path.join(run_dir, f"{PREFIX_CHECKPOINT_DIR}-{trainer.state.global_step}")
+
+    # 最佳 checkpoint 可能仲喺背景寫緊，都當佢已經存在
+    if trainer.state.best_global_step:
+        best_dir = os.path.join(run_dir, f"{PREFIX_CHECKPOINT_DIR}-{trainer.state.best_global_step}")
+        if best_dir == target or os.path.exists(best_dir) or writer.is_pending(best_dir):
+            trainer.state.best_model_checkpoint = best_dir
+
+    if not trainer.args.should_save:
+        return
+    writer.submit(target, snapshot_trainer(trainer),
+                  after=lambda: trainer._rotate_checkpoints(use_mtime=False, output_dir=run_dir))
+
+
+def load_adapter_checkpoint(model, checkpoint_dir):
+    """續訓時載入權重 (optimizer / scheduler / RNG 由 Trainer 自己載入)"""
+    return load_adapter_weights(peft_model_of(model), checkpoint_dir)
+
+
+# ===========================
+# 🧪 冒煙測試 (比較 checkpoint 大小 / 停頓時間，並驗證續訓結果一致)
+# ===========================
+def _train_tiny(base, splits, output_dir, max_steps, adapter_checkpoints, resume=None, save_steps=4):
+    from transformers import AutoTokenizer, TrainingArguments
+    from src.training.train_lora import PIITrainer, TokenClassificationCollator, build_lora_model
+
+    tokenizer = AutoTokenizer.from_pretrained(base)
+    torch.manual_seed(0)
+    model = build_lora_model(base)
+    args = TrainingArguments(
+        output_dir=output_dir,
+        save_strategy="steps",
+        save_steps=save_steps,
+        eval_strategy="no",
+        learning_rate=1e-3,
+        max_steps=max_steps,
+        lr_scheduler_type="cosine",
+        warmup_ratio=0.1,
+        per_device_train_batch_size=8,
+        group_by_length=True,
+        length_column_name="length",
+        remove_unused_columns=False,
+        logging_steps=10,
+        report_to="none",
+    )
+    trainer = PIITrainer(
+        model=model, args=args, train_dataset=splits["train"], tokenizer=tokenizer,
+        data_collator=TokenClassificationCollator(tokenizer, pad_to_multiple_of=8),
+        adapter_checkpoints=adapter_checkpoints,
+    )
+    trainer.train(resume_from_checkpoint=resume)
+    return trainer
+
+
+def smoke_test():
+    from safetensors.torch import load_file
+    from src.training.distill import load_distill_splits
+    from src.training.smoke_fixtures import toy_workspace
+    from transformers import AutoTokenizer
+
+    with toy_workspace() as ws:
+        base = ws.model_path
+        splits = load_distill_splits([ws.data_file], AutoTokenizer.from_pretrained(base), cache_dir=ws.cache_dir)
+
+        rows = []
+        for label, adapter_mode in (("Trainer 原本", False), ("Adapter-only + 背景寫入", True)):
+            out = ws.path("full" if not adapter_mode else "adapter")
+            trainer = _train_tiny(base, splits, out, 12, adapter_mode)
+            rows.append((label, np.mean(trainer.checkpoint_stalls) * 1000, checkpoint_size_mb(os.path.join(out, "checkpoint-12"))))
+        print("\n| 模式 | 每次存檔停頓 (ms) | checkpoint 大小 (MB) |\n|---|---|---|")
+        for label, stall, size in rows:
+            print(f"| {label} | {stall:.1f} | {size:.2f} |")
+
+        # 由 checkpoint-8 續訓到第 12 步，權重要同一口氣訓練到第 12 步完全一樣
+        straight = load_file(ws.path("adapter", "checkpoint-12", ADAPTER_WEIGHTS_FILE))
+        _train_tiny(base, splits, ws.path("resumed"), 12, True,
+                    resume=ws.path("adapter", "checkpoint-8"))
+        resumed = load_file(ws.path("resumed", "checkpoint-12", ADAPTER_WEIGHTS_FILE))
+        assert set(straight) == set(resumed)
+        assert all(torch.equal(straight[k], resumed[k]) for k in straight), "續訓結果唔一致"
+        assert not [n for n in os.listdir(ws.path("adapter")) if n.startswith(TMP_PREFIX)]
+    print("✅ 冒煙測試通過 (續訓權重與一口氣訓練完全一致)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="輕量 adapter checkpoint：比較大小 / 停頓並驗證續訓")
+    parser.add_argument("--smoke-test", action="store_true", help="用細模型及玩具數據比較兩種 checkpoint")
+    parser.add_argument("--size", metavar="CHECKPOINT_DIR", help="顯示 checkpoint 資料夾大小")
+    cli_args = parser.parse_args()
+
+    if cli_args.smoke_test:
+        smoke_test()
+    elif cli_args.size:
+        print(f"📦 {cli_args.size}: {checkpoint_size_mb(cli_args.size):.2f} MB "
+              f"({'adapter-only' if is_adapter_checkpoint(cli_args.size) else 'Trainer 原本格式'})")
+    else:
+        parser.print_help()
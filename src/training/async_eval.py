@@ -0,0 +1,243 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import multiprocessing as mp
+
+import torch
+from torch.utils.data import DataLoader
+from datasets import load_from_disk
+from transformers import AutoTokenizer, AutoModelForTokenClassification, DataCollatorForTokenClassification, TrainerCallback
+from peft import PeftModel, set_peft_model_state_dict
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.dirname(current_dir))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from src.config import BASE_MODEL_NAME, LABEL2ID, ID2LABEL
+from src.training.streaming_metrics import SpanMetricAccumulator
+from src.training.distributed import broadcast_flag
+
+# ===========================
+# ⏱️ 非同步評估 (Asynchronous Checkpoint Evaluation)
+# ===========================
+# 以前每 500 步訓練就要停低，用 xlm-roberta-large 跑晒成個驗證集。
+# 而家 Trainer 只負責存 checkpoint (LoRA adapter)，另一個進程監察 output_dir：
+# - 每見到一個完整的 checkpoint 就載入 adapter 評估，結果追加到 async_eval.jsonl
+# - 訓練進程的 AsyncEvalCallback 讀返結果，負責 Early Stopping 及記錄最佳 checkpoint
+# - 評估完的舊 checkpoint 只保留「最佳 + 最新」，效果等同 save_total_limit=2
+
+RESULTS_NAME = "async_eval.jsonl"
+DONE_MARKER = "async_eval.done"
+EVAL_DATA_NAME = "async_eval_data"
+MODEL_INPUTS = ("input_ids", "attention_mask", "labels")
+
+
+def checkpoint_step(path):
+    return int(os.path.basename(path).rsplit("-", 1)[-1])
+
+
+def list_ready_checkpoints(output_dir, since=0.0):
+    """trainer_state.json 係 Trainer 最後先寫的檔案，有佢即代表 checkpoint 已完整"""
+    ready = []
+    if not os.path.isdir(output_dir):
+        return ready
+    for name in os.listdir(output_dir):
+        path = os.path.join(output_dir, name)
+        state_file = os.path.join(path, "trainer_state.json")
+        if name.startswith("checkpoint-") and os.path.exists(state_file) and os.path.getmtime(state_file) >= since:
+            ready.append(path)
+    return sorted(ready, key=checkpoint_step)
+
+
+def load_adapter_weights(model, checkpoint_dir):
+    """將 checkpoint 的 LoRA (及分類頭) 權重載入已包裝好的 PeftModel"""
+    safetensors_path = os.path.join(checkpoint_dir, "adapter_model.safetensors")
+    if os.path.exists(safetensors_path):
+        from safetensors.torch import load_file
+        state_dict = load_file(safetensors_path)
+    else:
+        state_dict = torch.load(os.path.join(checkpoint_dir, "adapter_model.bin"), map_location="cpu")
+    set_peft_model_state_dict(model, state_dict)
+    return model
+
+
+def read_results(output_dir):
+    path = os.path.join(output_dir, RESULTS_NAME)
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def evaluate_model(model, dataloader, device):
+    acc = SpanMetricAccumulator(print_report=False)
+    model.eval()
+    with torch.inference_mode():
+        for batch in dataloader:
+            labels = batch.pop("labels")
+            logits = model(**{k: v.to(device) for k, v in batch.items()}).logits
+            acc.update(logits.argmax(dim=-1).cpu().numpy(), labels.numpy())
+    return acc
+
+
+# ===========================
+# 👷 評估進程
+# ===========================
+def run_evaluator(output_dir, num_threads=None, batch_size=8, poll_interval=10.0, since=0.0,
+                  metric="eval_f1", keep_latest=True):
+    """
+    輪詢 output_dir，逐個評估新 checkpoint，直至見到 DONE_MARKER 且全部評估完。
+    """
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+
+    eval_dataset = load_from_disk(os.path.join(output_dir, EVAL_DATA_NAME))
+    eval_dataset = eval_dataset.remove_columns([c for c in eval_dataset.column_names if c not in MODEL_INPUTS])
+    tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL_NAME)
+    collator = DataCollatorForTokenClassification(tokenizer, pad_to_multiple_of=8)
+    dataloader = DataLoader(eval_dataset, batch_size=batch_size, collate_fn=collator)
+
+    model = None
+    done = {r["checkpoint"] for r in read_results(output_dir)}
+    best = max(read_results(output_dir), key=lambda r: r[metric], default=None)
+
+    while True:
+        finished = os.path.exists(os.path.join(output_dir, DONE_MARKER))
+        pending = [c for c in list_ready_checkpoints(output_dir, since) if os.path.basename(c) not in done]
+
+        if not pending:
+            if finished:
+                break
+            time.sleep(poll_interval)
+            continue
+
+        checkpoint = pending[0]
+        start = time.perf_counter()
+        if model is None:
+            base = AutoModelForTokenClassification.from_pretrained(
+                BASE_MODEL_NAME, num_labels=len(LABEL2ID), id2label=ID2LABEL,
+                label2id=LABEL2ID, ignore_mismatched_sizes=True
+            )
+            model = PeftModel.from_pretrained(base, checkpoint).to(device)
+        else:
+            load_adapter_weights(model, checkpoint)
+
+        acc = evaluate_model(model, dataloader, device)
+        scores = acc.compute()
+        record = {
+            "checkpoint": os.path.basename(checkpoint),
+            "step": checkpoint_step(checkpoint),
+            **{f"eval_{k}": v for k, v in scores.items()},
+            "eval_runtime": round(time.perf_counter() - start, 2),
+        }
+        with open(os.path.join(output_dir, RESULTS_NAME), "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        done.add(record["checkpoint"])
+        print(f"📊 [非同步評估] {record['checkpoint']} -> F1 {scores['f1']:.4f} ({record['eval_runtime']}s)")
+        print(acc.report())
+
+        if best is None or record[metric] > best[metric]:
+            best = record
+        _prune_checkpoints(output_dir, done, best["checkpoint"], since, keep_latest)
+
+
+def _prune_checkpoints(output_dir, evaluated, best_name, since, keep_latest):
+    """只刪除已評估、唔係最佳、亦唔係最新 (續訓用) 的 checkpoint"""
+    checkpoints = list_ready_checkpoints(output_dir, since)
+    latest = os.path.basename(checkpoints[-1]) if checkpoints and keep_latest else None
+    for path in checkpoints:
+        name = os.path.basename(path)
+        if name in evaluated and name not in (best_name, latest):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def default_eval_threads():
+    """評估進程預設用四分之一核心"""
+    return max(1, (os.cpu_count() or 1) // 4)
+
+
+def start_async_evaluator(output_dir, eval_dataset, num_threads=None):
+    """儲存驗證集並以 spawn 方式啟動評估進程"""
+    os.makedirs(output_dir, exist_ok=True)
+    for name in (RESULTS_NAME, DONE_MARKER):
+        if os.path.exists(os.path.join(output_dir, name)):
+            os.remove(os.path.join(output_dir, name))
+    data_dir = os.path.join(output_dir, EVAL_DATA_NAME)
+    shutil.rmtree(data_dir, ignore_errors=True)
+    eval_dataset.save_to_disk(data_dir)
+
+    if num_threads is None:
+        num_threads = default_eval_threads()
+    ctx = mp.get_context("spawn")
+    process = ctx.Process(
+        target=run_evaluator, name="async-evaluator",
+        kwargs={"output_dir": output_dir, "num_threads": num_threads, "since": time.time()}
+    )
+    process.start()
+    print(f"⏱️ 非同步評估進程已啟動 (pid {process.pid}, {num_threads} 線程)")
+    return process
+
+
+def finish_async_evaluator(output_dir, process):
+    """通知評估進程訓練已完成，等佢評估晒剩餘 checkpoint"""
+    open(os.path.join(output_dir, DONE_MARKER), "w").close()
+    print("⏳ 等待非同步評估完成剩餘 checkpoint...")
+    process.join()
+
+
+# ===========================
+# 🔁 訓練進程的 Callback
+# ===========================
+class AsyncEvalCallback(TrainerCallback):
+    """
+    讀取評估進程寫返嘅結果：更新 best_metric / best_model_checkpoint、寫入 log_history，
+    並按 patience 觸發 Early Stopping。最後一步強制存檔，確保最終模型都會被評估。
+    """
+
+    def __init__(self, output_dir, metric="eval_f1", patience=10):
+        self.output_dir = output_dir
+        self.metric = metric
+        self.patience = patience
+        self.seen = set()
+        self.bad_evals = 0
+
+    def poll(self, state):
+        new = [r for r in read_results(self.output_dir) if r["checkpoint"] not in self.seen]
+        for record in sorted(new, key=lambda r: r["step"]):
+            self.seen.add(record["checkpoint"])
+            state.log_history.append({**record, "async_eval": True})
+            if state.best_metric is None or record[self.metric] > state.best_metric:
+                state.best_metric = record[self.metric]
+                state.best_model_checkpoint = os.path.join(self.output_dir, record["checkpoint"])
+                self.bad_evals = 0
+            else:
+                self.bad_evals += 1
+        return new
+
+    def on_step_end(self, args, state, control, **kwargs):
+        if state.global_step >= state.max_steps:
+            control.should_save = True
+        # 結果檔好細，每次 log 順便讀一次 (多進程時由 rank 0 決定，再同步畀其他 rank)
+        if args.logging_steps and state.global_step % args.logging_steps == 0:
+            if state.is_world_process_zero:
+                self.poll(state)
+            if broadcast_flag(self.bad_evals >= self.patience):
+                print(f"🛑 非同步評估連續 {self.bad_evals} 次冇進步，提早停止訓練。")
+                control.should_training_stop = True
+                control.should_save = True
+        return control
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="監察 output_dir 並評估新 checkpoint")
+    parser.add_argument("--output-dir", default="./lora_out")
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--poll-interval", type=float, default=10.0)
+    cli_args = parser.parse_args()
+
+    run_evaluator(cli_args.output_dir, num_threads=cli_args.threads, poll_interval=cli_args.poll_interval)
@@ -0,0 +1,133 @@
+import os
+import sys
+import json
+import shutil
+import hashlib
+import argparse
+
+from datasets import DatasetDict
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.dirname(current_dir))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from src.config import LABEL2ID, MAX_SEQ_LENGTH, DATASET_CACHE_DIR
+
+# ===========================
+# 🗄️ Tokenized Dataset 快取 (Content-Addressed)
+# ===========================
+# 快取 key = hash(輸入檔內容 + Tokenizer + MAX_SEQ_LENGTH + LABEL2ID + split seed + 版本)，
+# 任何一項改變都會自動生成新快取；內容冇變就直接 memory-map 已存好的 Arrow 檔。
+
+# 改動 tokenize_and_align_labels 的邏輯時請遞增，令舊快取失效
+CACHE_VERSION = 1
+
+
+def file_sha256(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def tokenizer_identity(tokenizer):
+    return {
+        "class": type(tokenizer).__name__,
+        "name_or_path": tokenizer.name_or_path,
+        "vocab_size": len(tokenizer),
+    }
+
+
+def cache_key(input_file, tokenizer, seed, max_length=MAX_SEQ_LENGTH, label2id=LABEL2ID, extra=None):
+    payload = {
+        "version": CACHE_VERSION,
+        "input_sha256": file_sha256(input_file),
+        "tokenizer": tokenizer_identity(tokenizer),
+        "max_length": max_length,
+        "label2id": label2id,
+        "seed": seed,
+        "extra": extra or {},
+    }
+    key = hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()[:24]
+    return key, payload
+
+
+def load_or_build(input_file, tokenizer, seed, build_fn, cache_dir=DATASET_CACHE_DIR, extra=None):
+    """
+    有快取就 memory-map 載入；否則執行 build_fn() 生成 DatasetDict 並存檔。
+    寫入先存到臨時資料夾再 rename，中途中斷都唔會留低半成品。
+    """
+    key, payload = cache_key(input_file, tokenizer, seed, extra=extra)
+    target = os.path.join(cache_dir, key)
+
+    if os.path.exists(os.path.join(target, "cache_meta.json")):
+        print(f"⚡ 使用已快取的 Tokenized 數據: {target}")
+        return DatasetDict.load_from_disk(target)
+
+    datasets = build_fn()
+
+    tmp_dir = f"{target}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    datasets.save_to_disk(tmp_dir)
+    with open(os.path.join(tmp_dir, "cache_meta.json"), "w", encoding="utf-8") as f:
+        json.dump({**payload, "input_file": os.path.abspath(input_file)}, f, ensure_ascii=False, indent=2)
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(tmp_dir, target)
+    print(f"💾 已快取 Tokenized 數據至 {target}")
+
+    # 重新從磁碟載入，令 Trainer 使用 memory-mapped 版本
+    return DatasetDict.load_from_disk(target)
+
+
+def list_cache(cache_dir=DATASET_CACHE_DIR):
+    entries = []
+    if not os.path.isdir(cache_dir):
+        return entries
+    for key in sorted(os.listdir(cache_dir)):
+        meta_path = os.path.join(cache_dir, key, "cache_meta.json")
+        if not os.path.exists(meta_path):
+            continue
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        size = sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, files in os.walk(os.path.join(cache_dir, key)) for name in files
+        )
+        entries.append({"key": key, "size_mb": round(size / (1024 * 1024), 2), **meta})
+    return entries
+
+
+def purge_cache(cache_dir=DATASET_CACHE_DIR, key=None):
+    if not os.path.isdir(cache_dir):
+        return 0
+    keys = [key] if key else os.listdir(cache_dir)
+    removed = 0
+    for k in keys:
+        path = os.path.join(cache_dir, k)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+            removed += 1
+    return removed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="檢視或清除 Tokenized Dataset 快取")
+    parser.add_argument("--cache-dir", default=DATASET_CACHE_DIR)
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--list", action="store_true", help="列出所有快取")
+    group.add_argument("--purge", nargs="?", const="__all__", metavar="KEY", help="清除快取 (不指定 KEY 則全部清除)")
+    cli_args = parser.parse_args()
+
+    if cli_args.purge:
+        key = None if cli_args.purge == "__all__" else cli_args.purge
+        removed = purge_cache(cli_args.cache_dir, key)
+        print(f"🗑️ 已清除 {removed} 個快取")
+    else:
+        entries = list_cache(cli_args.cache_dir)
+        if not entries:
+            print(f"📭 {cli_args.cache_dir} 冇任何快取")
+        for e in entries:
+            print(f"🗄️ {e['key']} | {e['size_mb']} MB | {e['input_file']} | "
+                  f"{e['tokenizer']['name_or_path']} | max_len={e['max_length']} | seed={e['seed']}")
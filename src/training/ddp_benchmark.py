@@ -0,0 +1,162 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+import torch
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.dirname(current_dir))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from src.config import BASE_MODEL_NAME, LABEL2ID
+from src.training.distributed import dist_info, configure_cpu_threads
+
+# ===========================
+# 📊 CPU 數據並行擴展性測試
+# ===========================
+# 用法 (單機 Linux)：
+#   python -m src.training.ddp_benchmark --procs 1 2 4 8 --steps 20
+#
+# 每個進程數各自用 torchrun --standalone 啟動，模型及 LoRA 設定同 train_lora.py 一樣，
+# 用固定長度的隨機 batch 跑 forward + backward + AdamW，量度 (不計預熱)：
+#   samples/s   全部 rank 合計每秒處理的樣本數
+#   speedup     相對 1 個進程
+#   efficiency  speedup / 進程數 (1.0 = 線性擴展)
+#   allreduce   每步 all-reduce 的參數量 (只有 LoRA + 分類頭)
+# 核心數固定，進程數越多每個進程分到的線程越少；efficiency 下降主要嚟自 gloo all-reduce
+# 及每個進程的 batch 太細。結果寫入 --output (Markdown)，方便貼入 PR / 文件。
+#
+# ⚠️ 只係模型 + all-reduce 的每步時間下限 (即吞吐量上限)：唔經 Trainer，亦唔計 DataLoader / 即場生成 /
+# tokenize / collate 嘅時間。真實訓練的 samples/s 只會更低，數據路徑要另外用 train_lora.py 的日誌量度。
+
+
+def run_worker(model_name, steps, warmup, batch_size, seq_length, result_path):
+    from src.training.train_lora import build_lora_model
+
+    num_threads = configure_cpu_threads() or torch.get_num_threads()
+    rank, world_size, _, _ = dist_info()
+    if world_size > 1:
+        dist.init_process_group("gloo")
+
+    torch.manual_seed(rank)
+    model = build_lora_model(model_name)
+    model.train()
+    allreduce_params = sum(p.numel() for p in model.parameters() if p.requires_grad)
+    if world_size > 1:
+        # DDP 只會登記 requires_grad 的參數，凍結的 base 權重唔會被同步
+        model = DistributedDataParallel(model, find_unused_parameters=False, broadcast_buffers=False)
+    optimizer = torch.optim.AdamW([p for p in model.parameters() if p.requires_grad], lr=2e-5)
+
+    vocab_size = (model.module if world_size > 1 else model).config.vocab_size
+    input_ids = torch.randint(5, vocab_size, (batch_size, seq_length))
+    labels = torch.randint(0, len(LABEL2ID), (batch_size, seq_length))
+    attention_mask = torch.ones_like(input_ids)
+
+    def step():
+        loss = model(input_ids=input_ids, attention_mask=attention_mask, labels=labels).loss
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad(set_to_none=True)
+
+    for _ in range(warmup):
+        step()
+    if world_size > 1:
+        dist.barrier()
+    start = time.perf_counter()
+    for _ in range(steps):
+        step()
+    if world_size > 1:
+        dist.barrier()
+    elapsed = time.perf_counter() - start
+
+    if rank == 0:
+        result = {
+            "procs": world_size,
+            "threads_per_proc": num_threads,
+            "samples_per_sec": steps * batch_size * world_size / elapsed,
+            "step_time": elapsed / steps,
+            "allreduce_params": allreduce_params,
+        }
+        with open(result_path, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+    if world_size > 1:
+        dist.destroy_process_group()
+
+
+def launch(procs, args):
+    """以 torchrun --standalone 啟動 procs 個進程，回傳 rank 0 的結果"""
+    with tempfile.TemporaryDirectory() as tmp:
+        result_path = os.path.join(tmp, "result.json")
+        cmd = [
+            sys.executable, "-m", "torch.distributed.run", "--standalone", f"--nproc_per_node={procs}",
+            "-m", "src.training.ddp_benchmark", "--worker",
+            "--model", args.model, "--steps", str(args.steps), "--warmup", str(args.warmup),
+            "--batch-size", str(args.batch_size), "--seq-length", str(args.seq_length),
+            "--result", result_path,
+        ]
+        subprocess.run(cmd, check=True, cwd=project_root)
+        with open(result_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+
+def format_table(results):
+    base, base_procs = results[0]["samples_per_sec"], results[0]["procs"]
+    lines = [
+        "| 進程數 | 線程/進程 | samples/s | step 時間 (s) | speedup | efficiency | all-reduce 參數 |",
+        "|---|---|---|---|---|---|---|",
+    ]
+    for r in results:
+        speedup = r["samples_per_sec"] / base
+        lines.append(
+            f"| {r['procs']} | {r['threads_per_proc']} | {r['samples_per_sec']:.2f} | {r['step_time']:.3f} | "
+            f"{speedup:.2f}x | {speedup / (r['procs'] / base_procs):.0%} | {r['allreduce_params']:,} |"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CPU 多進程 (gloo) 數據並行擴展性測試")
+    parser.add_argument("--procs", nargs="+", type=int, default=[1, 2, 4, 8])
+    parser.add_argument("--model", default=BASE_MODEL_NAME)
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=4, help="每個進程的 batch size")
+    parser.add_argument("--seq-length", type=int, default=128)
+    parser.add_argument("--output", default="ddp_benchmark.md")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--result", default=None, help=argparse.SUPPRESS)
+    cli_args = parser.parse_args()
+
+    if cli_args.worker:
+        run_worker(cli_args.model, cli_args.steps, cli_args.warmup, cli_args.batch_size,
+                   cli_args.seq_length, cli_args.result)
+        sys.exit(0)
+
+    cores = os.cpu_count() or 1
+    results = []
+    for procs in sorted(cli_args.procs):
+        if procs > cores:
+            print(f"⏭️ {procs} 個進程多過 CPU 核心數 ({cores})，跳過。")
+            continue
+        print(f"🚀 測試 {procs} 個進程...")
+        results.append(launch(procs, cli_args))
+        print(f"   -> {results[-1]['samples_per_sec']:.2f} samples/s")
+
+    table = format_table(results)
+    header = (f"# CPU 數據並行擴展性測試\n\n"
+              f"- 模型: {cli_args.model}\n- CPU 核心: {cores}\n"
+              f"- 每進程 batch: {cli_args.batch_size} x {cli_args.seq_length} tokens, {cli_args.steps} 步\n\n"
+              f"> ⚠️ 固定隨機 batch 直接跑 DDP 模型，只量度 forward + backward + all-reduce + AdamW，\n"
+              f"> 唔經 Trainer，亦唔包括 DataLoader / 即場生成 / tokenize 的時間：\n"
+              f"> 數字係每步時間的下限 (即真實訓練吞吐量的上限)，唔代表數據路徑嘅表現。\n\n")
+    with open(cli_args.output, "w", encoding="utf-8") as f:
+        f.write(header + table + "\n")
+    print("\n" + table)
+    print(f"\n📁 結果已寫入 {cli_args.output}")
@@ -0,0 +1,462 @@
+import os
+import sys
+import copy
+import json
+import time
+import shutil
+import hashlib
+import argparse
+
+import numpy as np
+import torch
+from torch import nn
+from torch.utils.data import DataLoader, Dataset as TorchDataset
+from datasets import DatasetDict, concatenate_datasets
+from transformers import (
+    AutoModelForTokenClassification,
+    TrainingArguments,
+    DataCollatorForTokenClassification,
+    EarlyStoppingCallback,
+)
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.dirname(current_dir))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from src.config import (
+    LORA_MODEL_PATH, STUDENT_MODEL_PATH, TEACHER_LOGITS_CACHE_DIR, DATASET_CACHE_DIR, SPLIT_SEED
+)
+from src.inference.pipeline import PIIPipeline
+from src.training.train_lora import PIITrainer, LogCallback, build_tokenized_datasets
+from src.training.dataset_cache import load_or_build
+from src.training.streaming_metrics import SpanMetricAccumulator, preprocess_logits_for_metrics
+from src.training.async_eval import evaluate_model
+from src.training.telemetry import DEFAULT_LOG_PATH
+
+# ===========================
+# 🎓 知識蒸餾 (Teacher: 合併後的 LoRA 模型 -> Student: 細模型)
+# ===========================
+# CPU 上跑 xlm-roberta-large 成本最高。做法：
+# - Teacher = PIIPipeline 載入並 merge_and_unload 後的模型
+# - Teacher 對訓練數據 (合成 + 真實語料) 逐 token 的 logits 只計一次，以 fp16 memmap 存入磁碟
+#   (得 15 個標籤，直接存完整 logits，唔使揀 top-k；存 logits 而唔係機率，改 temperature 唔使重算)
+# - Student 同 teacher 共用 tokenizer，所以 token 一一對應；預設取 teacher 平均分佈的 6 層初始化
+# - Loss = alpha * T^2 * KL(teacher || student) + (1 - alpha) * CE(硬標籤)
+# - Student 存成完整 HF 模型，PIIPipeline(model_path=...) 可直接載入
+# - 報告：teacher / student 逐個標籤 F1 + latency 比例
+#
+# 用法：python -m src.training.distill --inputs train_data_lora_cleaned.json
+# 冒煙測試 (CPU，幾秒內完成)：python -m src.training.distill --smoke-test
+
+# 改動快取格式或 teacher 計算方式時請遞增
+TEACHER_CACHE_VERSION = 1
+REPORT_NAME = "distill_report.json"
+MODEL_INPUTS = ("input_ids", "attention_mask", "labels")
+
+
+def model_fingerprint(model_path):
+    """以權重檔的名稱、大小及修改時間識別 teacher (adapter 重新訓練後快取自動失效)"""
+    entries = []
+    for name in sorted(os.listdir(model_path)):
+        if name.endswith((".safetensors", ".bin")):
+            stat = os.stat(os.path.join(model_path, name))
+            entries.append([name, stat.st_size, int(stat.st_mtime)])
+    return {"path": os.path.abspath(model_path), "weights": entries}
+
+
+def teacher_cache_key(teacher_path, dataset):
+    payload = {
+        "version": TEACHER_CACHE_VERSION,
+        "teacher": model_fingerprint(teacher_path),
+        "dataset": getattr(dataset, "_fingerprint", None) or len(dataset),
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()[:24]
+
+
+@torch.inference_mode()
+def build_teacher_cache(teacher, dataset, target, batch_size=16):
+    """Teacher 跑一次 dataset，logits 以 fp16 寫入 [總 token 數, 標籤數] 的 memmap"""
+    device = next(teacher.parameters()).device
+    teacher.eval()
+    lengths = np.asarray(dataset["length"], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    num_labels = teacher.config.num_labels
+
+    tmp_dir = f"{target}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    logits_map = np.memmap(os.path.join(tmp_dir, "logits.f16"), dtype=np.float16, mode="w+",
+                           shape=(int(offsets[-1]), num_labels))
+
+    # 按長度排序分 batch，減少 padding
+    order = np.argsort(lengths, kind="stable")
+    input_ids_column = dataset["input_ids"]
+    for start in range(0, len(order), batch_size):
+        idx = order[start:start + batch_size]
+        max_len = int(lengths[idx].max())
+        input_ids = torch.full((len(idx), max_len), teacher.config.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(idx), max_len), dtype=torch.long)
+        for row, i in enumerate(idx):
+            input_ids[row, :lengths[i]] = torch.tensor(input_ids_column[i])
+            attention_mask[row, :lengths[i]] = 1
+
+        logits = teacher(input_ids=input_ids.to(device), attention_mask=attention_mask.to(device)).logits
+        logits = logits.float().clamp(-60000, 60000).to(torch.float16).cpu().numpy()
+        for row, i in enumerate(idx):
+            logits_map[offsets[i]:offsets[i + 1]] = logits[row, :lengths[i]]
+
+    logits_map.flush()
+    del logits_map
+    np.save(os.path.join(tmp_dir, "offsets.npy"), offsets)
+    with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"num_labels": num_labels, "tokens": int(offsets[-1]), "examples": len(lengths),
+                   "version": TEACHER_CACHE_VERSION}, f, indent=2)
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(tmp_dir, target)
+    return target
+
+
+def load_or_build_teacher_logits(teacher, teacher_path, dataset, cache_dir=TEACHER_LOGITS_CACHE_DIR, batch_size=16):
+    target = os.path.join(cache_dir, teacher_cache_key(teacher_path, dataset))
+    if os.path.exists(os.path.join(target, "meta.json")):
+        print(f"⚡ 使用已快取的 Teacher logits: {target}")
+    else:
+        print(f"🎓 正在用 Teacher 計算 soft labels ({len(dataset)} 句)...")
+        build_teacher_cache(teacher, dataset, target, batch_size=batch_size)
+        print(f"💾 已快取至 {target}")
+    return DistillDataset(target, dataset)
+
+
+class DistillDataset(TorchDataset):
+    """每條樣本：input_ids + 硬標籤 + teacher logits (memmap 切片，唔會即時讀入記憶體)"""
+
+    def __init__(self, cache_path, tokenized_dataset):
+        with open(os.path.join(cache_path, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.offsets = np.load(os.path.join(cache_path, "offsets.npy"))
+        self.logits = np.memmap(os.path.join(cache_path, "logits.f16"), dtype=np.float16, mode="r",
+                                shape=(self.meta["tokens"], self.meta["num_labels"]))
+        self.input_ids = tokenized_dataset["input_ids"]
+        self.labels = tokenized_dataset["labels"]
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, i):
+        return {
+            "input_ids": self.input_ids[i],
+            "labels": self.labels[i],
+            "teacher_logits": self.logits[self.offsets[i]:self.offsets[i + 1]],
+        }
+
+
+class DistillCollator:
+    """補齊 input_ids (pad_token_id)、labels (-100) 及 teacher logits (0)，生成 attention_mask"""
+
+    def __init__(self, pad_token_id, pad_to_multiple_of=8):
+        self.pad_token_id = pad_token_id
+        self.pad_to_multiple_of = pad_to_multiple_of
+
+    def __call__(self, features):
+        max_len = max(len(f["input_ids"]) for f in features)
+        if self.pad_to_multiple_of:
+            max_len = ((max_len + self.pad_to_multiple_of - 1) // self.pad_to_multiple_of) * self.pad_to_multiple_of
+        num_labels = features[0]["teacher_logits"].shape[-1]
+
+        input_ids = torch.full((len(features), max_len), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(features), max_len), dtype=torch.long)
+        labels = torch.full((len(features), max_len), -100, dtype=torch.long)
+        teacher_logits = torch.zeros((len(features), max_len, num_labels), dtype=torch.float32)
+        for row, f in enumerate(features):
+            n = len(f["input_ids"])
+            input_ids[row, :n] = torch.tensor(f["input_ids"])
+            attention_mask[row, :n] = 1
+            labels[row, :n] = torch.tensor(f["labels"])
+            teacher_logits[row, :n] = torch.from_numpy(np.asarray(f["teacher_logits"], dtype=np.float32))
+        return {"input_ids": input_ids, "attention_mask": attention_mask, "labels": labels,
+                "teacher_logits": teacher_logits}
+
+
+class DistillTrainer(PIITrainer):
+    """Loss = alpha * T^2 * KL(teacher/T || student/T) + (1 - alpha) * CE，只計有標籤的 token"""
+
+    def __init__(self, *args, temperature=2.0, alpha=0.5, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.temperature = temperature
+        self.alpha = alpha
+
+    def compute_loss(self, model, inputs, return_outputs=False, num_items_in_batch=None):
+        self._count_padding(model, inputs)
+        # 複製一份：prediction_step 之後仲要由 inputs 攞 labels
+        inputs = dict(inputs)
+        teacher_logits = inputs.pop("teacher_logits")
+        labels = inputs.pop("labels")
+        outputs = model(**inputs)
+
+        mask = labels != -100
+        student_logits = outputs.logits[mask]
+        t = self.temperature
+        kl = nn.functional.kl_div(
+            nn.functional.log_softmax(student_logits / t, dim=-1),
+            nn.functional.log_softmax(teacher_logits[mask] / t, dim=-1),
+            log_target=True, reduction="batchmean",
+        ) * (t * t)
+        ce = nn.functional.cross_entropy(student_logits, labels[mask])
+        loss = self.alpha * kl + (1 - self.alpha) * ce
+        return (loss, outputs) if return_outputs else loss
+
+
+def build_student(teacher, num_layers=6, hidden_size=None, student_model=None):
+    """
+    預設：複製 teacher 的 config，只保留 num_layers 層，並由 teacher 平均分佈的層
+    (連 embeddings 及分類頭) 初始化。指定 hidden_size (同 teacher 唔同) 時改為隨機初始化。
+    student_model：改用現成的細模型，但必須同 teacher 共用 tokenizer (詞表大小一致)。
+    """
+    if student_model:
+        student = AutoModelForTokenClassification.from_pretrained(
+            student_model, num_labels=teacher.config.num_labels, id2label=teacher.config.id2label,
+            label2id=teacher.config.label2id, ignore_mismatched_sizes=True
+        )
+        if student.config.vocab_size != teacher.config.vocab_size:
+            raise ValueError(f"Student 詞表 ({student.config.vocab_size}) 同 Teacher "
+                             f"({teacher.config.vocab_size}) 唔一致，逐 token 蒸餾需要共用 tokenizer。")
+        return student
+
+    config = copy.deepcopy(teacher.config)
+    config.num_hidden_layers = num_layers
+    same_width = hidden_size in (None, teacher.config.hidden_size)
+    if not same_width:
+        config.hidden_size = hidden_size
+        config.intermediate_size = hidden_size * 4
+        config.num_attention_heads = max(1, hidden_size // 64)
+    student = AutoModelForTokenClassification.from_config(config)
+
+    if same_width:
+        keep = np.linspace(0, teacher.config.num_hidden_layers - 1, num_layers).round().astype(int)
+        print(f"🧬 由 Teacher 第 {keep.tolist()} 層初始化 Student")
+        student.base_model.embeddings.load_state_dict(teacher.base_model.embeddings.state_dict())
+        for i, j in enumerate(keep):
+            student.base_model.encoder.layer[i].load_state_dict(teacher.base_model.encoder.layer[j].state_dict())
+        student.classifier.load_state_dict(teacher.classifier.state_dict())
+    return student
+
+
+def load_distill_splits(inputs, tokenizer, seed=SPLIT_SEED, cache_dir=DATASET_CACHE_DIR):
+    """每個輸入檔各自 (快取) tokenize + 切分，再合併成一份訓練/測試集"""
+    parts = [
+        load_or_build(path, tokenizer, seed, lambda path=path: build_tokenized_datasets(path, tokenizer, seed),
+                      cache_dir=cache_dir)
+        for path in inputs
+    ]
+    if len(parts) == 1:
+        return parts[0]
+    return DatasetDict({split: concatenate_datasets([p[split] for p in parts]) for split in ("train", "test")})
+
+
+# ===========================
+# 📊 報告
+# ===========================
+def measure_latency(model, dataset, collator, device, samples=32):
+    """逐句 (batch size 1) 推論的平均毫秒數，先預熱一次"""
+    items = [{k: dataset[i][k] for k in MODEL_INPUTS} for i in range(min(samples, len(dataset)))]
+    model.eval()
+    with torch.inference_mode():
+        batches = [{k: v.to(device) for k, v in collator([item]).items() if k != "labels"} for item in items]
+        model(**batches[0])
+        start = time.perf_counter()
+        for batch in batches:
+            model(**batch)
+    return (time.perf_counter() - start) / len(batches) * 1000
+
+
+def score_model(model, dataset, collator, device, batch_size=16, latency_samples=32):
+    dataloader = DataLoader(dataset, batch_size=batch_size, collate_fn=collator)
+    start = time.perf_counter()
+    acc = evaluate_model(model, dataloader, device)
+    batched_ms = (time.perf_counter() - start) / len(dataset) * 1000
+    _, _, f1 = acc.per_type()
+    return {
+        **acc.compute(),
+        "per_label_f1": {t: round(float(f), 4) for t, f in zip(acc.types, f1)},
+        "latency_ms_per_sentence_batched": round(batched_ms, 3),
+        "latency_ms_per_sentence": round(measure_latency(model, dataset, collator, device, latency_samples), 3),
+        "parameters": sum(p.numel() for p in model.parameters()),
+    }
+
+
+def distill_report(teacher_scores, student_scores):
+    labels = sorted(set(teacher_scores["per_label_f1"]) | set(student_scores["per_label_f1"]))
+    return {
+        "teacher": teacher_scores,
+        "student": student_scores,
+        "per_label_f1": {
+            label: {
+                "teacher": teacher_scores["per_label_f1"].get(label, 0.0),
+                "student": student_scores["per_label_f1"].get(label, 0.0),
+            }
+            for label in labels
+        },
+        "latency_ratio": round(teacher_scores["latency_ms_per_sentence"] / student_scores["latency_ms_per_sentence"], 2),
+        "latency_ratio_batched": round(
+            teacher_scores["latency_ms_per_sentence_batched"] / student_scores["latency_ms_per_sentence_batched"], 2
+        ),
+    }
+
+
+def format_report(report):
+    lines = ["| 標籤 | Teacher F1 | Student F1 | 差距 |", "|---|---|---|---|"]
+    for label, r in report["per_label_f1"].items():
+        lines.append(f"| {label} | {r['teacher']:.4f} | {r['student']:.4f} | {r['student'] - r['teacher']:+.4f} |")
+    t, s = report["teacher"], report["student"]
+    lines.append(f"| **overall** | {t['f1']:.4f} | {s['f1']:.4f} | {s['f1'] - t['f1']:+.4f} |")
+    lines.append("")
+    lines.append(f"- 參數量: Teacher {t['parameters']:,} / Student {s['parameters']:,}")
+    lines.append(f"- 逐句 latency: Teacher {t['latency_ms_per_sentence']:.1f} ms / "
+                 f"Student {s['latency_ms_per_sentence']:.1f} ms (快 {report['latency_ratio']}x)")
+    lines.append(f"- 批量 latency: Teacher {t['latency_ms_per_sentence_batched']:.1f} ms / "
+                 f"Student {s['latency_ms_per_sentence_batched']:.1f} ms (快 {report['latency_ratio_batched']}x)")
+    return "\n".join(lines)
+
+
+# ===========================
+# 🚀 主流程
+# ===========================
+def distill(teacher_path=LORA_MODEL_PATH, inputs=("train_data_lora_cleaned.json",), output_dir=STUDENT_MODEL_PATH,
+            num_layers=6, hidden_size=None, student_model=None, temperature=2.0, alpha=0.5,
+            num_train_epochs=3, learning_rate=5e-5, batch_size=16, cache_dir=TEACHER_LOGITS_CACHE_DIR,
+            dataset_cache_dir=DATASET_CACHE_DIR, work_dir="./distill_out", log_path=DEFAULT_LOG_PATH,
+            report_to="tensorboard"):
+    start = time.time()
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+
+    # 1. Teacher：同推論一樣經 PIIPipeline 載入 (LoRA 已合併)
+    pii_pipe = PIIPipeline(model_path=teacher_path, backend="eager", use_profile=False)
+    teacher, tokenizer = pii_pipe.model.to(device), pii_pipe.tokenizer
+
+    # 2. 數據 + Teacher soft labels (只計一次)
+    splits = load_distill_splits(inputs, tokenizer, cache_dir=dataset_cache_dir)
+    train_dataset = load_or_build_teacher_logits(teacher, teacher_path, splits["train"], cache_dir, batch_size)
+    eval_dataset = load_or_build_teacher_logits(teacher, teacher_path, splits["test"], cache_dir, batch_size)
+
+    # 3. Student
+    student = build_student(teacher, num_layers, hidden_size, student_model).to(device)
+    print(f"🎒 Student 參數量: {sum(p.numel() for p in student.parameters()):,} "
+          f"(Teacher: {sum(p.numel() for p in teacher.parameters()):,})")
+
+    args = TrainingArguments(
+        output_dir=work_dir,
+        eval_strategy="epoch",
+        save_strategy="epoch",
+        save_total_limit=2,
+        learning_rate=learning_rate,
+        num_train_epochs=num_train_epochs,
+        lr_scheduler_type="cosine",
+        warmup_ratio=0.05,
+        weight_decay=0.01,
+        per_device_train_batch_size=batch_size,
+        per_device_eval_batch_size=batch_size,
+        group_by_length=True,
+        logging_steps=10,
+        fp16=torch.cuda.is_available(),
+        load_best_model_at_end=True,
+        metric_for_best_model="f1",
+        batch_eval_metrics=True,
+        # teacher_logits 唔係 model.forward 的參數，唔好俾 Trainer 自動刪走
+        remove_unused_columns=False,
+        report_to=report_to,
+    )
+    trainer = DistillTrainer(
+        model=student,
+        args=args,
+        train_dataset=train_dataset,
+        eval_dataset=eval_dataset,
+        tokenizer=tokenizer,
+        data_collator=DistillCollator(tokenizer.pad_token_id),
+        compute_metrics=SpanMetricAccumulator(),
+        preprocess_logits_for_metrics=preprocess_logits_for_metrics,
+        callbacks=[EarlyStoppingCallback(early_stopping_patience=2), LogCallback(log_path=log_path)],
+        temperature=temperature,
+        alpha=alpha,
+    )
+    print("🚀 開始蒸餾訓練...")
+    trainer.train()
+
+    # 4. 匯出 (完整 HF 模型 + tokenizer，PIIPipeline 直接載入)
+    print(f"💾 正在儲存 Student 至 {output_dir}...")
+    student.save_pretrained(output_dir)
+    tokenizer.save_pretrained(output_dir)
+
+    # 5. 報告：同一個測試集、同一個 collator，比較 F1 及 latency
+    print("📊 評估 Teacher 及 Student...")
+    test_split = splits["test"].remove_columns([c for c in splits["test"].column_names if c not in MODEL_INPUTS])
+    collator = DataCollatorForTokenClassification(tokenizer, pad_to_multiple_of=8)
+    report = distill_report(
+        score_model(teacher, test_split, collator, device, batch_size),
+        score_model(student, test_split, collator, device, batch_size),
+    )
+    report["config"] = {
+        "teacher": os.path.abspath(teacher_path),
+        "inputs": [os.path.abspath(p) for p in inputs],
+        "num_layers": student.config.num_hidden_layers,
+        "hidden_size": student.config.hidden_size,
+        "student_model": student_model,
+        "temperature": temperature,
+        "alpha": alpha,
+        "num_train_epochs": num_train_epochs,
+        "train_seconds": round(time.time() - start, 1),
+    }
+    with open(os.path.join(output_dir, REPORT_NAME), "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print("\n" + format_report(report))
+    print(f"\n✅ 蒸餾完成！Student: {output_dir} (報告: {os.path.join(output_dir, REPORT_NAME)})")
+    return output_dir, report
+
+
+# ===========================
+# 🧪 冒煙測試 (細 teacher + 玩具數據，CPU 幾秒內跑完成個流程)
+# ===========================
+def smoke_test():
+    from src.training.smoke_fixtures import toy_workspace
+
+    with toy_workspace("teacher") as ws:
+        output_dir, report = distill(
+            teacher_path=ws.model_path, inputs=[ws.data_file], output_dir=ws.path("student"),
+            num_layers=2, num_train_epochs=1, batch_size=8, cache_dir=ws.path("cache", "teacher_logits"),
+            dataset_cache_dir=ws.path("cache", "tokenized"), work_dir=ws.path("out"),
+            log_path=ws.log_path, report_to="none",
+        )
+        # 匯出的 student 要經 PIIPipeline 載入到
+        student_pipe = PIIPipeline(model_path=output_dir, backend="eager", use_profile=False)
+        print(student_pipe.predict(ws.sample_text()))
+        assert report["student"]["parameters"] < report["teacher"]["parameters"]
+    print("✅ 冒煙測試通過")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="將合併後的 LoRA 模型蒸餾成細模型")
+    parser.add_argument("--teacher", default=LORA_MODEL_PATH, help="PIIPipeline 可載入的模型資料夾")
+    parser.add_argument("--inputs", nargs="+", default=["train_data_lora_cleaned.json"],
+                        help="訓練數據 JSON (可以多個，例如真實 + 合成語料)")
+    parser.add_argument("--output", default=STUDENT_MODEL_PATH)
+    parser.add_argument("--layers", type=int, default=6, help="Student 層數")
+    parser.add_argument("--hidden-size", type=int, default=None, help="Student 闊度 (預設同 teacher 一樣)")
+    parser.add_argument("--student-model", default=None, help="改用現成細模型 (需同 teacher 共用 tokenizer)")
+    parser.add_argument("--temperature", type=float, default=2.0)
+    parser.add_argument("--alpha", type=float, default=0.5, help="KL loss 比重，其餘為硬標籤 CE")
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--lr", type=float, default=5e-5)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--smoke-test", action="store_true", help="用細 teacher 及玩具數據跑一次完整流程")
+    cli_args = parser.parse_args()
+
+    if cli_args.smoke_test:
+        smoke_test()
+    else:
+        distill(
+            teacher_path=cli_args.teacher, inputs=cli_args.inputs, output_dir=cli_args.output,
+            num_layers=cli_args.layers, hidden_size=cli_args.hidden_size, student_model=cli_args.student_model,
+            temperature=cli_args.temperature, alpha=cli_args.alpha, num_train_epochs=cli_args.epochs,
+            learning_rate=cli_args.lr, batch_size=cli_args.batch_size,
+        )
@@ -0,0 +1,80 @@
+import os
+import sys
+
+import torch
+import torch.distributed as dist
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.dirname(current_dir))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+# ===========================
+# 🖧 CPU 多進程數據並行 (torch.distributed + gloo)
+# ===========================
+# 單機：torchrun --standalone --nproc_per_node 4 -m src.training.train_lora
+# 多機：torchrun --nnodes 2 --node_rank <0|1> --nproc_per_node 8 \
+#         --master_addr <rank 0 主機> --master_port 29500 -m src.training.train_lora
+#
+# - Trainer 見到 torchrun 設定的環境變數會自動用 DDP；CPU 上強制用 gloo
+# - DDP 只同步 requires_grad 的參數，所以只有 LoRA (及分類頭) 會被 all-reduce
+# - 每個 rank 讀自己的數據：map-style 用 DistributedSampler；分片串流按檔案分配
+# - 每台機的 CPU 核心平均分畀本機的進程，避免 oversubscription
+
+
+def dist_info():
+    """由 torchrun 的環境變數讀取 (rank, world_size, local_rank, local_world_size)"""
+    return (
+        int(os.environ.get("RANK", 0)),
+        int(os.environ.get("WORLD_SIZE", 1)),
+        int(os.environ.get("LOCAL_RANK", 0)),
+        int(os.environ.get("LOCAL_WORLD_SIZE", 1)),
+    )
+
+
+def is_distributed():
+    return dist_info()[1] > 1
+
+
+def is_main_process():
+    return dist_info()[0] == 0
+
+
+def configure_cpu_threads(reserved_threads=0):
+    """
+    每個進程分到 (本機核心數 - reserved_threads) / 本機進程數 條線程。
+    reserved_threads：留畀其他進程 (例如非同步評估) 的核心。先扣再平分，每個 rank 線程數一樣，
+    唔會有一個 rank 特別慢、拖住所有 all-reduce。
+    """
+    _, world_size, _, local_world_size = dist_info()
+    if torch.cuda.is_available() or (world_size <= 1 and not reserved_threads):
+        return None
+    cores = max(local_world_size, (os.cpu_count() or 1) - reserved_threads)
+    num_threads = max(1, cores // local_world_size)
+    torch.set_num_threads(num_threads)
+    os.environ["OMP_NUM_THREADS"] = str(num_threads)
+    return num_threads
+
+
+def ddp_training_kwargs():
+    """多進程時額外的 TrainingArguments"""
+    if not is_distributed():
+        return {}
+    return {
+        "ddp_backend": "nccl" if torch.cuda.is_available() else "gloo",
+        # LoRA 參數每步都有用到；凍結的 base 權重唔會登記喺 reducer
+        "ddp_find_unused_parameters": False,
+        # 模型入面冇需要同步的 buffer (position_ids 係常數)
+        "ddp_broadcast_buffers": False,
+        # 每個 rank 自己讀自己的 shard，唔好由 rank 0 讀晒再派
+        "accelerator_config": {"dispatch_batches": False},
+    }
+
+
+def broadcast_flag(flag, src=0):
+    """將 rank 0 的決定 (例如 Early Stopping) 同步到所有 rank"""
+    if not (dist.is_available() and dist.is_initialized()):
+        return flag
+    tensor = torch.tensor([1 if flag else 0], dtype=torch.int32)
+    dist.broadcast(tensor, src=src)
+    return bool(tensor.item())
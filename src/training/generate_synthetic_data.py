@@ -31,7 +31,26 @@ NAME_FORBIDDEN = [
     "先生", "老闆", "小姐", "女士"
 ]
 
-def generate_synthetic(target_count=20000):
+# 🏷️ Template 佔位符 -> 實體類型 (不在表內的佔位符 = O)
+PLACEHOLDER_ENTITY = {
+    "{name}": "NAME",
+    "{addr}": "ADDRESS",
+    "{phone}": "PHONE",
+    "{id_num}": "ID",
+    "{account}": "ACCOUNT",
+    "{plate}": "LICENSE_PLATE",
+    "{org}": "ORG",
+    # 🔥 補漏 Keys (包含銀行相關)
+    "{bank}": "ORG",       # 銀行 -> ORG
+    "{company}": "ORG",    # 公司 -> ORG
+    "{station}": "ORG",    # 菜鳥驛站 -> ORG
+}
+
+def load_generation_resources():
+    """
+    載入並清洗生成所需的全部資源 (名字、地址、真實負樣本、Templates)。
+    DataLoader workers 由主進程 fork 出嚟，載入一次就可以共用。
+    """
     # ===========================
     # 1. 載入原始資源
     # ===========================
@@ -74,100 +93,97 @@ def generate_synthetic(target_count=20000):
     
     addresses = [a for a in raw_addresses if not any(word in a for word in CRITICAL_FORBIDDEN)]
     
+    return {
+        "names_data": names_data,
+        "addresses": addresses,
+        "real_negative_samples": real_negative_samples,
+        # 這裡會自動包含 Excel 載入的銀行相關 Templates
+        "templates": get_all_templates(),
+    }
+
+def generate_example(resources):
+    """
+    生成一條樣本 {"tokens", "ner_tags"}；被禁止名單污染或無效時回傳 None。
+    使用全域 random / Faker，由呼叫者負責設定 seed。
+    """
+    # 85% 正樣本 (有實體)，15% 負樣本 (全 O)
+    is_positive = random.random() < 0.85
+    tokens_list = []
+    tags_list = []
+
+    if is_positive:
+        # --- 正樣本生成 (Template Based) ---
+        template_parts = random.choice(resources["templates"])
+        
+        # 🔥 這裡會自動混合 GeoJSON 地址 和 Excel 銀行地址
+        fillers = get_random_fillers(resources["names_data"], resources["addresses"])
+        
+        for part in template_parts:
+            entity_type = "O"
+            
+            # 檢查 Template Part 是否需要填充
+            if part in fillers:
+                text_segment = str(fillers[part])
+                # 🏷️ 實體標籤映射
+                entity_type = PLACEHOLDER_ENTITY.get(part, "O")
+            else:
+                text_segment = part
+
+            tokens = smart_tokenize(text_segment)
+            
+            # 🛡️ 核心安全檢查
+            if entity_type == "O":
+                if any(word in text_segment for word in CRITICAL_FORBIDDEN):
+                    return None
+
+            tokens_list.extend(tokens)
+            
+            # 生成 BIO 標籤
+            if entity_type != "O":
+                try:
+                    # B-TYPE
+                    tags_list.append(LABEL2ID[f"B-{entity_type}"])
+                    # I-TYPE
+                    tags_list.extend([LABEL2ID[f"I-{entity_type}"]] * (len(tokens) - 1))
+                except KeyError:
+                    # Fallback
+                    tags_list.extend([LABEL2ID["O"]] * len(tokens))
+            else:
+                tags_list.extend([LABEL2ID["O"]] * len(tokens))
+    else:
+        # --- 負樣本生成 ---
+        real_negative_samples = resources["real_negative_samples"]
+        if real_negative_samples and random.random() < 0.8:
+            raw_sent = random.choice(real_negative_samples)
+        else:
+            raw_sent = fake.sentence()
+
+        if any(word in raw_sent for word in CRITICAL_FORBIDDEN):
+            return None
+            
+        tokens_list = smart_tokenize(raw_sent)
+        tags_list = [LABEL2ID["O"]] * len(tokens_list)
+
     # ===========================
-    # 3. 開始生成循環
+    # 最終校對
     # ===========================
-    # 這裡會自動包含 Excel 載入的銀行相關 Templates
-    templates = get_all_templates() 
+    if len(tokens_list) == len(tags_list) and len(tokens_list) > 0:
+        return {"tokens": tokens_list, "ner_tags": tags_list}
+    return None
+
+def generate_synthetic(target_count=20000):
+    resources = load_generation_resources()
     
     data = []
     print(f"🚀 正在生成「分源處理」合成數據... 目標: {target_count}")
 
     # 使用 tqdm 顯示進度
+    # (訓練時即場生成、唔落地的版本見 src/training/synthetic_stream.py)
     with tqdm(total=target_count) as pbar:
         while len(data) < target_count:
-            # 85% 正樣本 (有實體)，15% 負樣本 (全 O)
-            is_positive = random.random() < 0.85
-            tokens_list = []
-            tags_list = []
-            is_contaminated = False
-
-            if is_positive:
-                # --- 正樣本生成 (Template Based) ---
-                template_parts = random.choice(templates)
-                
-                # 🔥 這裡會自動混合 GeoJSON 地址 和 Excel 銀行地址
-                fillers = get_random_fillers(names_data, addresses)
-                
-                for part in template_parts:
-                    entity_type = "O"
-                    
-                    # 檢查 Template Part 是否需要填充
-                    if part in fillers:
-                        text_segment = str(fillers[part])
-                        
-                        # 🏷️ 實體標籤映射
-                        if part == "{name}": entity_type = "NAME"
-                        elif part == "{addr}": entity_type = "ADDRESS"
-                        elif part == "{phone}": entity_type = "PHONE"
-                        elif part == "{id_num}": entity_type = "ID"
-                        elif part == "{account}": entity_type = "ACCOUNT"
-                        elif part == "{plate}": entity_type = "LICENSE_PLATE"
-                        elif part == "{org}": entity_type = "ORG"
-                        
-                        # 🔥 補漏 Keys (包含銀行相關)
-                        elif part == "{bank}": entity_type = "ORG"       # 銀行 -> ORG
-                        elif part == "{company}": entity_type = "ORG"    # 公司 -> ORG
-                        elif part == "{station}": entity_type = "ORG"    # 菜鳥驛站 -> ORG
-                        elif part == "{pickup_code}": entity_type = "O" 
-                        elif part == "{code}": entity_type = "O"        
-                        elif part == "{order_id}": entity_type = "O"    
-                        elif part == "{email}": entity_type = "O"        
-                        
-                    else:
-                        text_segment = part
-
-                    tokens = smart_tokenize(text_segment)
-                    
-                    # 🛡️ 核心安全檢查
-                    if entity_type == "O":
-                        if any(word in text_segment for word in CRITICAL_FORBIDDEN):
-                            is_contaminated = True
-                            break
-
-                    tokens_list.extend(tokens)
-                    
-                    # 生成 BIO 標籤
-                    if entity_type != "O":
-                        try:
-                            # B-TYPE
-                            tags_list.append(LABEL2ID[f"B-{entity_type}"])
-                            # I-TYPE
-                            tags_list.extend([LABEL2ID[f"I-{entity_type}"]] * (len(tokens) - 1))
-                        except KeyError:
-                            # Fallback
-                            tags_list.extend([LABEL2ID["O"]] * len(tokens))
-                    else:
-                        tags_list.extend([LABEL2ID["O"]] * len(tokens))
-            else:
-                # --- 負樣本生成 ---
-                if real_negative_samples and random.random() < 0.8:
-                    raw_sent = random.choice(real_negative_samples)
-                else:
-                    raw_sent = fake.sentence()
-
-                if any(word in raw_sent for word in CRITICAL_FORBIDDEN):
-                    continue
-                    
-                tokens = smart_tokenize(raw_sent)
-                tokens_list = tokens
-                tags_list = [LABEL2ID["O"]] * len(tokens)
-
-            # ===========================
-            # 4. 最終校對與儲存
-            # ===========================
-            if not is_contaminated and len(tokens_list) == len(tags_list) and len(tokens_list) > 0:
-                data.append({"tokens": tokens_list, "ner_tags": tags_list})
+            example = generate_example(resources)
+            if example is not None:
+                data.append(example)
                 pbar.update(1) # 更新進度條
 
     return data
@@ -0,0 +1,414 @@
+import os
+import sys
+import json
+import math
+import time
+import argparse
+
+import numpy as np
+import torch
+from torch import nn
+from torch.optim.lr_scheduler import LambdaLR
+from torch.utils.data import DataLoader
+from datasets import Dataset, concatenate_datasets
+from transformers import AutoTokenizer, TrainingArguments, DataCollatorForTokenClassification
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.dirname(current_dir))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from src.config import BASE_MODEL_NAME, MINED_LORA_MODEL_PATH, DATASET_CACHE_DIR, SPLIT_SEED
+from src.training.train_lora import (
+    PIITrainer, LogCallback, TokenClassificationCollator, build_lora_model, tokenize_and_align_labels
+)
+from src.training.incremental import load_parent_model
+from src.training.async_eval import evaluate_model
+from src.training.distill import load_distill_splits, MODEL_INPUTS
+from src.training.telemetry import new_run_id, read_history, DEFAULT_LOG_PATH
+
+# ===========================
+# ⛏️ 困難樣本挖掘 (Hard-example Mining)
+# ===========================
+# 以前每個 epoch 都將 20k 合成樣本 + 重複 10 次的 news / MTR 全部行一次，當中大部分模型早已識得。
+# 呢度每一輪 (round) 之間加一個挖掘步驟：
+# - 候選池 = 訓練集 + (可選) 每輪用 generate_synthetic_data.py 新生成的一批合成樣本
+# - 按長度排序批量推論，計每條樣本的平均 token loss 及最小 margin (正確標籤 logit - 最大其他 logit)
+# - 揀 loss 最高 / margin 最低的 keep_fraction，再由其餘樣本隨機抽 floor_fraction (防止忘記易樣本)
+# - 只用揀中的樣本訓練一個 epoch，然後喺固定測試集評估 F1
+# - 所有輪次共用一個 AdamW + cosine schedule (按總步數設定)，每輪新 Trainer 唔會重設動量同 learning rate
+# - 報告：每輪 F1、訓練 token 數，對比「每輪行晒成個候選池」的 token 數
+#
+# 由零開始時第一輪未有可信的分數，用同樣數量的隨機樣本熱身；
+# 由現有 adapter 繼續 (--init-adapter，即「兩次訓練之間」挖掘) 則第一輪已經直接挖掘。
+#
+# 用法：python -m src.training.hard_mining --rounds 5 --keep-fraction 0.2 --synthetic 20000
+# 冒煙測試：python -m src.training.hard_mining --smoke-test
+
+REPORT_NAME = "mining_report.json"
+
+
+# ===========================
+# 📦 候選池
+# ===========================
+def generate_candidates(count, seed):
+    """用 generate_synthetic_data.py 的邏輯生成一批合成樣本 (同 synthetic_stream 一樣過濾禁止名單)"""
+    from src.training.synthetic_stream import generate_fixed_set
+    from src.training.generate_synthetic_data import load_generation_resources
+
+    return generate_fixed_set(load_generation_resources(), count, seed=seed)
+
+
+def tokenize_items(items, tokenizer):
+    dataset = Dataset.from_list(items)
+    return dataset.map(
+        tokenize_and_align_labels, batched=True,
+        fn_kwargs={"tokenizer": tokenizer}, remove_columns=dataset.column_names
+    )
+
+
+def _model_columns(dataset):
+    return dataset.remove_columns([c for c in dataset.column_names if c not in MODEL_INPUTS + ("length",)])
+
+
+# ===========================
+# 📏 評分
+# ===========================
+def score_examples(model, dataset, collator, batch_size=32):
+    """
+    回傳 (平均 token loss, 最小 margin)，每條樣本一個值。
+    先按長度排序再分 batch，padding 最少；只計有標籤的 token。
+    """
+    device = next(model.parameters()).device
+    lengths = np.asarray(dataset["length"])
+    order = np.argsort(lengths, kind="stable")
+    losses = np.zeros(len(dataset), dtype=np.float32)
+    margins = np.zeros(len(dataset), dtype=np.float32)
+
+    model.eval()
+    with torch.inference_mode():
+        for start in range(0, len(order), batch_size):
+            index = order[start:start + batch_size]
+            batch = collator([{k: dataset[int(i)][k] for k in MODEL_INPUTS} for i in index])
+            labels = batch.pop("labels").to(device)
+            logits = model(**{k: v.to(device) for k, v in batch.items()}).logits.float()
+
+            mask = labels != -100
+            gold = labels.clamp(min=0).unsqueeze(-1)
+            token_loss = -nn.functional.log_softmax(logits, dim=-1).gather(-1, gold).squeeze(-1)
+            gold_logit = logits.gather(-1, gold).squeeze(-1)
+            other_logit = logits.scatter(-1, gold, float("-inf")).max(dim=-1).values
+            token_margin = gold_logit - other_logit
+
+            count = mask.sum(dim=1).clamp(min=1)
+            losses[index] = ((token_loss * mask).sum(dim=1) / count).cpu().numpy()
+            margins[index] = token_margin.masked_fill(~mask, float("inf")).min(dim=1).values.cpu().numpy()
+    return losses, margins
+
+
+def selection_size(total, keep_fraction, floor_fraction):
+    """每輪揀幾多條 (熱身輪同挖掘輪一樣)，用嚟預先計總步數"""
+    keep = int(round(total * keep_fraction))
+    return keep + min(total - keep, int(round(total * floor_fraction)))
+
+
+def select_examples(losses, margins, criterion, keep_fraction, floor_fraction, rng):
+    """最難的 keep_fraction + 其餘樣本中隨機 floor_fraction (都以成個候選池計)"""
+    total = len(losses)
+    hardness = losses if criterion == "loss" else -margins
+    keep = int(round(total * keep_fraction))
+    ranked = np.argsort(-hardness, kind="stable")
+    hard, rest = ranked[:keep], ranked[keep:]
+    floor = rng.choice(rest, size=selection_size(total, keep_fraction, floor_fraction) - keep, replace=False)
+    return np.sort(np.concatenate([hard, floor])), len(hard), len(floor)
+
+
+def evaluate_f1(model, dataset, collator, batch_size=32):
+    device = next(model.parameters()).device
+    acc = evaluate_model(model, DataLoader(dataset, batch_size=batch_size, collate_fn=collator), device)
+    return round(acc.compute()["f1"], 4)
+
+
+# ===========================
+# 🚀 訓練一輪
+# ===========================
+def steps_per_round(examples, batch_size, grad_accum):
+    """同 Trainer 一樣計一個 epoch 的 optimizer 步數"""
+    return max(1, math.ceil(math.ceil(examples / batch_size) / grad_accum))
+
+
+def build_optimizer(model, learning_rate, total_steps, weight_decay=0.05, warmup_ratio=0.1):
+    """
+    全部輪次共用的 AdamW + cosine schedule (同 train_lora.py 的設定一樣，但按所有輪次的總步數計)。
+    提早達到目標 F1 就停喺 schedule 中途；步數超出預計亦只會停喺最低 learning rate。
+    """
+    decay, no_decay = [], []
+    for name, param in model.named_parameters():
+        if param.requires_grad:
+            (no_decay if "bias" in name or "LayerNorm" in name else decay).append(param)
+    optimizer = torch.optim.AdamW(
+        [{"params": decay, "weight_decay": weight_decay}, {"params": no_decay, "weight_decay": 0.0}],
+        lr=learning_rate,
+    )
+    warmup_steps = math.ceil(total_steps * warmup_ratio)
+
+    def lr_lambda(step):
+        if step < warmup_steps:
+            return step / max(1, warmup_steps)
+        progress = min(1.0, (step - warmup_steps) / max(1, total_steps - warmup_steps))
+        return 0.5 * (1.0 + math.cos(math.pi * progress))
+
+    return optimizer, LambdaLR(optimizer, lr_lambda)
+
+
+def train_round(model, tokenizer, train_dataset, work_dir, optimizers, batch_size, grad_accum,
+                log_path=DEFAULT_LOG_PATH, report_to="tensorboard", run_id=None, step_offset=0, round_index=None):
+    """
+    用揀中的樣本訓練一個 epoch (同 train_lora.py 一樣的 loss 設定)。
+    optimizers = build_optimizer() 的 (optimizer, scheduler)，每輪沿用，Adam 狀態及 schedule 跨輪延續。
+    每輪一個新 Trainer，global_step 由 0 計起：遙測記錄用同一個 run_id，step 加上 step_offset 接續落去。
+    """
+    args = TrainingArguments(
+        output_dir=work_dir,
+        save_strategy="no",
+        eval_strategy="no",
+        # learning rate / schedule / weight decay 由 optimizers 決定
+        num_train_epochs=1,
+        label_smoothing_factor=0.1,
+        per_device_train_batch_size=batch_size,
+        gradient_accumulation_steps=grad_accum,
+        group_by_length=True,
+        length_column_name="length",
+        remove_unused_columns=False,
+        logging_steps=10,
+        fp16=torch.cuda.is_available(),
+        report_to=report_to,
+    )
+    trainer = PIITrainer(
+        model=model,
+        args=args,
+        train_dataset=train_dataset,
+        tokenizer=tokenizer,
+        data_collator=TokenClassificationCollator(tokenizer, pad_to_multiple_of=8),
+        optimizers=optimizers,
+        callbacks=[LogCallback(log_path=log_path, run_id=run_id, step_offset=step_offset,
+                               extra={"round": round_index})],
+    )
+    trainer.train()
+    return trainer.state.global_step
+
+
+def format_report(report):
+    lines = ["| 輪 | 揀選方式 | 訓練樣本 | 訓練 token | 累計 token | 全量累計 token | F1 |",
+             "|---|---|---|---|---|---|---|"]
+    for r in report["rounds"]:
+        lines.append(
+            f"| {r['round']} | {r['selection']} | {r['examples']:,} / {r['pool_examples']:,} | {r['tokens']:,} | "
+            f"{r['cumulative_tokens']:,} | {r['full_pool_cumulative_tokens']:,} | {r['f1']:.4f} |"
+        )
+    summary = report["summary"]
+    lines.append(f"\n訓練 token 只係全量的 {summary['token_ratio']:.1%} (減少 {summary['data_reduction']:.1%})，"
+                 f"最終 F1 {summary['final_f1']:.4f}，最佳 F1 {summary['best_f1']:.4f} (第 {summary['best_round']} 輪)")
+    if summary.get("target_f1") is not None:
+        reached = summary["rounds_to_target"]
+        lines.append(f"目標 F1 {summary['target_f1']}：" + (f"第 {reached} 輪達到" if reached else "未達到"))
+    return "\n".join(lines)
+
+
+# ===========================
+# ⛏️ 主流程
+# ===========================
+def mine(inputs=("train_data_lora_cleaned.json",), base_model_name=BASE_MODEL_NAME, init_adapter=None,
+         output_dir=MINED_LORA_MODEL_PATH, rounds=5, keep_fraction=0.2, floor_fraction=0.05, criterion="loss",
+         synthetic=0, target_f1=None, learning_rate=2e-5, batch_size=4, grad_accum=2, score_batch_size=32,
+         seed=SPLIT_SEED, dataset_cache_dir=DATASET_CACHE_DIR, work_dir="./mining_out", log_path=DEFAULT_LOG_PATH,
+         report_to="tensorboard"):
+    start = time.time()
+    rng = np.random.default_rng(seed)
+    tokenizer = AutoTokenizer.from_pretrained(init_adapter or base_model_name)
+
+    # 1. 數據：訓練集做候選池，測試集固定用嚟評估 (同 train_lora.py 一樣的切分及快取)
+    splits = load_distill_splits(inputs, tokenizer, seed=seed, cache_dir=dataset_cache_dir)
+    real_pool = _model_columns(splits["train"])
+    test_split = splits["test"].remove_columns([c for c in splits["test"].column_names if c not in MODEL_INPUTS])
+    collator = DataCollatorForTokenClassification(tokenizer, pad_to_multiple_of=8)
+
+    # 2. 模型：由零開始 (新 LoRA) 或由現有 adapter 繼續
+    if init_adapter:
+        print(f"📦 由現有 adapter 繼續: {init_adapter}")
+        model = load_parent_model(init_adapter, base_model_name)
+    else:
+        model = build_lora_model(base_model_name)
+    model.print_trainable_parameters()
+    model.to("cuda" if torch.cuda.is_available() else "cpu")
+
+    report = {
+        "config": {
+            "inputs": [os.path.abspath(p) for p in inputs],
+            "base_model": base_model_name,
+            "init_adapter": os.path.abspath(init_adapter) if init_adapter else None,
+            "rounds": rounds,
+            "keep_fraction": keep_fraction,
+            "floor_fraction": floor_fraction,
+            "criterion": criterion,
+            "synthetic_per_round": synthetic,
+            "learning_rate": learning_rate,
+        },
+        "initial_f1": evaluate_f1(model, test_split, collator, score_batch_size),
+        "rounds": [],
+    }
+    print(f"📊 起點 F1: {report['initial_f1']:.4f}")
+
+    # 所有輪次共用一個 optimizer / schedule：候選池大小固定，所以總步數可以預先計
+    pool_size = len(real_pool) + synthetic
+    planned_steps = rounds * steps_per_round(
+        selection_size(pool_size, keep_fraction, floor_fraction), batch_size, grad_accum
+    )
+    optimizers = build_optimizer(model, learning_rate, planned_steps)
+    report["config"]["planned_steps"] = planned_steps
+
+    cumulative, full_cumulative, rounds_to_target = 0, 0, None
+    run_id, total_steps = new_run_id(), 0
+    for round_index in range(1, rounds + 1):
+        round_start = time.time()
+        pool = real_pool
+        if synthetic:
+            # 每輪一批新的合成候選 (唔同 seed)，模型唔會重複見到同一批
+            fresh = tokenize_items(generate_candidates(synthetic, seed + round_index), tokenizer)
+            pool = concatenate_datasets([real_pool, _model_columns(fresh)])
+        pool_tokens = int(np.sum(pool["length"]))
+
+        # 3. 挖掘：批量評分 -> 揀最難 + 隨機底數
+        if round_index == 1 and not init_adapter:
+            budget = selection_size(len(pool), keep_fraction, floor_fraction)
+            selected = np.sort(rng.choice(len(pool), size=budget, replace=False))
+            selection, hard_count, floor_count, score_seconds = "random (熱身)", 0, len(selected), 0.0
+        else:
+            score_start = time.time()
+            losses, margins = score_examples(model, pool, collator, score_batch_size)
+            score_seconds = time.time() - score_start
+            selected, hard_count, floor_count = select_examples(
+                losses, margins, criterion, keep_fraction, floor_fraction, rng
+            )
+            selection = criterion
+            print(f"⛏️ 第 {round_index} 輪：評分 {len(pool):,} 條 ({score_seconds:.1f}s)，"
+                  f"平均 loss {losses.mean():.4f}，揀中 {hard_count} 條困難 + {floor_count} 條隨機")
+
+        # 4. 只用揀中的樣本訓練一個 epoch
+        train_dataset = pool.select(selected)
+        tokens = int(np.sum(train_dataset["length"]))
+        steps = train_round(model, tokenizer, train_dataset, os.path.join(work_dir, f"round-{round_index}"),
+                            optimizers, batch_size, grad_accum, log_path=log_path, report_to=report_to,
+                            run_id=run_id, step_offset=total_steps, round_index=round_index)
+        total_steps += steps
+        cumulative += tokens
+        full_cumulative += pool_tokens
+
+        # 5. 評估
+        f1 = evaluate_f1(model, test_split, collator, score_batch_size)
+        report["rounds"].append({
+            "round": round_index,
+            "selection": selection,
+            "pool_examples": len(pool),
+            "examples": len(selected),
+            "hard_examples": int(hard_count),
+            "floor_examples": int(floor_count),
+            "tokens": tokens,
+            "pool_tokens": pool_tokens,
+            "cumulative_tokens": cumulative,
+            "full_pool_cumulative_tokens": full_cumulative,
+            "steps": steps,
+            "f1": f1,
+            "score_seconds": round(score_seconds, 1),
+            "round_seconds": round(time.time() - round_start, 1),
+        })
+        print(f"📊 第 {round_index} 輪 F1: {f1:.4f} (訓練 {tokens:,} / {pool_tokens:,} token)")
+        if target_f1 is not None and f1 >= target_f1:
+            rounds_to_target = round_index
+            print(f"🎯 已達到目標 F1 {target_f1}，提早結束")
+            break
+
+    best = max(report["rounds"], key=lambda r: r["f1"])
+    report["summary"] = {
+        "trained_tokens": cumulative,
+        "full_pool_tokens": full_cumulative,
+        "token_ratio": round(cumulative / max(full_cumulative, 1), 4),
+        "data_reduction": round(1 - cumulative / max(full_cumulative, 1), 4),
+        "final_f1": report["rounds"][-1]["f1"],
+        "best_f1": best["f1"],
+        "best_round": best["round"],
+        "target_f1": target_f1,
+        "rounds_to_target": rounds_to_target,
+        "train_seconds": round(time.time() - start, 1),
+    }
+
+    print(f"💾 正在儲存 adapter 至 {output_dir}...")
+    model.save_pretrained(output_dir)
+    tokenizer.save_pretrained(output_dir)
+    with open(os.path.join(output_dir, REPORT_NAME), "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print("\n" + format_report(report))
+    print(f"\n✅ 挖掘訓練完成！報告: {os.path.join(output_dir, REPORT_NAME)}")
+    return output_dir, report
+
+
+# ===========================
+# 🧪 冒煙測試 (細模型 + 玩具數據)
+# ===========================
+def smoke_test():
+    from src.training.smoke_fixtures import toy_workspace
+
+    with toy_workspace() as ws:
+        common = dict(
+            inputs=[ws.data_file], base_model_name=ws.model_path, keep_fraction=0.3, floor_fraction=0.1,
+            batch_size=4, grad_accum=1, learning_rate=1e-3, dataset_cache_dir=ws.cache_dir,
+            work_dir=ws.path("out"), log_path=ws.log_path, report_to="none",
+        )
+        first_dir, report = mine(output_dir=ws.path("mined"), rounds=2, **common)
+        summary = report["summary"]
+        assert report["rounds"][0]["selection"].startswith("random")
+        assert report["rounds"][1]["hard_examples"] > 0
+        assert summary["trained_tokens"] < summary["full_pool_tokens"]
+        # 遙測：兩輪同一個 run_id，step 接續唔會重新由 0 計
+        history = [r for r in read_history(common["log_path"]) if "loss" in r or "train_loss" in r]
+        assert {r["round"] for r in history} == {1, 2}
+        assert [r["step"] for r in history] == sorted(r["step"] for r in history)
+        # 共用 schedule：第二輪接住第一輪的 learning rate 落，唔會重新 warmup
+        assert sum(r["steps"] for r in report["rounds"]) == report["config"]["planned_steps"]
+        lrs = [r["learning_rate"] for r in history if "learning_rate" in r]
+        assert len(lrs) >= 2 and lrs == sorted(lrs, reverse=True), lrs
+
+        # 兩次訓練之間挖掘：由上一次的 adapter 繼續，第一輪已經按 margin 揀
+        _, report = mine(init_adapter=first_dir, output_dir=ws.path("mined_2"), rounds=1,
+                         criterion="margin", **common)
+        assert report["rounds"][0]["selection"] == "margin"
+    print("✅ 冒煙測試通過")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="困難樣本挖掘：每輪只用模型未識的樣本訓練")
+    parser.add_argument("--inputs", nargs="+", default=["train_data_lora_cleaned.json"])
+    parser.add_argument("--init-adapter", default=None, help="由現有 adapter 繼續 (預設由零開始新 LoRA)")
+    parser.add_argument("--output", default=MINED_LORA_MODEL_PATH)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--keep-fraction", type=float, default=0.2, help="每輪保留最難樣本的比例")
+    parser.add_argument("--floor-fraction", type=float, default=0.05, help="每輪額外隨機抽樣的比例")
+    parser.add_argument("--criterion", choices=["loss", "margin"], default="loss")
+    parser.add_argument("--synthetic", type=int, default=0, help="每輪額外生成幾多條合成候選樣本")
+    parser.add_argument("--target-f1", type=float, default=None, help="達到就提早結束")
+    parser.add_argument("--lr", type=float, default=2e-5)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--score-batch-size", type=int, default=32)
+    parser.add_argument("--smoke-test", action="store_true", help="用細模型及玩具數據跑一次完整流程")
+    cli_args = parser.parse_args()
+
+    if cli_args.smoke_test:
+        smoke_test()
+    else:
+        mine(
+            inputs=cli_args.inputs, init_adapter=cli_args.init_adapter, output_dir=cli_args.output,
+            rounds=cli_args.rounds, keep_fraction=cli_args.keep_fraction, floor_fraction=cli_args.floor_fraction,
+            criterion=cli_args.criterion, synthetic=cli_args.synthetic, target_f1=cli_args.target_f1,
+            learning_rate=cli_args.lr, batch_size=cli_args.batch_size, score_batch_size=cli_args.score_batch_size,
+        )
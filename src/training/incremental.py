@@ -0,0 +1,309 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+
+import torch
+from torch.utils.data import DataLoader
+from datasets import Dataset
+from transformers import (
+    AutoTokenizer,
+    AutoModelForTokenClassification,
+    TrainingArguments,
+    DataCollatorForTokenClassification,
+    EarlyStoppingCallback,
+)
+from peft import PeftModel
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.dirname(current_dir))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from src.config import BASE_MODEL_NAME, LABEL2ID, ID2LABEL, SPLIT_SEED
+from src.training.train_lora import (
+    PIITrainer, LogCallback, TokenClassificationCollator, load_raw_data, tokenize_and_align_labels
+)
+from src.training.streaming_metrics import SpanMetricAccumulator, preprocess_logits_for_metrics
+from src.training.dataset_cache import file_sha256
+from src.training.telemetry import DEFAULT_LOG_PATH
+
+# ===========================
+# 🔁 增量微調 (Warm-start Incremental Fine-tuning)
+# ===========================
+# 加咗新一批 news / MTR 數據，唔使再由零開始訓練 5 個 epoch：
+# - 由現有 adapter (例如 models/final_lora_model_latest) 繼續訓練，沿用佢自己的 LoRA 設定
+# - 只用新增數據 (delta) + 按比例抽樣的舊數據 (replay，防止遺忘)，短 schedule
+# - 訓練前後分別喺「舊驗證集」及「新數據驗證集」評估，生成對比報告
+# - 輸出新版本 adapter (models/final_lora_model_vN)，附 lineage.json 記錄來源
+# - 訓練後檢查 encoder 入面的 LoRA 矩陣真係有改變 (唔係得分類頭學到嘢)，結果寫入 lineage.json
+#
+# 用法：python -m src.training.train_lora --incremental <父 adapter> --delta <新數據.json>
+# 冒煙測試：python -m src.training.incremental --smoke-test
+
+MODELS_DIR = "./models"
+VERSION_PREFIX = "final_lora_model_v"
+
+
+def next_version_dir(models_dir=MODELS_DIR, prefix=VERSION_PREFIX):
+    """models/ 入面任何 *_vN 的最大 N + 1"""
+    versions = [0]
+    if os.path.isdir(models_dir):
+        for name in os.listdir(models_dir):
+            match = re.search(r"_v(\d+)$", name)
+            if match:
+                versions.append(int(match.group(1)))
+    return os.path.join(models_dir, f"{prefix}{max(versions) + 1}")
+
+
+def load_parent_model(parent_dir, base_model_name=BASE_MODEL_NAME):
+    """載入 base model + 父 adapter (可訓練)"""
+    base = AutoModelForTokenClassification.from_pretrained(
+        base_model_name,
+        num_labels=len(LABEL2ID),
+        id2label=ID2LABEL,
+        label2id=LABEL2ID,
+        ignore_mismatched_sizes=True
+    )
+    return PeftModel.from_pretrained(base, parent_dir, is_trainable=True)
+
+
+def build_incremental_splits(delta_file, old_file, replay_ratio, seed=SPLIT_SEED):
+    """
+    回傳 (訓練數據, 舊驗證集, 新數據驗證集)。
+    舊數據用同 build_tokenized_datasets 一樣的 seed 切分，replay 只會由舊訓練集抽樣。
+    注意：只有父模型都係用同一個 seed 切分 (加入 SPLIT_SEED 之後訓練，lineage.json 有 split_seed)，
+    舊驗證集先等於父模型當時的驗證集。之前的 train_test_split 冇 seed (例如 models/final_lora_model_latest)，
+    舊驗證集會有部分係父模型訓練過的數據，父模型分數會偏高 (見 parent_split_seed 的警告)。
+    """
+    delta = Dataset.from_list(load_raw_data(delta_file)).train_test_split(test_size=0.1, seed=seed)
+    old = Dataset.from_list(load_raw_data(old_file)).train_test_split(test_size=0.1, seed=seed)
+
+    replay_count = min(len(old["train"]), int(len(delta["train"]) * replay_ratio))
+    replay_idx = random.Random(seed).sample(range(len(old["train"])), replay_count)
+    train_items = list(delta["train"]) + list(old["train"].select(replay_idx))
+    random.Random(seed).shuffle(train_items)
+    print(f"🔁 增量數據：新增 {len(delta['train'])} 條 + replay {replay_count} 條舊數據")
+    return Dataset.from_list(train_items), old["test"], delta["test"], replay_count
+
+
+def parent_split_seed(parent_dir):
+    """父 adapter 的 lineage.json 記錄的切分 seed；冇記錄回傳 None"""
+    path = os.path.join(parent_dir, "lineage.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f).get("split_seed")
+
+
+def snapshot_lora(model):
+    """encoder 入面所有 LoRA 矩陣的副本 (唔包括分類頭)"""
+    return {n: p.detach().clone() for n, p in model.named_parameters() if "lora_" in n}
+
+
+def lora_change_summary(before, model):
+    """同 snapshot 比較：有幾多個 LoRA 矩陣改變咗、最大改變幅度"""
+    after = dict(model.named_parameters())
+    diffs = [float((after[n].detach() - p).abs().max()) for n, p in before.items()]
+    return {
+        "lora_tensors": len(diffs),
+        "lora_tensors_changed": sum(d > 0 for d in diffs),
+        "max_lora_change": max(diffs, default=0.0),
+    }
+
+
+def _tokenize(dataset, tokenizer):
+    return dataset.map(
+        tokenize_and_align_labels, batched=True,
+        fn_kwargs={"tokenizer": tokenizer}, remove_columns=dataset.column_names
+    )
+
+
+def evaluate_splits(model, splits, tokenizer, batch_size=16):
+    """回傳 {split 名: {overall + per-entity F1}}"""
+    from src.training.async_eval import evaluate_model
+
+    device = next(model.parameters()).device
+    collator = DataCollatorForTokenClassification(tokenizer, pad_to_multiple_of=8)
+    results = {}
+    for name, dataset in splits.items():
+        dataset = dataset.remove_columns([c for c in dataset.column_names if c == "length"])
+        acc = evaluate_model(model, DataLoader(dataset, batch_size=batch_size, collate_fn=collator), device)
+        _, _, f1 = acc.per_type()
+        results[name] = {
+            **acc.compute(),
+            "per_entity_f1": {t: round(float(f), 4) for t, f in zip(acc.types, f1)},
+            "support": int(acc.true_sum.sum()),
+        }
+    return results
+
+
+def comparison_report(parent, child):
+    """父 / 子模型在每個驗證集的分數及差距"""
+    report = {}
+    for split in parent:
+        entities = sorted(set(parent[split]["per_entity_f1"]) | set(child[split]["per_entity_f1"]))
+        report[split] = {
+            "parent_f1": round(parent[split]["f1"], 4),
+            "child_f1": round(child[split]["f1"], 4),
+            "delta_f1": round(child[split]["f1"] - parent[split]["f1"], 4),
+            "per_entity_delta_f1": {
+                e: round(child[split]["per_entity_f1"].get(e, 0.0) - parent[split]["per_entity_f1"].get(e, 0.0), 4)
+                for e in entities
+            },
+            "parent": parent[split],
+            "child": child[split],
+        }
+    return report
+
+
+def format_report(report):
+    lines = ["| 驗證集 | 父模型 F1 | 新模型 F1 | 差距 |", "|---|---|---|---|"]
+    for split, r in report.items():
+        lines.append(f"| {split} | {r['parent_f1']:.4f} | {r['child_f1']:.4f} | {r['delta_f1']:+.4f} |")
+    return "\n".join(lines)
+
+
+def train_incremental(parent_dir, delta_file, old_file="train_data_lora_cleaned.json", replay_ratio=1.0,
+                      num_train_epochs=2, learning_rate=1e-5, output_dir=None, base_model_name=BASE_MODEL_NAME,
+                      work_dir="./lora_out", log_path=DEFAULT_LOG_PATH, report_to="tensorboard"):
+    start = time.time()
+    tokenizer = AutoTokenizer.from_pretrained(base_model_name)
+    parent_seed = parent_split_seed(parent_dir)
+    if parent_seed != SPLIT_SEED:
+        print(f"⚠️ 父 adapter 冇用 SPLIT_SEED={SPLIT_SEED} 切分 (lineage.json 記錄: {parent_seed})："
+              f"old_eval 可能包括父模型訓練過的數據，父模型的 old_eval 分數會偏高。")
+
+    train_items, old_eval, delta_eval, replay_count = build_incremental_splits(delta_file, old_file, replay_ratio)
+    train_dataset = _tokenize(train_items, tokenizer)
+    eval_splits = {"old_eval": _tokenize(old_eval, tokenizer), "delta_eval": _tokenize(delta_eval, tokenizer)}
+
+    print(f"📦 載入父 adapter: {parent_dir}")
+    model = load_parent_model(parent_dir, base_model_name)
+    model.print_trainable_parameters()
+    parent_lora = snapshot_lora(model)
+
+    # 訓練前先評估父模型 (同一份權重，唔使另外載入)
+    print("📊 評估父模型...")
+    parent_scores = evaluate_splits(model, eval_splits, tokenizer)
+
+    output_dir = output_dir or next_version_dir()
+    args = TrainingArguments(
+        output_dir=os.path.join(work_dir, os.path.basename(output_dir)),
+        # 短 schedule：較細的 learning rate，每個 epoch 評估一次
+        eval_strategy="epoch",
+        save_strategy="epoch",
+        save_total_limit=2,
+        learning_rate=learning_rate,
+        num_train_epochs=num_train_epochs,
+        lr_scheduler_type="cosine",
+        warmup_ratio=0.05,
+        weight_decay=0.05,
+        label_smoothing_factor=0.1,
+        per_device_train_batch_size=4,
+        gradient_accumulation_steps=2,
+        group_by_length=True,
+        length_column_name="length",
+        remove_unused_columns=False,
+        logging_steps=10,
+        fp16=torch.cuda.is_available(),
+        gradient_checkpointing=True,
+        # non-reentrant 先會計 encoder 入面 LoRA 的梯度 (見 train_lora.py)
+        gradient_checkpointing_kwargs={"use_reentrant": False},
+        load_best_model_at_end=True,
+        metric_for_best_model="f1",
+        batch_eval_metrics=True,
+        report_to=report_to,
+    )
+    trainer = PIITrainer(
+        model=model,
+        args=args,
+        train_dataset=train_dataset,
+        # 以新數據驗證集揀最佳 checkpoint；舊驗證集喺報告度睇有冇遺忘
+        eval_dataset=eval_splits["delta_eval"],
+        tokenizer=tokenizer,
+        data_collator=TokenClassificationCollator(tokenizer, pad_to_multiple_of=8),
+        compute_metrics=SpanMetricAccumulator(),
+        preprocess_logits_for_metrics=preprocess_logits_for_metrics,
+        callbacks=[EarlyStoppingCallback(early_stopping_patience=2), LogCallback(log_path=log_path)]
+    )
+    print("🚀 開始增量微調...")
+    trainer.train()
+
+    lora_change = lora_change_summary(parent_lora, model)
+    if lora_change["lora_tensors_changed"] < lora_change["lora_tensors"]:
+        print(f"⚠️ 只有 {lora_change['lora_tensors_changed']} / {lora_change['lora_tensors']} 個 LoRA 矩陣有改變 "
+              f"(gradient checkpointing 設定錯誤時 encoder 的 LoRA 會冇梯度)")
+
+    print("📊 評估新模型...")
+    child_scores = evaluate_splits(model, eval_splits, tokenizer)
+    report = comparison_report(parent_scores, child_scores)
+
+    print(f"💾 正在儲存新版本 adapter 至 {output_dir}...")
+    model.save_pretrained(output_dir)
+    tokenizer.save_pretrained(output_dir)
+    lineage = {
+        "parent": os.path.abspath(parent_dir),
+        "delta_file": os.path.abspath(delta_file),
+        "delta_sha256": file_sha256(delta_file),
+        "old_file": os.path.abspath(old_file),
+        "train_examples": len(train_items),
+        "replay_examples": replay_count,
+        # 下一次增量微調用呢個判斷 old_eval 可唔可信
+        "split_seed": SPLIT_SEED,
+        "parent_split_seed": parent_seed,
+        "num_train_epochs": num_train_epochs,
+        "learning_rate": learning_rate,
+        **lora_change,
+        "train_seconds": round(time.time() - start, 1),
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    with open(os.path.join(output_dir, "lineage.json"), "w", encoding="utf-8") as f:
+        json.dump(lineage, f, ensure_ascii=False, indent=2)
+    with open(os.path.join(output_dir, "comparison_report.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print("\n" + format_report(report))
+    print(f"\n✅ 增量微調完成 ({lineage['train_seconds']}s)！報告: {os.path.join(output_dir, 'comparison_report.json')}")
+    return output_dir, report
+
+
+# ===========================
+# 🧪 冒煙測試 (細模型 + 玩具數據：encoder 的 LoRA 要真係有訓練到)
+# ===========================
+def smoke_test():
+    from safetensors.torch import load_file
+    from src.training.smoke_fixtures import toy_workspace, write_toy_data
+    from src.training.train_lora import build_lora_model
+
+    with toy_workspace() as ws:
+        parent_dir = ws.path("parent")
+        build_lora_model(ws.model_path).save_pretrained(parent_dir)
+        delta_file = write_toy_data(ws.path("delta.json"), ws.words, count=80, seed=1)
+        output_dir, _ = train_incremental(
+            parent_dir, delta_file, old_file=ws.data_file, num_train_epochs=2, learning_rate=1e-3,
+            output_dir=ws.path("child"), base_model_name=ws.model_path, work_dir=ws.path("out"),
+            log_path=ws.log_path, report_to="none",
+        )
+        parent = load_file(os.path.join(parent_dir, "adapter_model.safetensors"))
+        child = load_file(os.path.join(output_dir, "adapter_model.safetensors"))
+        lora_keys = [k for k in parent if "lora_" in k]
+        unchanged = [k for k in lora_keys if torch.equal(parent[k], child[k])]
+        assert lora_keys and not unchanged, f"{len(unchanged)} / {len(lora_keys)} 個 LoRA 矩陣冇改變: {unchanged[:3]}"
+        with open(os.path.join(output_dir, "lineage.json"), "r", encoding="utf-8") as f:
+            lineage = json.load(f)
+        assert lineage["lora_tensors_changed"] == lineage["lora_tensors"]
+    print("✅ 冒煙測試通過 (encoder 所有 LoRA 矩陣都有更新)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="由現有 adapter 增量微調 (正式用法見 train_lora.py --incremental)")
+    parser.add_argument("--smoke-test", action="store_true", help="用細模型及玩具數據跑一次完整流程")
+    cli_args = parser.parse_args()
+    if cli_args.smoke_test:
+        smoke_test()
+    else:
+        parser.print_help()
@@ -0,0 +1,101 @@
+import os
+import sys
+import time
+import json
+import random
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.dirname(current_dir))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+# ===========================
+# 🏷️ Subword 標籤對齊
+# ===========================
+# 策略 (與原本一致)：
+# - 特殊 token (<s>, </s>) -> -100
+# - 每個字的第一個 subword 及後續 subword 都用該字的標籤
+
+
+def align_labels_reference(batch_word_ids, batch_labels):
+    """原本逐 token 的 Python 版本 (保留作對照及測試用)"""
+    labels = []
+    for word_ids, label in zip(batch_word_ids, batch_labels):
+        previous_word_idx = None
+        label_ids = []
+        for word_idx in word_ids:
+            if word_idx is None:
+                label_ids.append(-100)
+            elif word_idx != previous_word_idx:
+                label_ids.append(label[word_idx])
+            else:
+                label_ids.append(label[word_idx])
+            previous_word_idx = word_idx
+        labels.append(label_ids)
+    return labels
+
+
+def align_labels(batch_word_ids, batch_labels):
+    """
+    快速版：每句一個 list comprehension，冇 previous_word_idx 狀態亦冇分支重複。
+    (NumPy 版本試過：word_ids 本身係 Python list，轉成 array 的成本比對齊本身更高，
+    連同 Arrow 寫入計都冇加速，所以保留純 Python 的單次掃描。)
+    """
+    return [
+        [label[word_idx] if word_idx is not None else -100 for word_idx in word_ids]
+        for word_ids, label in zip(batch_word_ids, batch_labels)
+    ]
+
+
+def batch_word_ids(tokenized_inputs, batch_size):
+    """從 Fast Tokenizer 的輸出取出每句的 word_ids"""
+    return [tokenized_inputs.word_ids(batch_index=i) for i in range(batch_size)]
+
+
+# ===========================
+# 🧪 測試 + Benchmark
+# ===========================
+if __name__ == "__main__":
+    from transformers import AutoTokenizer
+    from src.config import BASE_MODEL_NAME, MAX_SEQ_LENGTH
+
+    input_file = sys.argv[1] if len(sys.argv) > 1 else "train_data_lora_cleaned.json"
+    tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL_NAME)
+
+    if os.path.exists(input_file):
+        with open(input_file, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+        data = raw["data"] if isinstance(raw, dict) and "data" in raw else raw
+    else:
+        print(f"⚠️ 找不到 {input_file}，改用隨機生成的樣本。")
+        rng = random.Random(0)
+        words = ["李嘉誠", "住", "喺", "Man", "Yee", "Building", "9123", "4567", "R123456(7)", "，"]
+        data = []
+        for _ in range(2000):
+            tokens = [rng.choice(words) for _ in range(rng.randint(5, 60))]
+            data.append({"tokens": tokens, "ner_tags": [rng.randint(0, 14) for _ in tokens]})
+
+    batch_size = 1000
+    total_ref, total_fast = 0.0, 0.0
+    for start in range(0, len(data), batch_size):
+        batch = data[start:start + batch_size]
+        tokenized = tokenizer(
+            [d["tokens"] for d in batch], is_split_into_words=True,
+            truncation=True, max_length=MAX_SEQ_LENGTH
+        )
+        word_ids = batch_word_ids(tokenized, len(batch))
+        labels = [d["ner_tags"] for d in batch]
+
+        t0 = time.perf_counter()
+        expected = align_labels_reference(word_ids, labels)
+        t1 = time.perf_counter()
+        actual = align_labels(word_ids, labels)
+        t2 = time.perf_counter()
+
+        assert actual == expected, f"❌ 第 {start} 批標籤對齊結果不一致"
+        total_ref += t1 - t0
+        total_fast += t2 - t1
+
+    print(f"✅ {len(data)} 條樣本：快速版結果與原版完全一致")
+    print(f"⏱️ 原版: {total_ref * 1000:.1f} ms | 快速版: {total_fast * 1000:.1f} ms | "
+          f"加速 {total_ref / max(total_fast, 1e-9):.1f}x")
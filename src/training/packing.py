@@ -0,0 +1,115 @@
+import os
+import sys
+import random
+
+import torch
+from datasets import Dataset
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.dirname(current_dir))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from src.config import MAX_SEQ_LENGTH
+
+# ===========================
+# 📦 序列打包 (Sequence Packing)
+# ===========================
+# 合成數據大部分只有 20~60 個 token，將多句拼成一個 MAX_SEQ_LENGTH 的窗口，
+# 每次 forward 幾乎全部都係真實 token。
+# - 每句保留自己的 <s> ... </s>，邊界 token 的標籤本身就係 -100
+# - segment_ids 標記每個 token 屬於窗口內第幾句 (0 = padding)，
+#   Collator 用佢生成 block-diagonal attention mask，句與句之間互相睇唔到
+# - position_ids 每句重新由 padding_idx + 1 開始 (同 RoBERTa 預設一致)
+
+
+def pack_examples(input_ids_list, labels_list, max_length=MAX_SEQ_LENGTH, position_offset=2, seed=42):
+    """
+    Next-fit 打包：按隨機次序將句子放入窗口，放唔落就開新窗口。
+    回傳 dict (input_ids, labels, position_ids, segment_ids, length)。
+    """
+    order = list(range(len(input_ids_list)))
+    random.Random(seed).shuffle(order)
+
+    packed = {"input_ids": [], "labels": [], "position_ids": [], "segment_ids": [], "length": []}
+    current = {"input_ids": [], "labels": [], "position_ids": [], "segment_ids": []}
+    segment = 0
+
+    def flush():
+        if current["input_ids"]:
+            for key in current:
+                packed[key].append(current[key])
+            packed["length"].append(len(current["input_ids"]))
+
+    for idx in order:
+        ids = input_ids_list[idx][:max_length]
+        labels = labels_list[idx][:max_length]
+        if len(current["input_ids"]) + len(ids) > max_length:
+            flush()
+            current = {"input_ids": [], "labels": [], "position_ids": [], "segment_ids": []}
+            segment = 0
+        segment += 1
+        current["input_ids"].extend(ids)
+        current["labels"].extend(labels)
+        current["position_ids"].extend(range(position_offset, position_offset + len(ids)))
+        current["segment_ids"].extend([segment] * len(ids))
+    flush()
+    return packed
+
+
+def pack_dataset(tokenized_dataset, tokenizer, max_length=MAX_SEQ_LENGTH, seed=42):
+    """將已 tokenize 的 Dataset 打包成固定長度窗口"""
+    # RoBERTa 的 position id 由 padding_idx + 1 開始
+    position_offset = tokenizer.pad_token_id + 1
+    packed = pack_examples(
+        tokenized_dataset["input_ids"], tokenized_dataset["labels"],
+        max_length=max_length, position_offset=position_offset, seed=seed
+    )
+    real_tokens = sum(packed["length"])
+    capacity = len(packed["length"]) * max_length
+    print(f"📦 序列打包：{len(tokenized_dataset)} 句 -> {len(packed['length'])} 個窗口 "
+          f"(窗口使用率 {real_tokens / max(capacity, 1):.1%})")
+    return Dataset.from_dict(packed)
+
+
+class PackedDataCollator:
+    """
+    打包數據的 Collator：補齊至 batch 最長窗口，並由 segment_ids 生成
+    [batch, seq, seq] 的 block-diagonal attention mask。
+    未打包的樣本 (例如評估集) 當作只有一句處理，所以同一個 Collator 可以通用。
+    """
+
+    def __init__(self, tokenizer, pad_to_multiple_of=8):
+        self.pad_token_id = tokenizer.pad_token_id
+        self.position_offset = tokenizer.pad_token_id + 1
+        self.pad_to_multiple_of = pad_to_multiple_of
+
+    def _fields(self, feature):
+        length = len(feature["input_ids"])
+        segment_ids = feature.get("segment_ids") or [1] * length
+        position_ids = feature.get("position_ids") or list(range(self.position_offset, self.position_offset + length))
+        return feature["input_ids"], feature["labels"], position_ids, segment_ids
+
+    def __call__(self, features):
+        rows = [self._fields(f) for f in features]
+        max_len = max(len(r[0]) for r in rows)
+        if self.pad_to_multiple_of:
+            max_len = ((max_len + self.pad_to_multiple_of - 1) // self.pad_to_multiple_of) * self.pad_to_multiple_of
+
+        def pad(column, value):
+            return [list(r[column]) + [value] * (max_len - len(r[column])) for r in rows]
+
+        input_ids = torch.tensor(pad(0, self.pad_token_id), dtype=torch.long)
+        labels = torch.tensor(pad(1, -100), dtype=torch.long)
+        position_ids = torch.tensor(pad(2, self.pad_token_id), dtype=torch.long)
+        segment_ids = torch.tensor(pad(3, 0), dtype=torch.long)
+
+        # 同一句 (相同 segment，且唔係 padding) 先可以互相 attend
+        attention_mask = (segment_ids.unsqueeze(2) == segment_ids.unsqueeze(1)) & (segment_ids.unsqueeze(2) > 0)
+
+        return {
+            "input_ids": input_ids,
+            "labels": labels,
+            "position_ids": position_ids,
+            "attention_mask": attention_mask.long(),
+        }
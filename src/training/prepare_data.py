@@ -1,4 +1,5 @@
 # src/training/prepare_data.py
+import argparse
 import json
 import os
 import random
@@ -87,7 +88,67 @@ def is_clean(item, forbidden_set):
                 
     return True
 
+# 各來源的抽樣權重 (以前用 `news * 10` 複製數據實現)
+SOURCE_WEIGHTS = {"synthetic": 1, "news": 10, "novel": 1, "mtr": 10}
+
+# 負樣本目標比例 (相對正樣本數)
+NEG_RATIO = 0.35
+
+def is_positive(item):
+    return any(t != O_ID for t in item['ner_tags'])
+
+def balance_weighted_sources(sources):
+    """
+    分片模式的數據平衡：按「權重 x 樣本數」計算正負比例，
+    超出 NEG_RATIO 時按相同比例削減每個來源的負樣本 (數據唔再複製)。
+    """
+    weighted_pos = sum(w * sum(1 for d in items if is_positive(d)) for items, w in sources.values())
+    weighted_neg = sum(w * sum(1 for d in items if not is_positive(d)) for items, w in sources.values())
+    target_neg = int(weighted_pos * NEG_RATIO)
+    print(f"   - 加權分佈 -> 正樣本: {weighted_pos} | 負樣本: {weighted_neg}")
+
+    if weighted_neg <= target_neg:
+        print(f"   - ✅ 負樣本數量健康，無需削減。")
+        return sources
+
+    keep_frac = target_neg / weighted_neg
+    print(f"   - ✂️ 每個來源的負樣本保留 {keep_frac:.1%}")
+    balanced = {}
+    for name, (items, weight) in sources.items():
+        pos = [d for d in items if is_positive(d)]
+        neg = [d for d in items if not is_positive(d)]
+        balanced[name] = (pos + random.sample(neg, int(len(neg) * keep_frac)), weight)
+    return balanced
+
+def write_shards(out_dir, synthetic_cleaned, news, novel, mtr):
+    """
+    🧩 分片模式：每個來源各自寫成 JSONL 分片 + 權重，唔再複製數據，
+    並直接套用 clean_and_augment 的清洗及負面樣本注入。
+    """
+    from src.training.clean_and_augment import fix_bad_entities, convert_samples_to_ids, NEGATIVE_SAMPLES_RAW
+    from src.training.sharded_data import write_sharded_corpus
+
+    sources = {
+        "synthetic": (synthetic_cleaned, SOURCE_WEIGHTS["synthetic"]),
+        "news": (news, SOURCE_WEIGHTS["news"]),
+        "novel": (novel, SOURCE_WEIGHTS["novel"]),
+        "mtr": (mtr, SOURCE_WEIGHTS["mtr"]),
+    }
+    print("⚖️ 正在執行數據平衡 (按權重計算)...")
+    sources = balance_weighted_sources(sources)
+
+    sources = {name: (fix_bad_entities(items), w) for name, (items, w) in sources.items() if items}
+    sources["augment"] = (convert_samples_to_ids(NEGATIVE_SAMPLES_RAW), 1)
+
+    write_sharded_corpus(sources, out_dir)
+    print(f"🚀 分片數據已生成：{out_dir} (訓練: python -m src.training.train_lora --shards {out_dir}/manifest.json)")
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="整合原始數據")
+    parser.add_argument("--shards", default=None, metavar="OUT_DIR",
+                        help="輸出分片 JSONL (按權重抽樣，唔複製數據)，而唔係單一 train_data_lora.json")
+    cli_args = parser.parse_args()
+
     # 1. 讀取數據
     print("📂 讀取原始數據...")
     news = load_json("./data/raw/news_data.json")
@@ -110,6 +171,10 @@ if __name__ == "__main__":
     else:
         synthetic_cleaned = []
 
+    if cli_args.shards:
+        write_shards(cli_args.shards, synthetic_cleaned, news, novel, mtr)
+        sys.exit(0)
+
     # 4. 按權重合併
     all_training_data = []
     
@@ -117,7 +182,7 @@ if __name__ == "__main__":
     all_training_data.extend(synthetic_cleaned)
     
     # 新聞數據 (x10)
-    if news: all_training_data.extend(news * 10)
+    if news: all_training_data.extend(news * SOURCE_WEIGHTS["news"])
     
     # 小說數據 (x1)
     if novel: 
@@ -125,7 +190,7 @@ if __name__ == "__main__":
         all_training_data.extend(novel * 1)
     
     # 港鐵數據 (x10)
-    if mtr: all_training_data.extend(mtr * 10)
+    if mtr: all_training_data.extend(mtr * SOURCE_WEIGHTS["mtr"])
 
     # 5. 強制平衡機制 (Balancing)
     print("⚖️ 正在執行數據平衡 (Target: 負樣本佔總數 ~25%)...")
@@ -135,7 +200,7 @@ if __name__ == "__main__":
     
     print(f"   - 原始分佈 -> 正樣本: {len(pos_samples)} | 負樣本: {len(neg_samples)}")
 
-    target_neg_count = int(len(pos_samples) * 0.35) 
+    target_neg_count = int(len(pos_samples) * NEG_RATIO) 
     
     if len(neg_samples) > target_neg_count:
         print(f"   - ✂️ 削減負樣本: {len(neg_samples)} -> {target_neg_count}")
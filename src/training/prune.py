@@ -0,0 +1,282 @@
+import os
+import sys
+import copy
+import json
+import time
+import argparse
+
+import torch
+from torch.utils.data import DataLoader
+from transformers import TrainingArguments, DataCollatorForTokenClassification
+from transformers.pytorch_utils import prune_linear_layer
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.dirname(current_dir))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from src.config import LORA_MODEL_PATH, PRUNED_MODEL_PATH, DATASET_CACHE_DIR, SPLIT_SEED
+from src.inference.pipeline import PIIPipeline
+from src.training.train_lora import PIITrainer, TokenClassificationCollator, apply_lora
+from src.training.distill import load_distill_splits, score_model, MODEL_INPUTS
+
+# ===========================
+# ✂️ 結構化剪枝 (Attention Heads + FFN 通道)
+# ===========================
+# 除咗量化，另一個減 CPU latency 的方法係直接將矩陣變細：
+# - 用有標籤數據計重要性 (一階 Taylor：loss 對 head mask / FFN mask 的梯度絕對值，逐 batch 累加)
+# - Heads：每層先做 L2 正規化再全局排名，刪最唔重要的 (每層最少保留 1 個)；
+#   用 HF 內建 prune_heads，config.pruned_heads 會跟住存檔，from_pretrained 自動重建細矩陣
+# - FFN：config 只有一個 intermediate_size，所以每層刪同樣數量 (各層自己揀最唔重要的通道)
+# - 可選：短暫 LoRA 恢復微調，之後 merge 返入權重，輸出仍然係普通 HF 模型
+# - 掃描多個剪枝比例，報告 F1 / latency；揀 F1 跌幅 <= max_f1_drop 之中剪得最多的存檔
+#
+# 用法：python -m src.training.prune --ratios 0.1 0.2 0.3 0.4 --max-f1-drop 0.01
+# 冒煙測試：python -m src.training.prune --smoke-test
+
+REPORT_NAME = "prune_report.json"
+
+
+def _layers(model):
+    return model.base_model.encoder.layer
+
+
+def collect_importance(model, dataloader, device):
+    """回傳 (head_scores [層數, heads], ffn_scores [每層一個 [intermediate_size]])"""
+    config = model.config
+    layers = _layers(model)
+    requires_grad = [p.requires_grad for p in model.parameters()]
+    for p in model.parameters():
+        p.requires_grad_(False)
+
+    head_mask = torch.ones(config.num_hidden_layers, config.num_attention_heads, device=device, requires_grad=True)
+    ffn_masks = [torch.ones(layer.intermediate.dense.out_features, device=device, requires_grad=True)
+                 for layer in layers]
+    hooks = [
+        layer.intermediate.register_forward_hook(lambda module, args, output, mask=mask: output * mask)
+        for layer, mask in zip(layers, ffn_masks)
+    ]
+    head_scores = torch.zeros_like(head_mask)
+    ffn_scores = [torch.zeros_like(mask) for mask in ffn_masks]
+
+    # eval 模式：冇 dropout，重要性只反映權重本身
+    model.eval()
+    try:
+        for batch in dataloader:
+            loss = model(**{k: v.to(device) for k, v in batch.items()}, head_mask=head_mask).loss
+            loss.backward()
+            head_scores += head_mask.grad.abs()
+            head_mask.grad = None
+            for score, mask in zip(ffn_scores, ffn_masks):
+                score += mask.grad.abs()
+                mask.grad = None
+    finally:
+        for hook in hooks:
+            hook.remove()
+        for p, flag in zip(model.parameters(), requires_grad):
+            p.requires_grad_(flag)
+    return head_scores.detach().cpu(), [s.detach().cpu() for s in ffn_scores]
+
+
+def select_heads(head_scores, ratio):
+    """每層 L2 正規化後全局排名，回傳 {層: [要刪的 heads]}"""
+    num_layers, num_heads = head_scores.shape
+    normalized = head_scores / head_scores.norm(dim=1, keepdim=True).clamp_min(1e-12)
+    target = int(num_layers * num_heads * ratio)
+    remaining = [num_heads] * num_layers
+    heads_to_prune = {}
+    for flat in normalized.flatten().argsort().tolist():
+        if target <= 0:
+            break
+        layer, head = divmod(flat, num_heads)
+        if remaining[layer] > 1:
+            heads_to_prune.setdefault(layer, []).append(head)
+            remaining[layer] -= 1
+            target -= 1
+    return heads_to_prune
+
+
+def prune_model(model, head_scores, ffn_scores, ratio, multiple_of=8):
+    """複製一份模型，按 ratio 刪 heads 及 FFN 通道 (矩陣真正變細)"""
+    pruned = copy.deepcopy(model)
+    heads_to_prune = select_heads(head_scores, ratio)
+    if heads_to_prune:
+        pruned.prune_heads(heads_to_prune)
+
+    intermediate_size = model.config.intermediate_size
+    # FFN 保留數量取 multiple_of 的倍數，矩陣乘法對齊較好
+    keep = max(multiple_of, int(intermediate_size * (1 - ratio)) // multiple_of * multiple_of)
+    if keep < intermediate_size:
+        for layer, scores in zip(_layers(pruned), ffn_scores):
+            index = scores.argsort(descending=True)[:keep].sort().values.to(layer.intermediate.dense.weight.device)
+            layer.intermediate.dense = prune_linear_layer(layer.intermediate.dense, index, dim=0)
+            layer.output.dense = prune_linear_layer(layer.output.dense, index, dim=1)
+        pruned.config.intermediate_size = keep
+    return pruned
+
+
+def recover(model, tokenizer, train_dataset, max_steps, work_dir, learning_rate=1e-4, batch_size=8,
+            report_to="tensorboard"):
+    """短暫 LoRA 恢復微調，完成後 merge 返入權重"""
+    peft_model = apply_lora(model)
+    args = TrainingArguments(
+        output_dir=work_dir,
+        save_strategy="no",
+        eval_strategy="no",
+        learning_rate=learning_rate,
+        max_steps=max_steps,
+        lr_scheduler_type="cosine",
+        warmup_ratio=0.05,
+        per_device_train_batch_size=batch_size,
+        group_by_length=True,
+        length_column_name="length",
+        remove_unused_columns=False,
+        logging_steps=10,
+        fp16=torch.cuda.is_available(),
+        report_to=report_to,
+    )
+    trainer = PIITrainer(
+        model=peft_model,
+        args=args,
+        train_dataset=train_dataset,
+        tokenizer=tokenizer,
+        data_collator=TokenClassificationCollator(tokenizer, pad_to_multiple_of=8),
+    )
+    trainer.train()
+    return peft_model.merge_and_unload().eval()
+
+
+def format_report(rows):
+    lines = ["| 剪枝比例 | Heads | FFN | 參數量 | F1 | F1 差距 | 逐句 latency (ms) | 加速 |",
+             "|---|---|---|---|---|---|---|---|"]
+    base = rows[0]
+    for r in rows:
+        lines.append(
+            f"| {r['ratio']:.2f} | {r['heads']} | {r['intermediate_size']} | {r['parameters']:,} | {r['f1']:.4f} | "
+            f"{r['f1'] - base['f1']:+.4f} | {r['latency_ms_per_sentence']:.1f} | "
+            f"{base['latency_ms_per_sentence'] / r['latency_ms_per_sentence']:.2f}x |"
+        )
+    return "\n".join(lines)
+
+
+def _summary(model, ratio, scores):
+    config = model.config
+    pruned_heads = sum(len(h) for h in config.pruned_heads.values())
+    return {
+        "ratio": ratio,
+        "heads": config.num_hidden_layers * config.num_attention_heads - pruned_heads,
+        "intermediate_size": config.intermediate_size,
+        **{k: v for k, v in scores.items() if k != "per_label_f1"},
+        "per_label_f1": scores["per_label_f1"],
+    }
+
+
+def prune_sweep(model_path=LORA_MODEL_PATH, inputs=("train_data_lora_cleaned.json",), ratios=(0.1, 0.2, 0.3, 0.4),
+                max_f1_drop=0.01, recovery_steps=0, score_samples=512, batch_size=8, output_dir=PRUNED_MODEL_PATH,
+                dataset_cache_dir=DATASET_CACHE_DIR, work_dir="./prune_out", report_to="tensorboard"):
+    start = time.time()
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+
+    # 1. 合併後的模型 (同推論一樣經 PIIPipeline 載入)
+    pii_pipe = PIIPipeline(model_path=model_path, backend="eager", use_profile=False)
+    model, tokenizer = pii_pipe.model.to(device), pii_pipe.tokenizer
+
+    splits = load_distill_splits(inputs, tokenizer, cache_dir=dataset_cache_dir)
+    collator = DataCollatorForTokenClassification(tokenizer, pad_to_multiple_of=8)
+    train_split = splits["train"]
+    score_split = train_split.shuffle(seed=SPLIT_SEED).select(range(min(score_samples, len(train_split))))
+    score_split = score_split.remove_columns([c for c in score_split.column_names if c not in MODEL_INPUTS])
+    test_split = splits["test"].remove_columns([c for c in splits["test"].column_names if c not in MODEL_INPUTS])
+
+    # 2. 重要性 (只計一次，所有比例共用)
+    print(f"🔍 正在用 {len(score_split)} 句計算 heads / FFN 通道重要性...")
+    head_scores, ffn_scores = collect_importance(
+        model, DataLoader(score_split, batch_size=batch_size, collate_fn=collator), device
+    )
+
+    # 3. 掃描剪枝比例
+    print("📊 評估原本模型...")
+    rows = [_summary(model, 0.0, score_model(model, test_split, collator, device, batch_size))]
+    best_ratio, best_model = None, None
+    for ratio in sorted(ratios):
+        print(f"✂️ 剪枝比例 {ratio:.2f}...")
+        pruned = prune_model(model, head_scores, ffn_scores, ratio)
+        if recovery_steps:
+            print(f"🩹 LoRA 恢復微調 {recovery_steps} 步...")
+            pruned = recover(pruned, tokenizer, train_split, recovery_steps, os.path.join(work_dir, f"ratio_{ratio}"),
+                             batch_size=batch_size, report_to=report_to)
+        rows.append(_summary(pruned, ratio, score_model(pruned, test_split, collator, device, batch_size)))
+        print(f"   -> F1 {rows[-1]['f1']:.4f}，逐句 {rows[-1]['latency_ms_per_sentence']:.1f} ms")
+        if rows[0]["f1"] - rows[-1]["f1"] <= max_f1_drop:
+            best_ratio, best_model = ratio, pruned
+
+    report = {
+        "rows": rows,
+        "selected_ratio": best_ratio,
+        "config": {
+            "model": os.path.abspath(model_path),
+            "inputs": [os.path.abspath(p) for p in inputs],
+            "max_f1_drop": max_f1_drop,
+            "recovery_steps": recovery_steps,
+            "score_samples": len(score_split),
+            "seconds": round(time.time() - start, 1),
+        },
+    }
+    print("\n" + format_report(rows))
+
+    # 4. 存檔 (完整 HF 模型；config.pruned_heads / intermediate_size 記錄咗剪枝後的形狀)
+    if best_model is None:
+        print(f"\n⚠️ 冇任何剪枝比例的 F1 跌幅 <= {max_f1_drop}，唔儲存模型。")
+        os.makedirs(work_dir, exist_ok=True)
+        report_path = os.path.join(work_dir, REPORT_NAME)
+    else:
+        print(f"\n💾 正在儲存剪枝比例 {best_ratio:.2f} 的模型至 {output_dir}...")
+        best_model.save_pretrained(output_dir)
+        tokenizer.save_pretrained(output_dir)
+        report_path = os.path.join(output_dir, REPORT_NAME)
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"✅ 剪枝完成！報告: {report_path}")
+    return report
+
+
+def smoke_test():
+    from src.training.smoke_fixtures import toy_workspace
+
+    with toy_workspace("teacher") as ws:
+        output_dir = ws.path("pruned")
+        report = prune_sweep(
+            model_path=ws.model_path, inputs=[ws.data_file], ratios=(0.25, 0.5), max_f1_drop=1.0,
+            recovery_steps=5, score_samples=64, output_dir=output_dir,
+            dataset_cache_dir=ws.cache_dir, work_dir=ws.path("out"), report_to="none",
+        )
+        assert report["rows"][-1]["parameters"] < report["rows"][0]["parameters"]
+        # 剪枝後的模型要經 PIIPipeline 載入到，形狀同存檔時一樣
+        pipe = PIIPipeline(model_path=output_dir, backend="eager", use_profile=False)
+        assert pipe.model.config.intermediate_size == report["rows"][-1]["intermediate_size"]
+        print(pipe.predict(ws.sample_text()))
+    print("✅ 冒煙測試通過")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="合併後模型的結構化剪枝 (attention heads + FFN 通道)")
+    parser.add_argument("--model", default=LORA_MODEL_PATH, help="PIIPipeline 可載入的模型資料夾")
+    parser.add_argument("--inputs", nargs="+", default=["train_data_lora_cleaned.json"])
+    parser.add_argument("--ratios", nargs="+", type=float, default=[0.1, 0.2, 0.3, 0.4],
+                        help="每個比例同時套用喺 heads 及 FFN 通道")
+    parser.add_argument("--max-f1-drop", type=float, default=0.01, help="可接受的最大 F1 跌幅")
+    parser.add_argument("--recovery-steps", type=int, default=0, help="剪枝後 LoRA 恢復微調步數 (0 = 唔做)")
+    parser.add_argument("--score-samples", type=int, default=512, help="計重要性用的句數")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--output", default=PRUNED_MODEL_PATH)
+    parser.add_argument("--smoke-test", action="store_true", help="用細模型及玩具數據跑一次完整流程")
+    cli_args = parser.parse_args()
+
+    if cli_args.smoke_test:
+        smoke_test()
+    else:
+        prune_sweep(
+            model_path=cli_args.model, inputs=cli_args.inputs, ratios=cli_args.ratios,
+            max_f1_drop=cli_args.max_f1_drop, recovery_steps=cli_args.recovery_steps,
+            score_samples=cli_args.score_samples, batch_size=cli_args.batch_size, output_dir=cli_args.output,
+        )
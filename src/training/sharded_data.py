@@ -0,0 +1,142 @@
+import os
+import sys
+import json
+import math
+import hashlib
+
+from datasets import load_dataset, interleave_datasets
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.dirname(current_dir))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from src.config import SPLIT_SEED
+
+# ===========================
+# 🧩 分片 JSONL 數據格式 (Sharded JSONL)
+# ===========================
+# 目錄結構：
+#   <out_dir>/manifest.json
+#   <out_dir>/<source>/shard-00000.jsonl ...
+#   <out_dir>/eval.jsonl                     (固定的驗證集)
+#
+# manifest.json 記錄每個來源的權重 (weight) 及樣本數。
+# 訓練時按 weight x 樣本數 的比例抽樣，取代以前 `news * 10` 咁樣複製數據。
+
+MANIFEST_NAME = "manifest.json"
+EVAL_NAME = "eval.jsonl"
+DEFAULT_SHARD_SIZE = 10000
+DEFAULT_MIN_SHARDS = 8
+
+
+def is_eval_example(item, eval_fraction):
+    """按內容 hash 決定是否屬於驗證集：同一條數據永遠落同一邊，重跑結果一致"""
+    key = json.dumps(item["tokens"], ensure_ascii=False).encode("utf-8")
+    bucket = int(hashlib.sha1(key).hexdigest()[:8], 16) % 10000
+    return bucket < eval_fraction * 10000
+
+
+def _write_jsonl(path, items):
+    with open(path, "w", encoding="utf-8") as f:
+        for item in items:
+            f.write(json.dumps({"tokens": item["tokens"], "ner_tags": item["ner_tags"]}, ensure_ascii=False) + "\n")
+
+
+def write_sharded_corpus(sources, out_dir, eval_fraction=0.1, shard_size=DEFAULT_SHARD_SIZE, min_shards=DEFAULT_MIN_SHARDS):
+    """
+    sources: {來源名: (樣本列表, 權重)}
+    將每個來源切成多個 JSONL 分片，並抽出固定的驗證集。
+    每個來源至少 min_shards 個分片，多進程訓練時每個 rank 先可以分到唔同檔案。
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = {"sources": {}, "eval": EVAL_NAME, "eval_fraction": eval_fraction}
+    eval_items = []
+
+    for name, (items, weight) in sources.items():
+        if not items:
+            continue
+        train_items = []
+        for item in items:
+            (eval_items if is_eval_example(item, eval_fraction) else train_items).append(item)
+
+        source_dir = os.path.join(out_dir, name)
+        os.makedirs(source_dir, exist_ok=True)
+        shards = []
+        source_shard_size = max(1, min(shard_size, math.ceil(len(train_items) / min_shards)))
+        for shard_idx, start in enumerate(range(0, len(train_items), source_shard_size)):
+            shard_name = f"{name}/shard-{shard_idx:05d}.jsonl"
+            _write_jsonl(os.path.join(out_dir, shard_name), train_items[start:start + source_shard_size])
+            shards.append(shard_name)
+
+        manifest["sources"][name] = {"weight": weight, "count": len(train_items), "shards": shards}
+        print(f"🧩 {name}: {len(train_items)} 條 -> {len(shards)} 個分片 (權重 x{weight})")
+
+    _write_jsonl(os.path.join(out_dir, EVAL_NAME), eval_items)
+    manifest["eval_count"] = len(eval_items)
+    with open(os.path.join(out_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    print(f"📋 驗證集: {len(eval_items)} 條 | Manifest: {os.path.join(out_dir, MANIFEST_NAME)}")
+    return manifest
+
+
+def load_manifest(manifest_path):
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    manifest["root"] = os.path.dirname(os.path.abspath(manifest_path))
+    return manifest
+
+
+def weighted_epoch_size(manifest):
+    """一個「epoch」的等效樣本數 = Σ (權重 x 樣本數)，等同以前複製數據後的總數"""
+    return sum(s["weight"] * s["count"] for s in manifest["sources"].values())
+
+
+def load_streaming_train(manifest, shuffle_buffer=10000, seed=SPLIT_SEED):
+    """
+    逐個分片串流讀取，按 權重 x 樣本數 比例交錯抽樣，再經 shuffle buffer 打亂。
+    回傳 HuggingFace IterableDataset (未 tokenize)。
+    """
+    streams, weights = [], []
+    for name, source in manifest["sources"].items():
+        if not source["shards"]:
+            continue
+        files = [os.path.join(manifest["root"], shard) for shard in source["shards"]]
+        streams.append(load_dataset("json", data_files=files, split="train", streaming=True))
+        weights.append(source["weight"] * source["count"])
+
+    total = sum(weights)
+    probabilities = [w / total for w in weights]
+    mixed = interleave_datasets(
+        streams, probabilities=probabilities, seed=seed, stopping_strategy="all_exhausted"
+    )
+    return mixed.shuffle(seed=seed, buffer_size=shuffle_buffer)
+
+
+def load_eval(manifest):
+    eval_path = os.path.join(manifest["root"], manifest["eval"])
+    return load_dataset("json", data_files=eval_path, split="train")
+
+
+def load_sources(manifest, exclude=()):
+    """將分片全部讀入記憶體：{來源名: (樣本列表, 權重)}"""
+    sources = {}
+    for name, source in manifest["sources"].items():
+        if name in exclude:
+            continue
+        items = []
+        for shard in source["shards"]:
+            with open(os.path.join(manifest["root"], shard), "r", encoding="utf-8") as f:
+                items.extend(json.loads(line) for line in f if line.strip())
+        sources[name] = (items, source["weight"])
+    return sources
+
+
+def steps_for_examples(examples_per_epoch, epochs, batch_size, grad_accum=1, world_size=1):
+    """IterableDataset 冇長度，要自己計 max_steps"""
+    samples_per_step = batch_size * grad_accum * world_size
+    return max(1, math.ceil(examples_per_epoch * epochs / samples_per_step))
+
+
+def steps_for_epochs(manifest, epochs, batch_size, grad_accum=1, world_size=1):
+    return steps_for_examples(weighted_epoch_size(manifest), epochs, batch_size, grad_accum, world_size)
@@ -0,0 +1,95 @@
+import os
+import sys
+import json
+import random
+import tempfile
+from contextlib import contextmanager
+
+import torch
+from transformers import AutoModelForTokenClassification
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.dirname(current_dir))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from src.config import LABEL_LIST, SPLIT_SEED
+
+# ===========================
+# 🧪 冒煙測試共用夾具 (細模型 + 玩具數據)
+# ===========================
+# 各模組的 --smoke-test 都係：臨時資料夾 -> 隨機初始化的細 XLM-R -> 玩具數據 -> 跑一次完整流程。
+# 只喺 smoke_test() 入面 import，正式流程唔會載入呢個模組。
+#
+# 用法：
+#   with toy_workspace() as ws:
+#       train(model_path=ws.model_path, inputs=[ws.data_file], dataset_cache_dir=ws.cache_dir, ...)
+
+
+def build_tiny_model(target, vocab_words=200, seed=SPLIT_SEED):
+    """隨機初始化的 4 層細 XLM-R + 按空格分詞的 tokenizer，存成完整模型資料夾"""
+    from tokenizers import Tokenizer, models, pre_tokenizers, processors
+    from transformers import PreTrainedTokenizerFast, XLMRobertaConfig
+
+    specials = ["<s>", "<pad>", "</s>", "<unk>", "<mask>"]
+    words = [f"w{i}" for i in range(vocab_words)]
+    vocab = {tok: i for i, tok in enumerate(specials + words)}
+    backend = Tokenizer(models.WordLevel(vocab, unk_token="<unk>"))
+    backend.pre_tokenizer = pre_tokenizers.Whitespace()
+    backend.post_processor = processors.TemplateProcessing(
+        single="<s> $A </s>", special_tokens=[("<s>", vocab["<s>"]), ("</s>", vocab["</s>"])]
+    )
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=backend, bos_token="<s>", eos_token="</s>", unk_token="<unk>",
+        pad_token="<pad>", mask_token="<mask>", model_max_length=128
+    )
+
+    torch.manual_seed(seed)
+    config = XLMRobertaConfig(
+        vocab_size=len(vocab), hidden_size=64, num_hidden_layers=4, num_attention_heads=4,
+        intermediate_size=128, max_position_embeddings=130, pad_token_id=vocab["<pad>"],
+        bos_token_id=vocab["<s>"], eos_token_id=vocab["</s>"],
+        num_labels=len(LABEL_LIST), id2label=dict(enumerate(LABEL_LIST)),
+        label2id={l: i for i, l in enumerate(LABEL_LIST)},
+    )
+    AutoModelForTokenClassification.from_config(config).save_pretrained(target)
+    tokenizer.save_pretrained(target)
+    return words
+
+
+def write_toy_data(path, words, count=200, seed=SPLIT_SEED):
+    """隨機字 + 隨機標籤的玩具數據 (train_data_lora_cleaned.json 格式)"""
+    rng = random.Random(seed)
+    data = []
+    for _ in range(count):
+        length = rng.randint(3, 20)
+        data.append({"tokens": [rng.choice(words) for _ in range(length)],
+                     "ner_tags": [rng.randrange(len(LABEL_LIST)) for _ in range(length)]})
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    return path
+
+
+class ToyWorkspace:
+    """臨時資料夾入面的細模型、玩具數據、快取及日誌路徑"""
+
+    def __init__(self, root, model_name="base"):
+        self.root = root
+        self.model_path = self.path(model_name)
+        self.words = build_tiny_model(self.model_path)
+        self.data_file = write_toy_data(self.path("toy_data.json"), self.words)
+        self.cache_dir = self.path("cache")
+        self.log_path = self.path("training_history.jsonl")
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def sample_text(self, start=0, count=8):
+        return " ".join(self.words[start:start + count])
+
+
+@contextmanager
+def toy_workspace(model_name="base"):
+    """建立 ToyWorkspace，離開時刪走成個臨時資料夾"""
+    with tempfile.TemporaryDirectory() as tmp:
+        yield ToyWorkspace(tmp, model_name)
@@ -0,0 +1,195 @@
+import os
+import sys
+
+import numpy as np
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.dirname(current_dir))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from src.config import ID2LABEL
+
+# ===========================
+# 📏 串流式評估指標 (Span-level, 與 seqeval 預設模式一致)
+# ===========================
+# 以前 compute_metrics 要等 Trainer 收齊全部 (N, seq, num_labels) logits，
+# 再逐個 token 轉成標籤字串交畀 seqeval，記憶體同時間都隨驗證集大小增長。
+# 而家：
+# - preprocess_logits_for_metrics 每個 batch 即時 argmax，只保留 label id
+# - Trainer 開 batch_eval_metrics，每個 batch 更新一次 TP / FP / FN 計數器 (NumPy)
+# - 最後由計數器直接計 precision / recall / f1 及 per-entity 報告
+# 實體切分規則照抄 seqeval.get_entities (conlleval 寬鬆模式)，結果與原本完全一致。
+
+
+def _split_label(label):
+    # 同 seqeval：'O' 的類型當作 '_'
+    return label[0], label[1:].split("-", maxsplit=1)[-1] or "_"
+
+
+def _end_of_chunk(prev_tag, tag, prev_type, type_):
+    if prev_tag in ("E", "S"):
+        return True
+    if prev_tag in ("B", "I") and tag in ("B", "S", "O"):
+        return True
+    return prev_tag not in ("O", ".") and prev_type != type_
+
+
+def _start_of_chunk(prev_tag, tag, prev_type, type_):
+    if tag in ("B", "S"):
+        return True
+    if prev_tag in ("E", "S", "O") and tag in ("E", "I"):
+        return True
+    return tag not in ("O", ".") and prev_type != type_
+
+
+def preprocess_logits_for_metrics(logits, labels):
+    """每個 eval batch 即時 argmax：只保留 (batch, seq) 的 label id"""
+    if isinstance(logits, tuple):
+        logits = logits[0]
+    return logits.argmax(dim=-1)
+
+
+class SpanMetricAccumulator:
+    """
+    逐 batch 累積每個實體類型的 TP / 預測數 / 真實數。
+    可直接當 Trainer 的 compute_metrics 使用 (配合 batch_eval_metrics=True)。
+    """
+
+    def __init__(self, id2label=ID2LABEL, print_report=True):
+        self.print_report = print_report
+        parts = {i: _split_label(label) for i, label in id2label.items()}
+        self.types = sorted({t for tag, t in parts.values() if tag != "O"})
+        type_index = {t: k for k, t in enumerate(self.types)}
+        # 預先將 label id 轉成 (tag, type, type_index)，逐 token 唔使再處理字串
+        self._parts = {i: (tag, t, type_index.get(t, -1)) for i, (tag, t) in parts.items()}
+        self.reset()
+
+    def reset(self):
+        self.tp = np.zeros(len(self.types), dtype=np.int64)
+        self.pred_sum = np.zeros(len(self.types), dtype=np.int64)
+        self.true_sum = np.zeros(len(self.types), dtype=np.int64)
+
+    def _spans(self, ids):
+        """seqeval.get_entities 的 id 版本：回傳 {(type_index, start, end)}"""
+        spans = set()
+        prev_tag, prev_type, prev_k, begin = "O", "", -1, 0
+        for i, label_id in enumerate(ids):
+            tag, type_, k = self._parts[label_id]
+            if _end_of_chunk(prev_tag, tag, prev_type, type_):
+                spans.add((prev_k, begin, i - 1))
+            if _start_of_chunk(prev_tag, tag, prev_type, type_):
+                begin = i
+            prev_tag, prev_type, prev_k = tag, type_, k
+        if _end_of_chunk(prev_tag, "O", prev_type, "_"):
+            spans.add((prev_k, begin, len(ids) - 1))
+        return spans
+
+    def update(self, predictions, labels):
+        """predictions / labels: (batch, seq) 的 label id；-100 位置會被忽略"""
+        predictions = np.asarray(predictions)
+        labels = np.asarray(labels)
+        for pred_row, label_row in zip(predictions, labels):
+            mask = label_row != -100
+            pred_spans = self._spans(pred_row[mask].tolist())
+            true_spans = self._spans(label_row[mask].tolist())
+            for spans, counter in ((pred_spans, self.pred_sum), (true_spans, self.true_sum)):
+                if spans:
+                    np.add.at(counter, [s[0] for s in spans], 1)
+            hits = pred_spans & true_spans
+            if hits:
+                np.add.at(self.tp, [s[0] for s in hits], 1)
+
+    def per_type(self):
+        precision = np.divide(self.tp, self.pred_sum, out=np.zeros(len(self.types)), where=self.pred_sum > 0)
+        recall = np.divide(self.tp, self.true_sum, out=np.zeros(len(self.types)), where=self.true_sum > 0)
+        denom = precision + recall
+        f1 = np.divide(2 * precision * recall, denom, out=np.zeros(len(self.types)), where=denom > 0)
+        return precision, recall, f1
+
+    def compute(self):
+        tp, pred, true = int(self.tp.sum()), int(self.pred_sum.sum()), int(self.true_sum.sum())
+        precision = tp / pred if pred else 0.0
+        recall = tp / true if true else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        return {"precision": precision, "recall": recall, "f1": f1}
+
+    def report(self, digits=2):
+        """與 seqeval.classification_report 相同格式的 per-entity 報告"""
+        precision, recall, f1 = self.per_type()
+        width = max([len(t) for t in self.types] + [len("weighted avg")])
+        header = f"{'':>{width}}  {'precision':>9} {'recall':>9} {'f1-score':>9} {'support':>9}"
+        row = lambda name, p, r, f, s: f"{name:>{width}}  {p:>9.{digits}f} {r:>9.{digits}f} {f:>9.{digits}f} {s:>9}"
+
+        lines = [header, ""]
+        for k, t in enumerate(self.types):
+            lines.append(row(t, precision[k], recall[k], f1[k], int(self.true_sum[k])))
+        lines.append("")
+
+        overall = self.compute()
+        support = int(self.true_sum.sum())
+        weights = self.true_sum / support if support else np.zeros(len(self.types))
+        lines.append(row("micro avg", overall["precision"], overall["recall"], overall["f1"], support))
+        lines.append(row("macro avg", precision.mean(), recall.mean(), f1.mean(), support))
+        lines.append(row("weighted avg", (precision * weights).sum(), (recall * weights).sum(), (f1 * weights).sum(), support))
+        return "\n".join(lines)
+
+    def __call__(self, eval_pred, compute_result=True):
+        predictions, labels = eval_pred.predictions, eval_pred.label_ids
+        if hasattr(predictions, "cpu"):
+            predictions = predictions.cpu().numpy()
+        if hasattr(labels, "cpu"):
+            labels = labels.cpu().numpy()
+        if predictions.ndim == 3:
+            # 未經 preprocess_logits_for_metrics 的 logits
+            predictions = predictions.argmax(axis=-1)
+        self.update(predictions, labels)
+
+        if not compute_result:
+            return {}
+
+        results = self.compute()
+        if self.print_report:
+            print("\n" + "=" * 40)
+            print("📊 詳細分類效能報告 (Per-Entity Report):")
+            print(self.report())
+            print("=" * 40 + "\n")
+        self.reset()
+        return results
+
+
+# ===========================
+# 🧪 與 seqeval 對照測試
+# ===========================
+if __name__ == "__main__":
+    import random
+    from seqeval.metrics import classification_report, precision_score, recall_score, f1_score
+
+    rng = random.Random(0)
+    label_ids = list(ID2LABEL)
+    acc = SpanMetricAccumulator(print_report=False)
+    all_true, all_pred = [], []
+
+    for _ in range(50):
+        batch, seq = 8, rng.randint(5, 40)
+        labels = np.array([[rng.choice(label_ids) for _ in range(seq)] for _ in range(batch)])
+        preds = np.where(np.random.default_rng(rng.randint(0, 10**6)).random(labels.shape) < 0.7,
+                         labels, np.array([[rng.choice(label_ids) for _ in range(seq)] for _ in range(batch)]))
+        labels[:, 0] = -100
+        labels[:, -1] = -100
+        acc.update(preds, labels)
+        for p, l in zip(preds, labels):
+            all_true.append([ID2LABEL[x] for x in l if x != -100])
+            all_pred.append([ID2LABEL[x] for (x, y) in zip(p, l) if y != -100])
+
+    ours = acc.compute()
+    expected = {
+        "precision": precision_score(all_true, all_pred),
+        "recall": recall_score(all_true, all_pred),
+        "f1": f1_score(all_true, all_pred),
+    }
+    for key in expected:
+        assert abs(ours[key] - expected[key]) < 1e-9, f"❌ {key}: {ours[key]} != {expected[key]}"
+    print("✅ 與 seqeval 結果一致:", {k: round(v, 4) for k, v in ours.items()})
+    print(acc.report())
+    print(classification_report(all_true, all_pred))
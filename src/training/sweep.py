@@ -0,0 +1,362 @@
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import argparse
+import itertools
+import multiprocessing as mp
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.dirname(current_dir))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+# 呢個模組會喺 spawn 出嚟的 worker 重新 import：torch / transformers 喺 worker 入面先 import
+from src.config import BASE_MODEL_NAME, DATASET_CACHE_DIR, SPLIT_SEED
+
+# ===========================
+# 🎛️ 超參數搜尋 (Successive Halving + 多進程 CPU trials)
+# ===========================
+# LoRA rank / alpha / target modules / learning rate 以前寫死喺 train_lora.py，
+# 而 models/final_lora_model_latest 用緊的設定 (r=16，只有 query / value) 已經同代碼唔一樣。
+# 呢度一晚跑晒：
+# - 搜尋空間 = {參數: [候選值]}，全組合打亂後抽 n_trials 個 (可以加入現有 adapter 的設定做對照)
+# - 多個 trial 同時跑，每個 spawn 進程限 cores_per_trial 個線程
+# - 所有 trial 共用同一份 Tokenized 數據快取 (主進程先建立，worker 直接 memory-map)
+# - Successive halving：每個 trial 的 cosine schedule 都按最大步數 (max_steps) 設定，
+#   跑到每一級 (rung) 的步數就存 checkpoint + 評估 F1，只有頭 1/eta 繼續由 checkpoint 跑落去
+# - 每一級完成就更新 leaderboard.json；最佳設定寫入 best_hparams.json，
+#   之後 python -m src.training.train_lora --hparams sweep_out/best_hparams.json
+#
+# 用法：python -m src.training.sweep --trials 27 --min-steps 200 --eta 3 --cores-per-trial 4
+# 冒煙測試：python -m src.training.sweep --smoke-test
+
+LEADERBOARD_NAME = "leaderboard.json"
+BEST_HPARAMS_NAME = "best_hparams.json"
+
+DEFAULT_SPACE = {
+    "r": [8, 16, 32],
+    "lora_alpha": [16, 32, 64],
+    "target_modules": [
+        ["query", "value"],
+        ["query", "key", "value"],
+        ["query", "key", "value", "output.dense", "intermediate.dense"],
+    ],
+    "learning_rate": [1e-5, 2e-5, 5e-5, 1e-4],
+}
+
+
+def load_space(value):
+    """JSON 字串或 JSON 檔案路徑"""
+    if value is None:
+        return DEFAULT_SPACE
+    if os.path.exists(value):
+        with open(value, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return json.loads(value)
+
+
+def sample_trials(space, n_trials=None, seed=SPLIT_SEED):
+    """全組合打亂後取頭 n_trials 個 (None = 全部)"""
+    names = list(space)
+    combos = [dict(zip(names, values)) for values in itertools.product(*(space[n] for n in names))]
+    random.Random(seed).shuffle(combos)
+    return combos[:n_trials] if n_trials else combos
+
+
+def adapter_hparams(adapter_dir):
+    """由現有 adapter 的 adapter_config.json 讀返佢訓練時的 LoRA 設定"""
+    with open(os.path.join(adapter_dir, "adapter_config.json"), "r", encoding="utf-8") as f:
+        config = json.load(f)
+    return {"r": config["r"], "lora_alpha": config["lora_alpha"], "lora_dropout": config["lora_dropout"],
+            "target_modules": sorted(config["target_modules"])}
+
+
+def rung_steps(min_steps, eta, num_rungs):
+    return [min_steps * eta ** i for i in range(num_rungs)]
+
+
+# ===========================
+# 👷 Worker (每個進程跑一個 trial 的一段)
+# ===========================
+_worker_settings = None
+
+def _init_worker(settings, num_threads):
+    global _worker_settings
+    import torch
+    torch.set_num_threads(num_threads)
+    _worker_settings = settings
+
+
+def _last_checkpoint(trial_dir):
+    from transformers.trainer_utils import get_last_checkpoint
+    return get_last_checkpoint(trial_dir) if os.path.isdir(trial_dir) else None
+
+
+def _run_trial(job):
+    trial, until_step = job
+    return trial["id"], run_trial_segment(trial, until_step, **_worker_settings)
+
+
+def run_trial_segment(trial, until_step, base_model_name, inputs, max_steps, output_dir, batch_size=4,
+                      grad_accum=2, eval_batch_size=16, eval_samples=None, seed=SPLIT_SEED,
+                      dataset_cache_dir=DATASET_CACHE_DIR, report_to="tensorboard"):
+    """
+    由上一級的 checkpoint (如有) 繼續訓練到 until_step，存 checkpoint 後評估 F1。
+    Optimizer / scheduler / 數據次序都由 checkpoint 還原，結果同一口氣跑到 until_step 一樣。
+    """
+    import torch
+    from torch.utils.data import DataLoader
+    from transformers import AutoTokenizer, TrainingArguments, TrainerCallback
+    from src.training.train_lora import PIITrainer, TokenClassificationCollator, build_lora_model, split_hparams
+    from src.training.distill import load_distill_splits, MODEL_INPUTS
+    from src.training.async_eval import evaluate_model
+
+    class PauseCallback(TrainerCallback):
+        def on_step_end(self, args, state, control, **kwargs):
+            if state.global_step >= until_step:
+                control.should_save = True
+                control.should_training_stop = True
+
+    start = time.time()
+    trial_dir = os.path.join(output_dir, trial["id"])
+    lora_params, learning_rate = split_hparams(trial["params"])
+    tokenizer = AutoTokenizer.from_pretrained(base_model_name)
+    splits = load_distill_splits(inputs, tokenizer, seed=seed, cache_dir=dataset_cache_dir)
+    test_split = splits["test"].remove_columns([c for c in splits["test"].column_names if c not in MODEL_INPUTS])
+    if eval_samples and eval_samples < len(test_split):
+        test_split = test_split.shuffle(seed=seed).select(range(eval_samples))
+
+    torch.manual_seed(seed)
+    model = build_lora_model(base_model_name, lora_params=lora_params)
+    collator = TokenClassificationCollator(tokenizer, pad_to_multiple_of=8)
+    args = TrainingArguments(
+        output_dir=trial_dir,
+        save_strategy="no",
+        eval_strategy="no",
+        learning_rate=learning_rate,
+        # schedule 永遠按最大步數設定，被淘汰的 trial 只係提早停，唔會改變前面的 learning rate
+        max_steps=max_steps,
+        lr_scheduler_type="cosine",
+        warmup_ratio=0.1,
+        weight_decay=0.05,
+        label_smoothing_factor=0.1,
+        per_device_train_batch_size=batch_size,
+        gradient_accumulation_steps=grad_accum,
+        group_by_length=True,
+        length_column_name="length",
+        remove_unused_columns=False,
+        logging_steps=10,
+        seed=seed,
+        fp16=torch.cuda.is_available(),
+        report_to=report_to,
+    )
+    trainer = PIITrainer(
+        model=model,
+        args=args,
+        train_dataset=splits["train"],
+        tokenizer=tokenizer,
+        data_collator=collator,
+        callbacks=[PauseCallback()],
+    )
+    trainer.train(resume_from_checkpoint=_last_checkpoint(trial_dir))
+
+    # 只保留最新 checkpoint (下一級由佢繼續；最後一級就係最終 adapter)
+    latest = _last_checkpoint(trial_dir)
+    for name in os.listdir(trial_dir):
+        path = os.path.join(trial_dir, name)
+        if name.startswith("checkpoint-") and path != latest:
+            shutil.rmtree(path, ignore_errors=True)
+
+    device = next(model.parameters()).device
+    acc = evaluate_model(model, DataLoader(test_split, batch_size=eval_batch_size, collate_fn=collator), device)
+    return {
+        "step": trainer.state.global_step,
+        "f1": round(acc.compute()["f1"], 4),
+        "seconds": round(time.time() - start, 1),
+        "checkpoint": latest,
+        "trainable_parameters": sum(p.numel() for p in model.parameters() if p.requires_grad),
+    }
+
+
+# ===========================
+# 🏆 Leaderboard
+# ===========================
+def leaderboard_rows(trials):
+    """跑得最遠 (最高 rung) 優先，同一級按最新 F1 排"""
+    def key(t):
+        last = t["history"][-1] if t["history"] else {"step": 0, "f1": -1.0}
+        return (last["step"], last["f1"])
+    return sorted(trials.values(), key=key, reverse=True)
+
+
+def write_leaderboard(output_dir, trials, config):
+    rows = leaderboard_rows(trials)
+    payload = {"config": config, "updated": time.strftime("%Y-%m-%d %H:%M:%S"), "trials": rows}
+    tmp_path = os.path.join(output_dir, f"{LEADERBOARD_NAME}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, os.path.join(output_dir, LEADERBOARD_NAME))
+    return rows
+
+
+def format_leaderboard(rows, top=10):
+    lines = ["| # | Trial | 參數 | 步數 | F1 | 狀態 |", "|---|---|---|---|---|---|"]
+    for i, t in enumerate(rows[:top], 1):
+        last = t["history"][-1] if t["history"] else {"step": 0, "f1": 0.0}
+        params = ", ".join(f"{k}={json.dumps(v)}" for k, v in t["params"].items())
+        lines.append(f"| {i} | {t['id']} | {params} | {last['step']} | {last['f1']:.4f} | {t['status']} |")
+    return "\n".join(lines)
+
+
+# ===========================
+# 🚀 主流程
+# ===========================
+def run_sweep(space=None, n_trials=None, include_adapters=(), inputs=("train_data_lora_cleaned.json",),
+              base_model_name=BASE_MODEL_NAME, min_steps=200, eta=3, num_rungs=3, cores_per_trial=4,
+              workers=None, batch_size=4, grad_accum=2, eval_samples=None, seed=SPLIT_SEED,
+              output_dir="./sweep_out", dataset_cache_dir=DATASET_CACHE_DIR, report_to="tensorboard"):
+    from transformers import AutoTokenizer
+    from src.training.distill import load_distill_splits
+    from src.training.train_lora import DEFAULT_LEARNING_RATE
+
+    start = time.time()
+    os.makedirs(output_dir, exist_ok=True)
+    space = space or DEFAULT_SPACE
+    rungs = rung_steps(min_steps, eta, num_rungs)
+
+    # 1. 所有 trial 共用的 Tokenized 數據快取：主進程建立一次，worker 只會 memory-map
+    load_distill_splits(inputs, AutoTokenizer.from_pretrained(base_model_name), seed=seed, cache_dir=dataset_cache_dir)
+
+    # 2. Trials：現有 adapter 的設定 (對照組) + 搜尋空間抽樣
+    # (現有 adapter 冇記錄 learning rate，用 train_lora.py 的預設值)
+    params_list = [{**adapter_hparams(path), "learning_rate": DEFAULT_LEARNING_RATE} for path in include_adapters]
+    params_list += sample_trials(space, n_trials, seed)
+    trials = {}
+    for index, params in enumerate(params_list):
+        trial_id = f"trial-{index:03d}"
+        trials[trial_id] = {"id": trial_id, "params": params, "history": [], "status": "running",
+                            "source": include_adapters[index] if index < len(include_adapters) else "space"}
+
+    config = {
+        "space": space, "inputs": [os.path.abspath(p) for p in inputs], "base_model": base_model_name,
+        "rungs": rungs, "eta": eta, "cores_per_trial": cores_per_trial, "batch_size": batch_size,
+        "grad_accum": grad_accum, "eval_samples": eval_samples, "seed": seed,
+    }
+    settings = dict(
+        base_model_name=base_model_name, inputs=list(inputs), max_steps=rungs[-1], output_dir=output_dir,
+        batch_size=batch_size, grad_accum=grad_accum, eval_samples=eval_samples, seed=seed,
+        dataset_cache_dir=dataset_cache_dir, report_to=report_to,
+    )
+    cores = os.cpu_count() or 1
+    print(f"🎛️ {len(trials)} 個 trial，rungs {rungs} (eta={eta})，每個 trial {cores_per_trial} 核心")
+
+    # 3. Successive halving：每一級全部 active trial 並行跑到該級步數，再淘汰
+    active = list(trials)
+    for level, until_step in enumerate(rungs):
+        parallel = max(1, min(workers or cores // cores_per_trial, len(active)))
+        print(f"\n🪜 Rung {level + 1}/{len(rungs)}：{len(active)} 個 trial 跑到第 {until_step} 步 ({parallel} 個並行)")
+        jobs = [(trials[trial_id], until_step) for trial_id in active]
+        ctx = mp.get_context("spawn")
+        # 每個 trial 段落用一個新進程 (maxtasksperchild=1)，跑完即釋放模型記憶體
+        with ctx.Pool(parallel, initializer=_init_worker, initargs=(settings, cores_per_trial),
+                      maxtasksperchild=1) as pool:
+            for trial_id, result in pool.imap_unordered(_run_trial, jobs):
+                trials[trial_id]["history"].append(
+                    {"rung": level + 1, "step": result["step"], "f1": result["f1"], "seconds": result["seconds"]})
+                trials[trial_id]["checkpoint"] = result["checkpoint"]
+                trials[trial_id]["trainable_parameters"] = result["trainable_parameters"]
+                print(f"   {trial_id}: 第 {result['step']} 步 F1 {result['f1']:.4f} ({result['seconds']}s)")
+                write_leaderboard(output_dir, trials, config)
+
+        if level + 1 == len(rungs):
+            for trial_id in active:
+                trials[trial_id]["status"] = "completed"
+            break
+        ranked = sorted(active, key=lambda t: trials[t]["history"][-1]["f1"], reverse=True)
+        keep = max(1, math.ceil(len(active) / eta))
+        for trial_id in ranked[keep:]:
+            trials[trial_id]["status"] = f"pruned@{until_step}"
+            # 淘汰咗的 trial 唔會再繼續，刪走 checkpoint 慳磁碟
+            shutil.rmtree(os.path.join(output_dir, trial_id), ignore_errors=True)
+            trials[trial_id]["checkpoint"] = None
+        active = ranked[:keep]
+        write_leaderboard(output_dir, trials, config)
+
+    rows = write_leaderboard(output_dir, trials, config)
+    best = rows[0]
+    with open(os.path.join(output_dir, BEST_HPARAMS_NAME), "w", encoding="utf-8") as f:
+        json.dump({"hparams": best["params"], "f1": best["history"][-1]["f1"], "trial": best["id"],
+                   "checkpoint": best["checkpoint"]}, f, ensure_ascii=False, indent=2)
+
+    print("\n" + format_leaderboard(rows))
+    print(f"\n🏆 最佳: {best['id']} {best['params']} (F1 {best['history'][-1]['f1']:.4f})，"
+          f"共 {time.time() - start:.0f}s")
+    print(f"💡 用呢組設定完整訓練：python -m src.training.train_lora --hparams "
+          f"{os.path.join(output_dir, BEST_HPARAMS_NAME)}")
+    return rows
+
+
+# ===========================
+# 🧪 冒煙測試 (細模型 + 玩具數據，2 個並行 worker)
+# ===========================
+def smoke_test():
+    from src.training.smoke_fixtures import toy_workspace
+
+    with toy_workspace() as ws:
+        space = {"r": [4, 8], "lora_alpha": [8, 16], "learning_rate": [1e-3, 1e-4]}
+        output_dir = ws.path("sweep_out")
+        rows = run_sweep(
+            space=space, n_trials=4, inputs=[ws.data_file], base_model_name=ws.model_path, min_steps=4, eta=2,
+            num_rungs=3, cores_per_trial=1, workers=2, batch_size=8, grad_accum=1, output_dir=output_dir,
+            dataset_cache_dir=ws.cache_dir, report_to="none",
+        )
+        statuses = [t["status"] for t in rows]
+        assert statuses.count("completed") == 1 and rows[0]["history"][-1]["step"] == 16, statuses
+        assert os.path.exists(os.path.join(rows[0]["checkpoint"], "adapter_model.safetensors"))
+
+        # 分段跑 (4 -> 8 -> 16 步) 要同一口氣跑 16 步的結果一樣
+        settings = dict(base_model_name=ws.model_path, inputs=[ws.data_file], max_steps=16, batch_size=8,
+                        grad_accum=1, dataset_cache_dir=ws.cache_dir, report_to="none")
+        straight = run_trial_segment({"id": "straight", "params": rows[0]["params"]}, 16,
+                                     output_dir=ws.path("check"), **settings)
+        assert straight["f1"] == rows[0]["history"][-1]["f1"], (straight, rows[0]["history"])
+        from safetensors.torch import load_file
+        resumed = load_file(os.path.join(rows[0]["checkpoint"], "adapter_model.safetensors"))
+        direct = load_file(os.path.join(straight["checkpoint"], "adapter_model.safetensors"))
+        assert all((resumed[k] - direct[k]).abs().max() < 1e-6 for k in direct)
+        with open(os.path.join(output_dir, BEST_HPARAMS_NAME), "r", encoding="utf-8") as f:
+            print(f"📄 {json.load(f)}")
+    print("✅ 冒煙測試通過")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LoRA 超參數搜尋 (successive halving + 多進程 CPU trials)")
+    parser.add_argument("--space", default=None, help="搜尋空間 JSON 字串或檔案 (預設 DEFAULT_SPACE)")
+    parser.add_argument("--trials", type=int, default=None, help="由全組合抽幾多個 trial (預設全部)")
+    parser.add_argument("--include-adapter", nargs="*", default=None,
+                        help="加入現有 adapter 的設定做對照 (預設 models/final_lora_model_latest，如存在)")
+    parser.add_argument("--inputs", nargs="+", default=["train_data_lora_cleaned.json"])
+    parser.add_argument("--min-steps", type=int, default=200, help="第一級 (rung) 的訓練步數")
+    parser.add_argument("--eta", type=int, default=3, help="每一級保留 1/eta，步數乘 eta")
+    parser.add_argument("--rungs", type=int, default=3)
+    parser.add_argument("--cores-per-trial", type=int, default=4)
+    parser.add_argument("--eval-samples", type=int, default=None, help="中途評估用的測試句數 (預設全部)")
+    parser.add_argument("--output", default="./sweep_out")
+    parser.add_argument("--smoke-test", action="store_true", help="用細模型及玩具數據跑一次完整流程")
+    cli_args = parser.parse_args()
+
+    if cli_args.smoke_test:
+        smoke_test()
+    else:
+        include = cli_args.include_adapter
+        if include is None:
+            include = [p for p in ["models/final_lora_model_latest"] if os.path.exists(os.path.join(p, "adapter_config.json"))]
+        run_sweep(
+            space=load_space(cli_args.space), n_trials=cli_args.trials, include_adapters=include,
+            inputs=cli_args.inputs, min_steps=cli_args.min_steps, eta=cli_args.eta, num_rungs=cli_args.rungs,
+            cores_per_trial=cli_args.cores_per_trial, eval_samples=cli_args.eval_samples, output_dir=cli_args.output,
+        )
@@ -0,0 +1,142 @@
+import os
+import sys
+import random
+
+from faker import Faker
+from torch.utils.data import IterableDataset, get_worker_info
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.dirname(current_dir))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from src.config import MAX_SEQ_LENGTH, SPLIT_SEED
+from src.training.generate_synthetic_data import load_generation_resources, generate_example
+from src.training.prepare_data import STRICT_FORBIDDEN, extract_gold_entities, is_clean
+from src.training.label_alignment import align_labels, batch_word_ids
+from src.training.sharded_data import load_sources, load_eval, weighted_epoch_size
+
+# ===========================
+# 🎲 即場生成合成數據 (On-the-fly Synthetic Stream)
+# ===========================
+# 以前 generate_synthetic_data.py 先生成固定 20,000 條寫入 JSON，每個 epoch 都睇返同一批。
+# 呢度喺 DataLoader worker 入面即場生成：唔使落地，訓練越耐見到的樣本越多。
+# - 每個 worker (及每個分散式 rank) 用唔同 seed，避免 fork 出嚟的進程生成一模一樣的數據
+# - 可按比例混入真實語料 (分片 manifest 的 news / mtr / novel ...)
+# - 生成邏輯與 generate_synthetic() 完全相同，並沿用 prepare_data.py 的禁止名單過濾
+
+# 以前一個 epoch 的合成樣本數 (用嚟計 max_steps)
+SYNTHETIC_EXAMPLES_PER_EPOCH = 20000
+
+
+def build_forbidden_set(real_sources):
+    """同 prepare_data.py 一樣：靜態禁止詞 + news / mtr 已標註的實體"""
+    gold_items = [item for name in ("news", "mtr") if name in real_sources for item in real_sources[name][0]]
+    return STRICT_FORBIDDEN | extract_gold_entities(gold_items)
+
+
+def seed_generators(seed):
+    """generators.py 及 generate_synthetic_data.py 都用全域 random / Faker"""
+    random.seed(seed)
+    Faker.seed(seed)
+
+
+class OnTheFlyDataset(IterableDataset):
+    """
+    無限串流：每個樣本以 synthetic_ratio 的機率即場生成，否則從真實語料抽樣
+    (按 權重 x 樣本數 比例選來源)。每 block_size 條一齊 tokenize，輸出
+    input_ids / attention_mask / labels，交畀 DataCollatorForTokenClassification 動態補齊。
+    """
+
+    # 每個 rank / worker 已經用自己的種子生成唔同樣本 (見 _worker_seed)，
+    # PIITrainer 唔會再交畀 accelerate 切分或分發 (見 PIITrainer.get_train_dataloader)
+    per_rank = True
+
+    def __init__(self, tokenizer, real_sources=None, synthetic_ratio=1.0, seed=SPLIT_SEED,
+                 max_length=MAX_SEQ_LENGTH, block_size=64, resources=None, forbidden=None):
+        self.tokenizer = tokenizer
+        self.real_sources = {name: src for name, src in (real_sources or {}).items() if src[0]}
+        self.synthetic_ratio = synthetic_ratio if self.real_sources else 1.0
+        self.seed = seed
+        self.max_length = max_length
+        self.block_size = block_size
+        # 喺主進程載入一次，workers fork 之後直接共用
+        self.resources = resources or load_generation_resources()
+        self.forbidden = forbidden if forbidden is not None else build_forbidden_set(self.real_sources)
+
+        self._real_names = list(self.real_sources)
+        self._real_weights = [w * len(items) for items, w in self.real_sources.values()]
+
+    def _worker_seed(self):
+        worker = get_worker_info()
+        worker_id = worker.id if worker else 0
+        rank = int(os.environ.get("RANK", 0))
+        return self.seed + 1000 * rank + worker_id
+
+    def _next_synthetic(self):
+        while True:
+            example = generate_example(self.resources)
+            if example is not None and is_clean(example, self.forbidden):
+                return example
+
+    def _next_example(self):
+        if random.random() < self.synthetic_ratio:
+            return self._next_synthetic()
+        name = random.choices(self._real_names, weights=self._real_weights)[0]
+        return random.choice(self.real_sources[name][0])
+
+    def _encode(self, examples):
+        tokenized = self.tokenizer(
+            [e["tokens"] for e in examples],
+            is_split_into_words=True,
+            truncation=True,
+            max_length=self.max_length
+        )
+        labels = align_labels(batch_word_ids(tokenized, len(examples)), [e["ner_tags"] for e in examples])
+        for i, label_ids in enumerate(labels):
+            yield {
+                "input_ids": tokenized["input_ids"][i],
+                "attention_mask": tokenized["attention_mask"][i],
+                "labels": label_ids,
+            }
+
+    def __iter__(self):
+        seed_generators(self._worker_seed())
+        while True:
+            yield from self._encode([self._next_example() for _ in range(self.block_size)])
+
+
+def generate_fixed_set(resources, count, seed=SPLIT_SEED, forbidden=STRICT_FORBIDDEN):
+    """固定 seed 生成一批合成樣本 (用作冇分片數據時的驗證集，每次訓練都一樣)"""
+    seed_generators(seed)
+    data = []
+    while len(data) < count:
+        example = generate_example(resources)
+        if example is not None and is_clean(example, forbidden):
+            data.append(example)
+    return data
+
+
+def build_on_the_fly_datasets(tokenizer, manifest=None, synthetic_ratio=0.5, eval_count=1000, seed=SPLIT_SEED):
+    """
+    回傳 (訓練串流, 驗證集 list, 每 epoch 等效樣本數)。
+    有 manifest：真實語料來自分片 (唔包括已落地的 synthetic)，驗證集用固定的 eval.jsonl；
+    冇 manifest：純合成，驗證集用固定 seed 生成。
+    """
+    resources = load_generation_resources()
+    if manifest:
+        real_sources = load_sources(manifest, exclude=("synthetic",))
+        eval_items = list(load_eval(manifest))
+        examples_per_epoch = weighted_epoch_size(manifest)
+    else:
+        real_sources = {}
+        eval_items = generate_fixed_set(resources, eval_count, seed=seed + 999_999)
+        examples_per_epoch = SYNTHETIC_EXAMPLES_PER_EPOCH
+
+    train_stream = OnTheFlyDataset(
+        tokenizer, real_sources=real_sources, synthetic_ratio=synthetic_ratio,
+        seed=seed, resources=resources
+    )
+    print(f"🎲 即場生成模式：合成比例 {train_stream.synthetic_ratio:.0%} | "
+          f"真實來源 {list(real_sources) or '無'} | 驗證集 {len(eval_items)} 條")
+    return train_stream, eval_items, examples_per_epoch
@@ -0,0 +1,135 @@
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import atexit
+import argparse
+import threading
+
+# ===========================
+# 📈 訓練遙測 (Append-only JSONL)
+# ===========================
+# 以前 LogCallback 每 10 步就用 indent=2 重寫成個 training_history.json，
+# 檔案越大寫得越慢 (總 I/O 係平方級)。而家：
+# - 每條記錄一行 JSON，append-only
+# - 由背景線程批量寫入，訓練線程只係將 dict 放入 Queue
+# - 需要舊格式時用 read_history / rebuild_json 即場重建
+# - 檔案係 append 模式，多次訓練會寫入同一個檔：每條記錄帶 run_id / run_start，
+#   read_history / rebuild_json 預設只取最後一次訓練
+
+DEFAULT_LOG_PATH = "training_history.jsonl"
+
+
+class JsonlWriter:
+    """背景線程寫入 JSONL：每 flush_every 條或每 flush_interval 秒 flush 一次"""
+
+    _STOP = object()
+
+    def __init__(self, path, flush_every=20, flush_interval=5.0):
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="jsonl-writer", daemon=True)
+        self._thread.start()
+        # 訓練中途崩潰都要 flush 埋 Queue 入面的記錄 (daemon 線程唔會等)
+        atexit.register(self.close)
+
+    def write(self, record):
+        self._queue.put(record)
+
+    def _run(self):
+        with open(self.path, "a", encoding="utf-8", buffering=1 << 16) as f:
+            pending = 0
+            last_flush = time.monotonic()
+            while True:
+                try:
+                    record = self._queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    record = None
+                if record is self._STOP:
+                    break
+                if record is not None:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    pending += 1
+                if pending and (pending >= self.flush_every or time.monotonic() - last_flush >= self.flush_interval):
+                    f.flush()
+                    pending = 0
+                    last_flush = time.monotonic()
+
+    def close(self):
+        atexit.unregister(self.close)
+        if self._thread.is_alive():
+            self._queue.put(self._STOP)
+            self._thread.join()
+
+
+def new_run_id():
+    """例如 20261019-153012-a1b2c3：按時間排序，同一秒開始的訓練都唔會撞"""
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+
+def peak_rss_mb():
+    """進程至今的最高常駐記憶體 (MB)"""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 單位係 KB，macOS 係 bytes
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+
+def read_history(path=DEFAULT_LOG_PATH, run_id="latest"):
+    """
+    讀取 JSONL 遙測記錄 (忽略中斷時寫了一半的最後一行)。
+    run_id="latest"：只回傳最後一次訓練的記錄；指定 run_id 就回傳該次；None 回傳全部。
+    (舊版冇 run_id 的記錄只會喺 None 時回傳)
+    """
+    records = []
+    if not os.path.exists(path):
+        return records
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    if run_id == "latest":
+        run_ids = [r["run_id"] for r in records if "run_id" in r]
+        if not run_ids:
+            return records
+        run_id = run_ids[-1]
+    if run_id is None:
+        return records
+    return [r for r in records if r.get("run_id") == run_id]
+
+
+def rebuild_json(jsonl_path=DEFAULT_LOG_PATH, json_path="training_history.json", run_id="latest"):
+    """按需要重建舊格式的 training_history.json (預設只包括最後一次訓練)"""
+    history = read_history(jsonl_path, run_id=run_id)
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(history, f, ensure_ascii=False, indent=2)
+    return history
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="檢視訓練遙測 / 重建 training_history.json")
+    parser.add_argument("path", nargs="?", default=DEFAULT_LOG_PATH)
+    parser.add_argument("--json", default=None, metavar="OUT", help="重建 JSON 檔 (舊格式)")
+    parser.add_argument("--tail", type=int, default=10, help="顯示最後 N 條訓練記錄")
+    parser.add_argument("--run-id", default="latest", help="只睇某次訓練 (預設最後一次)")
+    parser.add_argument("--all-runs", action="store_true", help="包括檔案入面所有訓練的記錄")
+    cli_args = parser.parse_args()
+    run_id = None if cli_args.all_runs else cli_args.run_id
+
+    if cli_args.json:
+        history = rebuild_json(cli_args.path, cli_args.json, run_id=run_id)
+        print(f"✅ 已由 {len(history)} 條記錄重建 {cli_args.json}")
+    else:
+        for r in [r for r in read_history(cli_args.path, run_id=run_id) if "loss" in r][-cli_args.tail:]:
+            print(f"step {r['step']:>6} | loss {r['loss']:.4f} | lr {r.get('learning_rate', 0):.2e} | "
+                  f"{r.get('samples_per_sec', 0):.1f} 樣本/秒 | {r.get('tokens_per_sec', 0):.0f} tokens/秒 | "
+                  f"padding {r.get('padding_ratio', 0):.1%} | RSS {r.get('peak_rss_mb')} MB")
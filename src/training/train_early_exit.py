@@ -0,0 +1,199 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+import torch
+from torch import nn
+from torch.utils.data import DataLoader
+from transformers import DataCollatorForTokenClassification
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.dirname(current_dir))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from src.config import LORA_MODEL_PATH, DATASET_CACHE_DIR
+from src.inference.pipeline import PIIPipeline
+from src.inference.early_exit import EarlyExitHeads, EXIT_HEADS_NAME, enable_early_exit, disable_early_exit
+from src.training.async_eval import evaluate_model
+from src.training.distill import load_distill_splits, measure_latency, MODEL_INPUTS
+
+# ===========================
+# 🚪 訓練 Early-exit 分類頭 (由最後分類頭蒸餾)
+# ===========================
+# Backbone 完全凍結，只訓練中間層的 Linear 分類頭：
+# - 每個 batch 用原本模型跑一次 (output_hidden_states)，最後分類頭的機率就係 soft target
+# - Loss = 各離開層 KL(最後分類頭 || 中間分類頭) 的平均，只計真實 token
+# - 訓練完用測試集掃描 threshold：F1、平均離開深度、逐句 latency，
+#   另外單獨報告「冇 PII 的句子」(全部 O)，呢類最應該提早離開
+#
+# 用法：python -m src.training.train_early_exit --model ./final_lora_model --every 4
+# 冒煙測試：python -m src.training.train_early_exit --smoke-test
+
+REPORT_NAME = "early_exit_report.json"
+
+
+def default_exit_layers(num_layers, every=4):
+    return list(range(every, num_layers, every))
+
+
+def train_exit_heads(model, dataloader, exit_layers, epochs=1, learning_rate=1e-3, temperature=1.0):
+    device = model.device
+    heads = EarlyExitHeads.from_classifier(model, exit_layers)
+    optimizer = torch.optim.AdamW(heads.parameters(), lr=learning_rate)
+    model.eval()
+    heads.train()
+
+    for epoch in range(epochs):
+        total, steps = 0.0, 0
+        for batch in dataloader:
+            batch = {k: v.to(device) for k, v in batch.items()}
+            mask = batch.pop("labels") != -100
+            with torch.no_grad():
+                outputs = model(**batch, output_hidden_states=True)
+                target = nn.functional.log_softmax(outputs.logits[mask] / temperature, dim=-1)
+
+            loss = 0.0
+            for layer in exit_layers:
+                # hidden_states[0] 係 embeddings，第 n 層輸出係 hidden_states[n]
+                student = heads(layer, outputs.hidden_states[layer][mask])
+                loss = loss + nn.functional.kl_div(
+                    nn.functional.log_softmax(student / temperature, dim=-1), target,
+                    log_target=True, reduction="batchmean",
+                )
+            loss = loss / len(exit_layers)
+            loss.backward()
+            optimizer.step()
+            optimizer.zero_grad(set_to_none=True)
+            total += loss.item()
+            steps += 1
+        print(f"📉 Epoch {epoch + 1}/{epochs}: KL {total / max(steps, 1):.4f}")
+    return heads.eval()
+
+
+def evaluate_threshold(model, heads, dataset, collator, latency_samples=64):
+    """逐句 (batch size 1，同 PIIPipeline.predict 一樣) 評估 F1、平均離開深度及 latency"""
+    device = model.device
+    heads.reset_stats()
+    acc = evaluate_model(model, DataLoader(dataset, batch_size=1, collate_fn=collator), device)
+    depth = heads.stats()["mean_exit_depth"]
+    latency = measure_latency(model, dataset, collator, device, latency_samples)
+    return {"f1": round(acc.compute()["f1"], 4), "mean_exit_depth": depth, "latency_ms_per_sentence": round(latency, 3)}
+
+
+def _pii_free(dataset):
+    return dataset.filter(lambda row: all(label in (-100, 0) for label in row["labels"]))
+
+
+def format_report(report):
+    full = report["full_model"]
+    lines = ["| threshold | F1 | F1 差距 | 平均離開層 | 逐句 latency (ms) | 加速 | 無 PII 句 離開層 | 無 PII 句 加速 |",
+             "|---|---|---|---|---|---|---|---|"]
+    for r in report["thresholds"]:
+        lines.append(
+            f"| {r['threshold']} | {r['all']['f1']:.4f} | {r['all']['f1'] - full['all']['f1']:+.4f} | "
+            f"{r['all']['mean_exit_depth']:.2f} / {report['num_layers']} | {r['all']['latency_ms_per_sentence']:.1f} | "
+            f"{full['all']['latency_ms_per_sentence'] / r['all']['latency_ms_per_sentence']:.2f}x | "
+            f"{r['pii_free']['mean_exit_depth']:.2f} | "
+            f"{full['pii_free']['latency_ms_per_sentence'] / r['pii_free']['latency_ms_per_sentence']:.2f}x |"
+        )
+    return "\n".join(lines)
+
+
+def train_early_exit(model_path=LORA_MODEL_PATH, inputs=("train_data_lora_cleaned.json",), every=4,
+                     thresholds=(0.8, 0.9, 0.95, 0.99), default_threshold=0.9, epochs=1, learning_rate=1e-3,
+                     batch_size=16, latency_samples=64, dataset_cache_dir=DATASET_CACHE_DIR):
+    start = time.time()
+    pii_pipe = PIIPipeline(model_path=model_path, backend="eager", use_profile=False)
+    model, tokenizer = pii_pipe.model, pii_pipe.tokenizer
+    num_layers = model.config.num_hidden_layers
+    exit_layers = default_exit_layers(num_layers, every)
+
+    splits = load_distill_splits(inputs, tokenizer, cache_dir=dataset_cache_dir)
+    collator = DataCollatorForTokenClassification(tokenizer, pad_to_multiple_of=8)
+    columns = lambda ds: [c for c in ds.column_names if c not in MODEL_INPUTS]
+    train_split = splits["train"].remove_columns(columns(splits["train"]))
+    test_split = splits["test"].remove_columns(columns(splits["test"]))
+    subsets = {"all": test_split, "pii_free": _pii_free(test_split)}
+    print(f"📦 測試集 {len(test_split)} 句 (其中 {len(subsets['pii_free'])} 句冇 PII)")
+
+    print(f"🚪 訓練離開層 {exit_layers} 的分類頭...")
+    heads = train_exit_heads(
+        model, DataLoader(train_split, batch_size=batch_size, shuffle=True, collate_fn=collator),
+        exit_layers, epochs=epochs, learning_rate=learning_rate,
+    )
+
+    # 原本模型 (行晒全部層) 作為基準；threshold > 1 即係永遠唔會提早離開
+    enable_early_exit(model, heads)
+    heads.threshold = 1.1
+    report = {
+        "num_layers": num_layers,
+        "exit_layers": exit_layers,
+        "full_model": {name: evaluate_threshold(model, heads, ds, collator, latency_samples)
+                       for name, ds in subsets.items() if len(ds)},
+        "thresholds": [],
+    }
+    for threshold in thresholds:
+        heads.threshold = threshold
+        row = {"threshold": threshold}
+        for name, ds in subsets.items():
+            if len(ds):
+                row[name] = evaluate_threshold(model, heads, ds, collator, latency_samples)
+        report["thresholds"].append(row)
+        print(f"   threshold {threshold}: F1 {row['all']['f1']:.4f}，平均離開層 {row['all']['mean_exit_depth']:.2f}")
+    disable_early_exit(model)
+
+    heads.threshold = default_threshold
+    heads.reset_stats()
+    heads.save(os.path.join(model_path, EXIT_HEADS_NAME))
+    report["default_threshold"] = default_threshold
+    report["train_seconds"] = round(time.time() - start, 1)
+    with open(os.path.join(model_path, REPORT_NAME), "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if len(subsets["pii_free"]):
+        print("\n" + format_report(report))
+    print(f"\n✅ 已儲存 early-exit 分類頭至 {os.path.join(model_path, EXIT_HEADS_NAME)}")
+    print(f"💡 使用：PIIPipeline(model_path='{model_path}', early_exit={default_threshold})")
+    return report
+
+
+def smoke_test():
+    from src.training.smoke_fixtures import toy_workspace
+
+    with toy_workspace("model") as ws:
+        # 玩具數據標籤係隨機的，無 PII 子集多數係空；呢度只驗證成個流程跑得通
+        train_early_exit(model_path=ws.model_path, inputs=[ws.data_file], every=1, thresholds=(0.05, 0.5),
+                         latency_samples=8, dataset_cache_dir=ws.cache_dir)
+
+        pipe = PIIPipeline(model_path=ws.model_path, backend="eager", use_profile=False, early_exit=0.05)
+        pipe.predict_batch([ws.sample_text(), ws.sample_text(8, 12)])
+        stats = pipe.early_exit_stats()
+        print(f"📊 {stats}")
+        assert stats["forwards"] > 0 and stats["mean_exit_depth"] < pipe.model.config.num_hidden_layers
+    print("✅ 冒煙測試通過")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="訓練 early-exit 中間層分類頭並掃描 threshold")
+    parser.add_argument("--model", default=LORA_MODEL_PATH, help="PIIPipeline 可載入的模型資料夾 (分類頭亦存喺度)")
+    parser.add_argument("--inputs", nargs="+", default=["train_data_lora_cleaned.json"])
+    parser.add_argument("--every", type=int, default=4, help="每隔幾層加一個分類頭")
+    parser.add_argument("--thresholds", nargs="+", type=float, default=[0.8, 0.9, 0.95, 0.99])
+    parser.add_argument("--default-threshold", type=float, default=0.9)
+    parser.add_argument("--epochs", type=int, default=1)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--smoke-test", action="store_true", help="用細模型及玩具數據跑一次完整流程")
+    cli_args = parser.parse_args()
+
+    if cli_args.smoke_test:
+        smoke_test()
+    else:
+        train_early_exit(
+            model_path=cli_args.model, inputs=cli_args.inputs, every=cli_args.every,
+            thresholds=cli_args.thresholds, default_threshold=cli_args.default_threshold,
+            epochs=cli_args.epochs, learning_rate=cli_args.lr, batch_size=cli_args.batch_size,
+        )
@@ -1,9 +1,10 @@
 import json
-import numpy as np
+import time
 import torch
 import os
 import sys
 from datasets import Dataset
+from torch.utils.data import DataLoader
 from transformers import (
     AutoTokenizer, 
     AutoModelForTokenClassification, 
@@ -14,9 +15,6 @@ from transformers import (
     TrainerCallback
 )
 from peft import get_peft_model, LoraConfig, TaskType
-import evaluate
-# 🔥 [新增] 導入詳細報告工具
-from seqeval.metrics import classification_report
 
 # ===========================
 # 🔥 1. 路徑修復 (Critical Path Fix)
@@ -27,193 +25,578 @@ project_root = os.path.dirname(os.path.dirname(current_dir))
 if project_root not in sys.path:
     sys.path.append(project_root)
 
-from src.config import BASE_MODEL_NAME, LORA_MODEL_PATH, LABEL2ID, ID2LABEL
+from src.config import BASE_MODEL_NAME, LORA_MODEL_PATH, LABEL2ID, ID2LABEL, MAX_SEQ_LENGTH, SPLIT_SEED
+from src.training.packing import pack_dataset, PackedDataCollator
+from src.training.dataset_cache import load_or_build
+from src.training.label_alignment import align_labels, batch_word_ids
+from src.training.telemetry import JsonlWriter, peak_rss_mb, new_run_id, DEFAULT_LOG_PATH
+from src.training.activation_cache import load_or_build_activations, UpperStackModel, CachedActivationCollator
+from src.training.distributed import dist_info, configure_cpu_threads, ddp_training_kwargs
+from src.training.streaming_metrics import SpanMetricAccumulator, preprocess_logits_for_metrics
+from src.training.adapter_checkpoint import (
+    CheckpointWriter, save_adapter_checkpoint, is_adapter_checkpoint, load_adapter_checkpoint, peft_model_of
+)
+from src.training.sharded_data import load_manifest, load_streaming_train, load_eval, steps_for_epochs, steps_for_examples
 
 # ===========================
 # 🔥 2. 自定義日誌 (Log Callback)
 # ===========================
 class LogCallback(TrainerCallback):
-    def __init__(self, log_path="training_history.json"):
+    """
+    每次 log 追加一行 JSONL (背景線程寫入，見 src/training/telemetry.py)，
+    並附加 step 時間、吞吐量、padding 比例、峰值 RSS。
+    每條記錄帶 run_id / run_start，同一個檔入面的唔同訓練可以分開 (預設每個 LogCallback 自動生成 run_id)；
+    分幾次 train() 的流程 (例如 hard_mining 每輪一個 Trainer) 可以傳入同一個 run_id，
+    再用 step_offset 接續 step 編號。
+    需要舊格式：python -m src.training.telemetry --json training_history.json
+    """
+    def __init__(self, log_path=DEFAULT_LOG_PATH, run_id=None, step_offset=0, extra=None):
         self.log_path = log_path
-        self.history = []
+        self.run_id = run_id
+        self.step_offset = step_offset
+        self.extra = extra or {}
+        self.writer = None
+        self._run_start = None
+        self._last_time = None
+        self._last_step = 0
+
+    def on_train_begin(self, args, state, control, **kwargs):
+        # 多進程訓練時只由 rank 0 寫日誌
+        if not state.is_world_process_zero:
+            return
+        self.writer = JsonlWriter(self.log_path)
+        self.run_id = self.run_id or new_run_id()
+        self._run_start = round(time.time(), 3)
+        self._last_time = time.perf_counter()
+        self._last_step = state.global_step
+
+    def _reset_clock(self, *args, **kwargs):
+        # 評估 / 存檔緊接喺 log 之後發生，重設計時，唔將佢哋計入訓練吞吐量
+        self._last_time = time.perf_counter()
+
+    on_evaluate = _reset_clock
+    on_save = _reset_clock
 
     def on_log(self, args, state, control, logs=None, **kwargs):
-        if logs:
-            log_entry = {
-                "step": state.global_step,
-                "epoch": round(state.epoch, 2) if state.epoch else 0,
-                **logs
-            }
-            self.history.append(log_entry)
-            with open(self.log_path, "w", encoding="utf-8") as f:
-                json.dump(self.history, f, ensure_ascii=False, indent=2)
-
-def train():
-    # 3. 載入數據
-    print("📂 載入訓練數據...")
-    input_file = "train_data_lora_cleaned.json"
-    
-    if not os.path.exists(input_file):
-        print(f"❌ 錯誤：找不到 {input_file}。請先執行 clean_and_augment.py！")
-        return
+        if not logs or self.writer is None:
+            return
+        record = {
+            "run_id": self.run_id,
+            "run_start": self._run_start,
+            **self.extra,
+            "step": self.step_offset + state.global_step,
+            "epoch": round(state.epoch, 2) if state.epoch else 0,
+            **logs,
+            "time": round(time.time(), 3),
+            "peak_rss_mb": peak_rss_mb(),
+        }
+        if "loss" in logs:
+            now = time.perf_counter()
+            elapsed = now - self._last_time
+            steps = state.global_step - self._last_step
+            if steps > 0 and elapsed > 0:
+                samples = steps * args.per_device_train_batch_size * args.gradient_accumulation_steps * args.world_size
+                record["step_time"] = round(elapsed / steps, 4)
+                record["samples_per_sec"] = round(samples / elapsed, 2)
+                if "real_tokens" in logs:
+                    record["tokens_per_sec"] = round(logs["real_tokens"] / elapsed, 1)
+            if "padding_efficiency" in logs:
+                record["padding_ratio"] = round(1 - logs["padding_efficiency"], 4)
+            self._last_time, self._last_step = now, state.global_step
+        self.writer.write(record)
+
+    def on_train_end(self, args, state, control, **kwargs):
+        self.close()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+# ===========================
+# 🔥 3. 自定義 Trainer (統計 Padding 效率)
+# ===========================
+class PIITrainer(Trainer):
+    """
+    在 Trainer 的日誌中加入 padding_efficiency = 真實 token / (真實 + padding token)，
+    用來確認動態 Padding + 按長度分組的效果。
+    adapter_checkpoints=True：checkpoint 只存 LoRA 可訓練參數 + optimizer / scheduler，
+    由背景線程寫入 (見 src/training/adapter_checkpoint.py)。
+    """
+
+    def __init__(self, *args, adapter_checkpoints=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._real_tokens = 0
+        self._padded_tokens = 0
+        # 每次存 checkpoint 訓練線程停頓的秒數
+        self.checkpoint_stalls = []
+        self.checkpoint_writer = None
+        # 多進程時每個 rank 要各自存 RNG，照用 Trainer 原本的同步 checkpoint
+        if adapter_checkpoints and self.args.world_size == 1 and peft_model_of(self.model) is not None:
+            self.checkpoint_writer = CheckpointWriter()
+
+    def get_train_dataloader(self):
+        # 多進程 + 已按 rank 播種的串流 (OnTheFlyDataset)：直接建 DataLoader，唔經 accelerator.prepare。
+        # 否則 accelerate 會用 DataLoaderDispatcher (rank 0 生成全部再分發) 或 IterableDatasetShard
+        # (每個 rank 生成 world_size 倍 batch 再只留一份)，兩者都浪費咗每個 rank 自己的生成器。
+        # 梯度同步由 DDP 模型負責，batch 搬去 device 由 _prepare_inputs 負責。
+        if self.args.world_size == 1 or not getattr(self.train_dataset, "per_rank", False):
+            return super().get_train_dataloader()
+        num_workers = self.args.dataloader_num_workers
+        return DataLoader(
+            self.train_dataset,
+            batch_size=self._train_batch_size,
+            collate_fn=self.data_collator,
+            num_workers=num_workers,
+            pin_memory=self.args.dataloader_pin_memory,
+            persistent_workers=self.args.dataloader_persistent_workers and num_workers > 0,
+            prefetch_factor=self.args.dataloader_prefetch_factor if num_workers > 0 else None,
+        )
+
+    def _count_padding(self, model, inputs):
+        if model.training and "attention_mask" in inputs:
+            mask = inputs["attention_mask"]
+            if mask.dim() == 3:
+                # 打包模式的 block-diagonal mask：對角線 = 真實 token
+                mask = mask.diagonal(dim1=1, dim2=2)
+            self._real_tokens += int(mask.sum())
+            self._padded_tokens += mask.numel()
+
+    def compute_loss(self, model, inputs, *args, **kwargs):
+        self._count_padding(model, inputs)
+        return super().compute_loss(model, inputs, *args, **kwargs)
+
+    def _save(self, output_dir=None, state_dict=None):
+        # 凍結層快取模式：Trainer.model 係 UpperStackModel，只儲存 LoRA adapter，
+        # 唔好將成個 base model 的 state dict 寫入每個 checkpoint
+        if isinstance(self.model, UpperStackModel):
+            output_dir = output_dir if output_dir is not None else self.args.output_dir
+            os.makedirs(output_dir, exist_ok=True)
+            self.model.save_pretrained(output_dir)
+            if self.processing_class is not None:
+                self.processing_class.save_pretrained(output_dir)
+            torch.save(self.args, os.path.join(output_dir, "training_args.bin"))
+            return
+        super()._save(output_dir, state_dict)
 
+    def _save_checkpoint(self, model, trial):
+        start = time.perf_counter()
+        if self.checkpoint_writer is not None:
+            save_adapter_checkpoint(self, self.checkpoint_writer, trial)
+        else:
+            super()._save_checkpoint(model, trial)
+        self.checkpoint_stalls.append(time.perf_counter() - start)
+
+    def _load_from_checkpoint(self, resume_from_checkpoint, model=None):
+        if is_adapter_checkpoint(resume_from_checkpoint):
+            load_adapter_checkpoint(model or self.model, resume_from_checkpoint)
+            return
+        super()._load_from_checkpoint(resume_from_checkpoint, model)
+
+    def _load_best_model(self):
+        # 最佳 checkpoint 可能仲喺背景寫緊
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.wait()
+        super()._load_best_model()
+
+    def train(self, *args, **kwargs):
+        try:
+            return super().train(*args, **kwargs)
+        finally:
+            if self.checkpoint_writer is not None:
+                self.checkpoint_writer.wait()
+            # 訓練拋出例外時唔會有 on_train_end：喺度 flush 埋遙測記錄
+            for callback in self.callback_handler.callbacks:
+                if isinstance(callback, LogCallback):
+                    callback.close()
+
+    def log(self, logs, *args, **kwargs):
+        if self._padded_tokens and "loss" in logs:
+            logs["padding_efficiency"] = round(self._real_tokens / self._padded_tokens, 4)
+            logs["real_tokens"] = self._real_tokens
+            self._real_tokens = 0
+            self._padded_tokens = 0
+        super().log(logs, *args, **kwargs)
+
+# ===========================
+# 🔥 4. 數據預處理 (Tokenization & Alignment)
+# ===========================
+def tokenize_and_align_labels(examples, tokenizer, max_length=MAX_SEQ_LENGTH):
+    # 🔥 不做 Padding：由 DataCollator 按每個 batch 的最長句子動態補齊
+    tokenized_inputs = tokenizer(
+        examples["tokens"], 
+        is_split_into_words=True, 
+        truncation=True, 
+        max_length=max_length
+    )
+    # 每個字的所有 subword 都用該字的標籤，特殊 token 設為 -100 (見 label_alignment.py)
+    word_ids = batch_word_ids(tokenized_inputs, len(examples["ner_tags"]))
+    labels = align_labels(word_ids, examples["ner_tags"])
+
+    tokenized_inputs["labels"] = labels
+    # 🔥 預先記錄長度，供 group_by_length 分組使用 (免得 Trainer 再掃一次數據)
+    # 注意：Trainer 要用 remove_unused_columns=False 先會保留呢欄畀 LengthGroupedSampler，
+    # 再由 TokenClassificationCollator 喺組 batch 時丟走
+    tokenized_inputs["length"] = [len(ids) for ids in tokenized_inputs["input_ids"]]
+    return tokenized_inputs
+
+class TokenClassificationCollator(DataCollatorForTokenClassification):
+    """
+    DataCollatorForTokenClassification + 丟走 length 欄。
+    remove_unused_columns=True 會喺建立 sampler 之前刪走 length，group_by_length 就要重新掃一次數據；
+    所以 Trainer 保留所有欄位，改由 Collator 自己過濾。
+    """
+
+    def __call__(self, features, return_tensors=None):
+        features = [{k: v for k, v in feature.items() if k != "length"} for feature in features]
+        return super().__call__(features, return_tensors)
+
+def load_raw_data(input_file):
     with open(input_file, "r", encoding="utf-8") as f:
         raw = json.load(f)
         data = raw["data"] if "data" in raw else raw # 兼容不同格式
-    
     print(f"✅ 成功載入 {len(data)} 條清洗後的數據")
-    
-    # 轉換為 HuggingFace Dataset
-    dataset = Dataset.from_list(data).train_test_split(test_size=0.1)
+    return data
 
-    # 4. 載入 Tokenizer
-    tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL_NAME)
-
-    # 5. 數據預處理 (Tokenization & Alignment)
-    def tokenize_and_align_labels(examples):
-        tokenized_inputs = tokenizer(
-            examples["tokens"], 
-            is_split_into_words=True, 
-            truncation=True, 
-            max_length=384, 
-            padding="max_length"
-        )
-        labels = []
-        for i, label in enumerate(examples["ner_tags"]):
-            word_ids = tokenized_inputs.word_ids(batch_index=i)
-            previous_word_idx = None
-            label_ids = []
-            
-            for word_idx in word_ids:
-                if word_idx is None:
-                    label_ids.append(-100) # 忽略特殊 token
-                elif word_idx != previous_word_idx:
-                    label_ids.append(label[word_idx]) # 每個字的第一個 token
-                else:
-                    label_ids.append(label[word_idx]) # 同一個字的後續 token (Subword)
-                
-                previous_word_idx = word_idx
-            labels.append(label_ids)
-
-        tokenized_inputs["labels"] = labels
-        return tokenized_inputs
+def build_tokenized_datasets(input_file, tokenizer, seed=SPLIT_SEED):
+    """讀取 JSON -> 切分訓練/測試集 -> Tokenize + 標籤對齊"""
+    data = load_raw_data(input_file)
+    
+    # 轉換為 HuggingFace Dataset (固定 seed，快取先可以重用)
+    dataset = Dataset.from_list(data).train_test_split(test_size=0.1, seed=seed)
 
     print("⚙️ 正在執行全標籤對齊處理...")
-    tokenized_datasets = dataset.map(
+    return dataset.map(
         tokenize_and_align_labels, 
         batched=True,
+        fn_kwargs={"tokenizer": tokenizer},
         remove_columns=dataset["train"].column_names
     )
 
-    # 6. 載入模型並配置 LoRA
+def load_sharded_datasets(manifest, tokenizer):
+    """
+    🧩 分片模式：訓練集逐個分片串流 (按來源權重抽樣 + shuffle buffer)，
+    驗證集為固定的 eval.jsonl。
+    """
+    tokenize_kwargs = dict(batched=True, fn_kwargs={"tokenizer": tokenizer}, remove_columns=["tokens", "ner_tags"])
+    train_dataset = load_streaming_train(manifest).map(tokenize_and_align_labels, **tokenize_kwargs)
+    eval_dataset = load_eval(manifest).map(tokenize_and_align_labels, **tokenize_kwargs)
+    return train_dataset, eval_dataset
+
+def load_on_the_fly_datasets(tokenizer, manifest, synthetic_ratio):
+    """🎲 即場生成模式：訓練集在 DataLoader workers 入面生成，驗證集固定"""
+    from src.training.synthetic_stream import build_on_the_fly_datasets
+    train_dataset, eval_items, examples_per_epoch = build_on_the_fly_datasets(
+        tokenizer, manifest=manifest, synthetic_ratio=synthetic_ratio
+    )
+    eval_dataset = Dataset.from_list(eval_items).map(
+        tokenize_and_align_labels, batched=True,
+        fn_kwargs={"tokenizer": tokenizer}, remove_columns=["tokens", "ner_tags"]
+    )
+    return train_dataset, eval_dataset, examples_per_epoch
+
+# ===========================
+# 🔥 5. LoRA 設定 (可用 --hparams 覆蓋，搜尋見 src/training/sweep.py)
+# ===========================
+LORA_DEFAULTS = {
+    "r": 8,              # 秩 (Rank): 控制參數量
+    "lora_alpha": 16,    # Alpha: 縮放因子
+    "lora_dropout": 0.1,
+    "target_modules": ["query", "key", "value", "output.dense", "intermediate.dense"],
+}
+DEFAULT_LEARNING_RATE = 2e-5
+
+def split_hparams(hparams=None):
+    """{LoRA 參數..., learning_rate} -> (LoRA 參數, learning rate)，冇提供的用預設值"""
+    hparams = dict(hparams or {})
+    learning_rate = hparams.pop("learning_rate", DEFAULT_LEARNING_RATE)
+    unknown = set(hparams) - set(LORA_DEFAULTS)
+    if unknown:
+        raise ValueError(f"唔識的超參數: {sorted(unknown)} (可用: {sorted(LORA_DEFAULTS)} + learning_rate)")
+    return {**LORA_DEFAULTS, **hparams}, learning_rate
+
+def load_hparams(path):
+    with open(path, "r", encoding="utf-8") as f:
+        hparams = json.load(f)
+    return hparams.get("hparams", hparams)
+
+def build_lora_model(base_model_name=BASE_MODEL_NAME, freeze_layers=0, lora_params=None):
     model = AutoModelForTokenClassification.from_pretrained(
-        BASE_MODEL_NAME, 
+        base_model_name, 
         num_labels=len(LABEL2ID),
         id2label=ID2LABEL,
         label2id=LABEL2ID,
         ignore_mismatched_sizes=True 
     )
+    return apply_lora(model, freeze_layers, lora_params)
+
+def apply_lora(model, freeze_layers=0, lora_params=None):
+    """喺已載入的 token classifier 上加 LoRA (例如剪枝後的模型做恢復微調)"""
+    # 🧊 freeze_layers > 0：只在第 freeze_layers 層之後加 LoRA，下面的層完全凍結
+    layer_kwargs = {}
+    if freeze_layers:
+        layer_kwargs = {
+            "layers_to_transform": list(range(freeze_layers, model.config.num_hidden_layers)),
+            "layers_pattern": "layer",
+        }
 
     peft_config = LoraConfig(
         task_type=TaskType.TOKEN_CLS, 
-        r=8,              # 秩 (Rank): 控制參數量
-        lora_alpha=16,    # Alpha: 縮放因子
-        lora_dropout=0.1,
-        target_modules=["query", "key", "value", "output.dense", "intermediate.dense"]
+        **{**LORA_DEFAULTS, **(lora_params or {})},
+        **layer_kwargs
     )
-    model = get_peft_model(model, peft_config)
+    return get_peft_model(model, peft_config)
+
+def train(packing=False, use_cache=True, shards=None, on_the_fly=False, synthetic_ratio=0.5, num_workers=4,
+          async_eval=False, eval_threads=None, freeze_layers=0, cache_activations=False, hparams=None,
+          full_checkpoints=False, resume=None):
+    num_train_epochs = 5
+    lora_params, learning_rate = split_hparams(hparams)
+    batch_size = 4
+    grad_accum = 2
+
+    # 🖧 多進程 (torchrun) 時：每個進程分一份 CPU 核心；非同步評估的核心先扣起，再平分畀各 rank
+    world_size = dist_info()[1]
+    if async_eval:
+        from src.training.async_eval import default_eval_threads
+        eval_threads = eval_threads or default_eval_threads()
+    num_threads = configure_cpu_threads(reserved_threads=eval_threads if async_eval else 0)
+    if num_threads and world_size > 1:
+        print(f"🖧 數據並行：rank {dist_info()[0]}/{world_size}，每進程 {num_threads} 線程")
+    if num_threads and async_eval:
+        print(f"🧵 訓練每進程 {num_threads} 線程，評估進程 {eval_threads} 線程")
+
+    # 3. 載入數據
+    print("📂 載入訓練數據...")
+    input_file = "train_data_lora_cleaned.json"
+    
+    if cache_activations and (not freeze_layers or packing or shards or on_the_fly):
+        print("❌ 錯誤：--cache-activations 需要 --freeze-layers N，且不支援 --packing / --shards / --on-the-fly。")
+        return
+    if shards or on_the_fly:
+        if packing:
+            print("❌ 錯誤：串流模式 (--shards / --on-the-fly) 暫不支援 --packing。")
+            return
+    elif not os.path.exists(input_file):
+        print(f"❌ 錯誤：找不到 {input_file}。請先執行 clean_and_augment.py！")
+        return
+
+    # 4. 載入 Tokenizer
+    tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL_NAME)
+
+    # 5. 數據預處理 (Tokenization & Alignment)
+    max_steps = -1
+    if on_the_fly:
+        manifest = load_manifest(shards) if shards else None
+        train_dataset, eval_dataset, examples_per_epoch = load_on_the_fly_datasets(tokenizer, manifest, synthetic_ratio)
+        max_steps = steps_for_examples(examples_per_epoch, num_train_epochs, batch_size, grad_accum, world_size)
+        print(f"🎲 即場生成模式：共 {max_steps} 步 (等效 {num_train_epochs} 個 epoch)")
+    elif shards:
+        manifest = load_manifest(shards)
+        train_dataset, eval_dataset = load_sharded_datasets(manifest, tokenizer)
+        # IterableDataset 冇長度：按「權重 x 樣本數」計出等效 epoch 的步數
+        max_steps = steps_for_epochs(manifest, num_train_epochs, batch_size, grad_accum, world_size)
+        print(f"🧩 分片串流模式：共 {max_steps} 步 (等效 {num_train_epochs} 個 epoch)")
+    else:
+        # 🔥 內容冇變就直接 memory-map 上次的結果 (見 src/training/dataset_cache.py)
+        build_fn = lambda: build_tokenized_datasets(input_file, tokenizer, seed=SPLIT_SEED)
+        if use_cache:
+            tokenized_datasets = load_or_build(input_file, tokenizer, SPLIT_SEED, build_fn)
+        else:
+            tokenized_datasets = build_fn()
+        train_dataset, eval_dataset = tokenized_datasets["train"], tokenized_datasets["test"]
+
+    # 🔥 序列打包：只打包訓練集，評估集保持逐句，所以 Metrics 仍然按原句計算
+    if packing:
+        train_dataset = pack_dataset(train_dataset, tokenizer)
+        data_collator = PackedDataCollator(tokenizer)
+    else:
+        # 動態 Padding：每個 batch 只補齊到該 batch 最長的句子
+        data_collator = TokenClassificationCollator(tokenizer, pad_to_multiple_of=8)
+
+    # 6. 載入模型並配置 LoRA
+    if hparams:
+        print(f"🎛️ 使用自訂超參數: {hparams}")
+    model = build_lora_model(freeze_layers=freeze_layers, lora_params=lora_params)
     model.print_trainable_parameters()
 
+    # 🧊 凍結層快取：下層只跑一次，之後每個 epoch 直接由快取的 hidden states 開始
+    trainer_model = model
+    if cache_activations:
+        train_dataset = load_or_build_activations(model, train_dataset, freeze_layers)
+        eval_dataset = load_or_build_activations(model, eval_dataset, freeze_layers)
+        trainer_model = UpperStackModel(model, freeze_layers)
+        data_collator = CachedActivationCollator()
+
     # 7. 設定評估指標 (Metrics)
-    metric = evaluate.load("seqeval")
-    
-    def compute_metrics(p):
-        predictions, labels = p
-        predictions = np.argmax(predictions, axis=2)
-
-        # 移除 -100 的標籤，只計算真實 Token
-        true_predictions = [
-            [ID2LABEL[p] for (p, l) in zip(prediction, label) if l != -100]
-            for prediction, label in zip(predictions, labels)
-        ]
-        true_labels = [
-            [ID2LABEL[l] for (p, l) in zip(prediction, label) if l != -100]
-            for prediction, label in zip(predictions, labels)
-        ]
-
-        results = metric.compute(predictions=true_predictions, references=true_labels)
-        
-        # 🔥 [關鍵新增] 生成並打印詳細分類報告
-        # 這能讓你在 Console 中直接看到每個類別 (ADDRESS, NAME...) 的分數
-        try:
-            report = classification_report(true_labels, true_predictions)
-            print("\n" + "="*40)
-            print("📊 詳細分類效能報告 (Per-Entity Report):")
-            print(report)
-            print("="*40 + "\n")
-        except Exception as e:
-            print(f"⚠️ 無法生成詳細報告: {e}")
-
-        return {
-            "f1": results["overall_f1"],
-            "precision": results["overall_precision"],
-            "recall": results["overall_recall"]
-        }
+    # 🔥 每個 eval batch 即時 argmax + 累積 span 級 TP/FP/FN，記憶體只隨 batch 大小增長
+    # (結果與 seqeval 完全一致，見 src/training/streaming_metrics.py)
+    compute_metrics = SpanMetricAccumulator()
 
     # 8. 訓練參數 (Training Arguments)
+    # ⏱️ 非同步評估：Trainer 只存 checkpoint，評估由另一個進程負責 (見 src/training/async_eval.py)
     args = TrainingArguments(
         output_dir="./lora_out",
-        eval_strategy="steps",
+        eval_strategy="no" if async_eval else "steps",
         
         # 優化設置：減少評估頻率以加快訓練
         eval_steps=500,        
         save_strategy="steps",
         save_steps=500,        
         
-        save_total_limit=2,    
+        # 非同步模式由評估進程清理舊 checkpoint (保留最佳 + 最新)
+        save_total_limit=None if async_eval else 2,    
         
-        learning_rate=2e-5,
-        num_train_epochs=5,
+        learning_rate=learning_rate,
+        num_train_epochs=num_train_epochs,
+        max_steps=max_steps,
         lr_scheduler_type="cosine",
         warmup_ratio=0.1,
         weight_decay=0.05,
         label_smoothing_factor=0.1,
         
-        per_device_train_batch_size=4,
-        gradient_accumulation_steps=2,
+        per_device_train_batch_size=batch_size,
+        gradient_accumulation_steps=grad_accum,
+        
+        # 優化設置：長度相近的句子放入同一 batch，減少動態 Padding 的浪費 (串流模式不適用)
+        group_by_length=not (shards or on_the_fly),
+        length_column_name="length",
         logging_steps=10,
         logging_dir='./logs',
         fp16=torch.cuda.is_available(),
-        gradient_checkpointing=True,
-        load_best_model_at_end=True,
+        # 快取模式只跑上層，唔使 gradient checkpointing；最佳 adapter 於訓練後自行載入
+        gradient_checkpointing=not cache_activations,
+        # 必須用 non-reentrant：embedding 凍結，輸入唔需要 grad，reentrant 版本會令 encoder 入面的
+        # LoRA 矩陣完全冇梯度 (只有分類頭會學到嘢)；DDP + 凍結參數亦只支援 non-reentrant
+        gradient_checkpointing_kwargs={"use_reentrant": False},
+        load_best_model_at_end=not (async_eval or cache_activations),
         metric_for_best_model="f1",
-        report_to="tensorboard"
+        batch_eval_metrics=True,
+        report_to="tensorboard",
+        # 即場生成模式：多個 worker 並行生成 + tokenize
+        dataloader_num_workers=num_workers if on_the_fly else 0,
+        # 打包模式需要 segment_ids / position_ids 傳到 Collator；group_by_length 需要 length 欄留到 sampler
+        # (兩者都由 Collator 自行過濾欄位)。串流模式仍由 Trainer 刪走多餘欄位
+        remove_unused_columns=bool(shards or on_the_fly) and not packing,
+        # 多進程：gloo backend、只 all-reduce LoRA 參數 (見 src/training/distributed.py)
+        **ddp_training_kwargs()
     )
 
     # 9. 啟動 Trainer
-    trainer = Trainer(
-        model=model,
+    if async_eval:
+        from src.training.async_eval import AsyncEvalCallback, start_async_evaluator, finish_async_evaluator
+        async_callback = AsyncEvalCallback(args.output_dir, patience=10)
+        stopping_callback = async_callback
+    else:
+        # 優化設置：給予更多耐心 (Patience 10)
+        stopping_callback = EarlyStoppingCallback(early_stopping_patience=10)
+
+    trainer = PIITrainer(
+        model=trainer_model,
         args=args,
-        train_dataset=tokenized_datasets["train"],
-        eval_dataset=tokenized_datasets["test"],
+        train_dataset=train_dataset,
+        eval_dataset=eval_dataset,
         tokenizer=tokenizer,
-        data_collator=DataCollatorForTokenClassification(tokenizer),
+        data_collator=data_collator,
         compute_metrics=compute_metrics,
+        preprocess_logits_for_metrics=preprocess_logits_for_metrics,
         callbacks=[
-            # 優化設置：給予更多耐心 (Patience 10)
-            EarlyStoppingCallback(early_stopping_patience=10), 
-            LogCallback(log_path="training_history.json")
-        ]
+            stopping_callback,
+            LogCallback(log_path=DEFAULT_LOG_PATH)
+        ],
+        # 💾 checkpoint 只存 LoRA 可訓練參數 + optimizer，由背景線程寫入 (見 src/training/adapter_checkpoint.py)
+        adapter_checkpoints=not full_checkpoints
     )
 
+    if async_eval and trainer.is_world_process_zero():
+        eval_process = start_async_evaluator(args.output_dir, eval_dataset, num_threads=eval_threads)
+
     print("🚀 啟動強化版標籤對齊及商用精調訓練...")
-    trainer.train()
+    trainer.train(resume_from_checkpoint=resume)
+
+    if async_eval and trainer.is_world_process_zero():
+        # 等評估進程做完，再載入最佳 checkpoint 的 adapter (等同 load_best_model_at_end)
+        finish_async_evaluator(args.output_dir, eval_process)
+        async_callback.poll(trainer.state)
 
-    # 10. 儲存最終模型
+    if not args.load_best_model_at_end and trainer.state.best_model_checkpoint:
+        from src.training.async_eval import load_adapter_weights
+        best_checkpoint = trainer.state.best_model_checkpoint
+        print(f"🏆 載入最佳 checkpoint: {best_checkpoint} (F1 {trainer.state.best_metric:.4f})")
+        load_adapter_weights(model, best_checkpoint)
+
+    # 10. 儲存最終模型 (多進程時只由 rank 0 儲存)
+    if not trainer.is_world_process_zero():
+        return
     print(f"💾 正在儲存模型至 {LORA_MODEL_PATH}...")
     model.save_pretrained(LORA_MODEL_PATH)
     tokenizer.save_pretrained(LORA_MODEL_PATH)
+    # 記錄驗證集點樣切出嚟：增量微調要用同一個 seed，舊驗證集先唔會同父模型的訓練數據重疊
+    lineage = {
+        "train_file": None if (shards or on_the_fly) else os.path.abspath(input_file),
+        "split_seed": None if (shards or on_the_fly) else SPLIT_SEED,
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    with open(os.path.join(LORA_MODEL_PATH, "lineage.json"), "w", encoding="utf-8") as f:
+        json.dump(lineage, f, ensure_ascii=False, indent=2)
     print(f"✅ 訓練完成！")
 
 if __name__ == "__main__":
-    train()
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description="LoRA 微調 PII 模型")
+    parser.add_argument("--packing", action="store_true", help="將短句打包成 MAX_SEQ_LENGTH 窗口訓練")
+    parser.add_argument("--no-cache", action="store_true", help="不使用 Tokenized 數據快取")
+    parser.add_argument("--cache-info", action="store_true", help="列出 Tokenized 數據快取後退出")
+    parser.add_argument("--purge-cache", action="store_true", help="清除所有 Tokenized 數據快取後退出")
+    parser.add_argument("--shards", default=None, metavar="MANIFEST",
+                        help="使用分片 JSONL 串流訓練 (prepare_data.py --shards 生成的 manifest.json)")
+    parser.add_argument("--on-the-fly", action="store_true",
+                        help="訓練時即場生成合成數據 (可配合 --shards 混入真實語料)")
+    parser.add_argument("--synthetic-ratio", type=float, default=0.5, help="即場生成模式下合成樣本的比例")
+    parser.add_argument("--num-workers", type=int, default=4, help="即場生成模式的 DataLoader worker 數")
+    parser.add_argument("--async-eval", action="store_true",
+                        help="訓練只存 checkpoint，由另一個進程並行評估 (訓練時間唔再包括評估)")
+    parser.add_argument("--eval-threads", type=int, default=None, help="非同步評估進程的線程數 (預設 CPU 核心數 / 4)")
+    parser.add_argument("--freeze-layers", type=int, default=0, metavar="N",
+                        help="凍結前 N 層 encoder，LoRA 只加喺上面的層")
+    parser.add_argument("--cache-activations", action="store_true",
+                        help="將凍結層的輸出以 fp16 memmap 快取，之後每個 epoch 只跑上層 (需要 --freeze-layers)")
+    parser.add_argument("--warm-start", default=None, metavar="ADAPTER_DIR",
+                        help="由現有 adapter 繼續增量微調 (配合 --delta)，輸出新版本 adapter + 對比報告")
+    parser.add_argument("--delta", default=None, metavar="JSON", help="增量微調的新增數據 (格式同 train_data_lora_cleaned.json)")
+    parser.add_argument("--replay-ratio", type=float, default=1.0, help="replay 舊數據數量 = 新增數據 x 此比例")
+    parser.add_argument("--incremental-epochs", type=int, default=2)
+    parser.add_argument("--hparams", default=None, metavar="JSON",
+                        help="LoRA 超參數 + learning_rate (例如 sweep 輸出的 best_hparams.json)")
+    parser.add_argument("--full-checkpoints", action="store_true",
+                        help="用 Trainer 原本的同步 checkpoint (預設只存 adapter + optimizer，背景寫入)")
+    parser.add_argument("--resume", nargs="?", const=True, default=None, metavar="CHECKPOINT_DIR",
+                        help="由 checkpoint 續訓 (唔指定路徑 = ./lora_out 最新的 checkpoint)")
+    cli_args = parser.parse_args()
+
+    if cli_args.cache_info or cli_args.purge_cache:
+        from src.training.dataset_cache import list_cache, purge_cache
+        if cli_args.purge_cache:
+            print(f"🗑️ 已清除 {purge_cache()} 個快取")
+        else:
+            for entry in list_cache():
+                print(f"🗄️ {entry['key']} | {entry['size_mb']} MB | {entry['input_file']} | seed={entry['seed']}")
+    elif cli_args.warm_start:
+        if not cli_args.delta:
+            parser.error("--warm-start 需要同時提供 --delta")
+        from src.training.incremental import train_incremental
+        train_incremental(
+            cli_args.warm_start, cli_args.delta, replay_ratio=cli_args.replay_ratio,
+            num_train_epochs=cli_args.incremental_epochs
+        )
+    else:
+        train(
+            packing=cli_args.packing, use_cache=not cli_args.no_cache, shards=cli_args.shards,
+            on_the_fly=cli_args.on_the_fly, synthetic_ratio=cli_args.synthetic_ratio,
+            num_workers=cli_args.num_workers, async_eval=cli_args.async_eval,
+            eval_threads=cli_args.eval_threads, freeze_layers=cli_args.freeze_layers,
+            cache_activations=cli_args.cache_activations,
+            hparams=load_hparams(cli_args.hparams) if cli_args.hparams else None,
+            full_checkpoints=cli_args.full_checkpoints, resume=cli_args.resume
+        )
\ No newline at end of file